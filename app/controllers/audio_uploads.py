@@ -0,0 +1,404 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from app.models.repositories.recording import AudioFileTooLargeError
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+
+class UploadStatus:
+    ACTIVE: str = "ACTIVE"
+    FINALIZED: str = "FINALIZED"
+
+
+class UploadNotFoundError(KeyError):
+    pass
+
+
+class UploadConflictError(Exception):
+    """A chunk overlaps a different chunk, or the upload is no longer active"""
+
+
+class ChunkChecksumMismatchError(ValueError):
+    pass
+
+
+class IncompleteUploadError(Exception):
+    def __init__(self, missing_ranges: List[Tuple[int, int]]):
+        self.missing_ranges = missing_ranges
+        super().__init__(f"The upload is missing the byte ranges {missing_ranges}")
+
+
+@dataclass
+class UploadChunk:
+    offset: int
+    size: int
+    sha256: str
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+@dataclass
+class AudioUpload:
+    id: str
+    recording_id: int
+    filename: str
+    total_size: int
+    status: str
+    created_at: float
+    sha256: Optional[str] = None
+    chunks: List[UploadChunk] = field(default_factory=list)
+
+    @property
+    def received_bytes(self) -> int:
+        return sum(chunk.size for chunk in self.chunks)
+
+    def missing_ranges(self) -> List[Tuple[int, int]]:
+        """Byte ranges [start, end) no chunk has been received for, which a resumed upload still has to send"""
+        missing, position = [], 0
+        for chunk in sorted(self.chunks, key=lambda chunk: chunk.offset):
+            if chunk.offset > position:
+                missing.append((position, chunk.offset))
+            position = max(position, chunk.end)
+        if position < self.total_size:
+            missing.append((position, self.total_size))
+        return missing
+
+
+class UploadStore:
+    """SQLite store of the resumable uploads and their received chunks, so that uploads survive a restart"""
+    _COLUMNS = "id, recording_id, filename, total_size, status, created_at, sha256"
+
+    def __init__(self, db_path: str = ":memory:"):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            if db_path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode = WAL")
+                # WAL keeps the database consistent with NORMAL, only the last commits may be lost on a power failure
+                self._connection.execute("PRAGMA synchronous = NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS uploads (id TEXT PRIMARY KEY, "
+                                     "recording_id INTEGER NOT NULL, filename TEXT NOT NULL, "
+                                     "total_size INTEGER NOT NULL, status TEXT NOT NULL, created_at REAL NOT NULL, "
+                                     "sha256 TEXT)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS upload_chunks (upload_id TEXT NOT NULL, "
+                                     "byte_offset INTEGER NOT NULL, size INTEGER NOT NULL, sha256 TEXT NOT NULL, "
+                                     "PRIMARY KEY (upload_id, byte_offset))")
+            self._connection.commit()
+
+    def add(self, upload: AudioUpload):
+        with self._lock:
+            self._connection.execute(f"INSERT INTO uploads ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (upload.id, upload.recording_id, upload.filename, upload.total_size,
+                                      upload.status, upload.created_at, upload.sha256))
+            self._connection.commit()
+
+    def get(self, upload_id: str) -> Optional[AudioUpload]:
+        with self._lock:
+            row = self._connection.execute(f"SELECT {self._COLUMNS} FROM uploads WHERE id = ?",
+                                           (upload_id,)).fetchone()
+            if row is None:
+                return None
+            chunks = self._connection.execute("SELECT byte_offset, size, sha256 FROM upload_chunks "
+                                              "WHERE upload_id = ? ORDER BY byte_offset", (upload_id,)).fetchall()
+        return AudioUpload(*row, chunks=[UploadChunk(*chunk) for chunk in chunks])
+
+    def add_chunk(self, upload_id: str, chunk: UploadChunk):
+        with self._lock:
+            self._connection.execute("INSERT INTO upload_chunks (upload_id, byte_offset, size, sha256) "
+                                     "VALUES (?, ?, ?, ?)",
+                                     (upload_id, chunk.offset, chunk.size, chunk.sha256))
+            self._connection.commit()
+
+    def expired(self, created_before: float) -> List[str]:
+        """Returns the ids of the active uploads created before the given time"""
+        with self._lock:
+            rows = self._connection.execute("SELECT id FROM uploads WHERE status = ? AND created_at < ?",
+                                            (UploadStatus.ACTIVE, created_before)).fetchall()
+        return [row[0] for row in rows]
+
+    def finalize(self, upload_id: str, sha256: str):
+        """Marks the upload as finalized and drops the bookkeeping of its chunks"""
+        with self._lock:
+            self._connection.execute("UPDATE uploads SET status = ?, sha256 = ? WHERE id = ?",
+                                     (UploadStatus.FINALIZED, sha256, upload_id))
+            self._connection.execute("DELETE FROM upload_chunks WHERE upload_id = ?", (upload_id,))
+            self._connection.commit()
+
+    def remove(self, upload_id: str):
+        with self._lock:
+            self._connection.execute("DELETE FROM upload_chunks WHERE upload_id = ?", (upload_id,))
+            self._connection.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+            self._connection.commit()
+
+
+class AudioUploadManager:
+    """
+    Resumable chunked audio uploads: an upload declares its total size, its chunks are written at their byte offset
+    into a preallocated part file, in any order and in parallel, and a finalize step checks that every byte arrived,
+    checksums the file and renames it atomically to its target path. A chunk sent again at the same offset is
+    verified against the checksum of the chunk received before instead of being written again. Uploads abandoned for
+    longer than the upload ttl are expired along with their part files.
+    """
+
+    def __init__(self, store: UploadStore, directory: str, max_audio_bytes: Optional[int] = None,
+                 max_chunk_bytes: int = 8 * 1024 * 1024, upload_ttl_seconds: Optional[float] = 24 * 60 * 60,
+                 sweep_interval_seconds: float = 60 * 60):
+        """
+        :param directory: directory of the part files, on the same file system as the saved audio files
+        :param max_audio_bytes: uploads declaring a larger total size are rejected. None accepts any size
+        :param max_chunk_bytes: chunks above this size are rejected
+        :param upload_ttl_seconds: active uploads created longer ago are expired. None keeps them until aborted
+        :param sweep_interval_seconds: minimum seconds between two sweeps of expire_due
+        """
+        self._store = store
+        self._directory = directory
+        self._max_audio_bytes = max_audio_bytes
+        self.max_chunk_bytes = max_chunk_bytes
+        self._upload_ttl = upload_ttl_seconds
+        self._sweep_interval = sweep_interval_seconds
+        self._last_sweep = time.time()
+        # guards the in-memory state only, the store is called off the event loop without holding it
+        self._lock = threading.Lock()
+        # byte ranges being written per upload, which other chunks must not overlap
+        self._in_flight: Dict[str, List[Tuple[int, int]]] = {}
+        # uploads being finalized, aborted or expired, which take no more chunks, and what is being done to them
+        self._closing: Dict[str, str] = {}
+        self._counters: Dict[str, int] = {"created": 0, "chunks": 0, "duplicate_chunks": 0, "finalized": 0,
+                                          "aborted": 0, "expired": 0, "bytes": 0}
+
+    async def create(self, recording_id: int, filename: str, total_size: int) -> AudioUpload:
+        """
+        :raises AudioFileTooLargeError: if total_size exceeds max_audio_bytes
+        :raises ValueError: if total_size is not positive
+        """
+        if total_size <= 0:
+            raise ValueError("The total size of an upload must be positive")
+        if self._max_audio_bytes is not None and total_size > self._max_audio_bytes:
+            raise AudioFileTooLargeError(self._max_audio_bytes)
+        upload = AudioUpload(uuid.uuid4().hex, recording_id, os.path.basename(filename or "audio"), total_size,
+                             UploadStatus.ACTIVE, time.time())
+        await asyncio.to_thread(self._allocate, self._part_path(upload.id), total_size)
+        await asyncio.to_thread(self._store.add, upload)
+        self._count("created")
+        logger.info("Created upload %s of %d bytes for recording %d", upload.id, total_size, recording_id)
+        return upload
+
+    def get(self, upload_id: str) -> AudioUpload:
+        """:raises UploadNotFoundError: if there is no upload with the id"""
+        upload = self._store.get(upload_id)
+        if upload is None:
+            raise UploadNotFoundError(upload_id)
+        return upload
+
+    async def aget(self, upload_id: str) -> AudioUpload:
+        """:raises UploadNotFoundError: if there is no upload with the id"""
+        return await asyncio.to_thread(self.get, upload_id)
+
+    async def write_chunk(self, upload_id: str, offset: int, data: bytes,
+                          sha256: Optional[str] = None) -> Tuple[AudioUpload, bool]:
+        """
+        Writes the chunk at its byte offset of the upload
+        :param sha256: checksum of the chunk computed by the client. None skips the verification
+        :return: the upload, and whether the chunk was a verified duplicate of a chunk received before
+        :raises UploadNotFoundError: if there is no upload with the id
+        :raises UploadConflictError: if the upload is finalized, or the chunk overlaps another chunk or differs from
+        the chunk received before at its offset
+        :raises ChunkChecksumMismatchError: if the chunk does not match sha256
+        :raises ValueError: if the chunk is empty, too large or outside of the upload
+        """
+        if not data or len(data) > self.max_chunk_bytes:
+            raise ValueError(f"Chunks must hold between 1 and {self.max_chunk_bytes} bytes")
+        chunk = UploadChunk(offset, len(data), await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest()))
+        if sha256 is not None and sha256.lower() != chunk.sha256:
+            raise ChunkChecksumMismatchError(f"The chunk at offset {offset} does not match its checksum")
+        # the reserved byte range keeps overlapping chunks, finalize and abort out until the chunk is stored, so that
+        # the upload read from the store below holds every chunk written before
+        with self._lock:
+            self._check_open(upload_id)
+            if any(start < chunk.end and offset < end for start, end in self._in_flight.get(upload_id, [])):
+                raise UploadConflictError(f"The chunk [{offset}, {chunk.end}) overlaps another chunk")
+            self._in_flight.setdefault(upload_id, []).append((offset, chunk.end))
+        try:
+            upload = await self._aactive(upload_id)
+            if offset < 0 or chunk.end > upload.total_size:
+                raise ValueError(f"The chunk [{offset}, {chunk.end}) is outside of the {upload.total_size} byte upload")
+            received = next((received for received in upload.chunks if received.offset == offset), None)
+            if received is not None:
+                if (received.size, received.sha256) != (chunk.size, chunk.sha256):
+                    raise UploadConflictError(f"The chunk at offset {offset} differs from the chunk received before")
+                self._count("duplicate_chunks")
+                return upload, True
+            if any(received.offset < chunk.end and offset < received.end for received in upload.chunks):
+                raise UploadConflictError(f"The chunk [{offset}, {chunk.end}) overlaps another chunk")
+            await asyncio.to_thread(self._write, self._part_path(upload_id), offset, data)
+            await asyncio.to_thread(self._store.add_chunk, upload_id, chunk)
+        finally:
+            with self._lock:
+                self._in_flight[upload_id].remove((offset, chunk.end))
+                if not self._in_flight[upload_id]:
+                    del self._in_flight[upload_id]
+        with self._lock:
+            self._counters["chunks"] += 1
+            self._counters["bytes"] += chunk.size
+        upload.chunks.append(chunk)
+        return upload, False
+
+    async def finalize(self, upload_id: str, target_path: str, sha256: Optional[str] = None) -> AudioUpload:
+        """
+        Checksums the complete part file and renames it to target_path
+        :param sha256: checksum of the whole file computed by the client. None skips the verification
+        :raises UploadNotFoundError: if there is no upload with the id
+        :raises UploadConflictError: if the upload is finalized or chunks are still being written
+        :raises IncompleteUploadError: if byte ranges of the upload are missing
+        :raises ChunkChecksumMismatchError: if the file does not match sha256. The upload stays active then
+        """
+        with self._lock:
+            self._start_closing(upload_id, "being finalized")
+        try:
+            upload = await self._aactive(upload_id)
+            missing_ranges = upload.missing_ranges()
+            if missing_ranges:
+                raise IncompleteUploadError(missing_ranges)
+            upload.sha256 = await asyncio.to_thread(self._checksum, self._part_path(upload_id))
+            if sha256 is not None and sha256.lower() != upload.sha256:
+                raise ChunkChecksumMismatchError(f"Upload {upload_id} does not match its checksum")
+            await asyncio.to_thread(os.replace, self._part_path(upload_id), target_path)
+            await asyncio.to_thread(self._store.finalize, upload_id, upload.sha256)
+        finally:
+            with self._lock:
+                del self._closing[upload_id]
+        upload.status = UploadStatus.FINALIZED
+        self._count("finalized")
+        logger.info("Finalized upload %s of %d bytes to %s", upload_id, upload.total_size, target_path)
+        return upload
+
+    async def abort(self, upload_id: str):
+        """
+        Drops the active upload and its part file
+        :raises UploadNotFoundError: if there is no upload with the id
+        :raises UploadConflictError: if the upload is finalized, being finalized or chunks are still being written
+        """
+        with self._lock:
+            self._start_closing(upload_id, "being aborted")
+        try:
+            await self._aactive(upload_id)
+            await self._adrop(upload_id)
+        finally:
+            with self._lock:
+                del self._closing[upload_id]
+        self._count("aborted")
+
+    async def expire(self) -> List[AudioUpload]:
+        """
+        Drops the active uploads created longer than the upload ttl ago, and their part files. Uploads with chunks
+        being written are left for the next sweep
+        :return: the expired uploads
+        """
+        with self._lock:
+            self._last_sweep = time.time()
+        if self._upload_ttl is None:
+            return []
+        expired = []
+        for upload_id in await asyncio.to_thread(self._store.expired, time.time() - self._upload_ttl):
+            with self._lock:
+                if upload_id in self._closing or self._in_flight.get(upload_id):
+                    continue
+                self._closing[upload_id] = "being expired"
+            try:
+                # finalized or aborted since it was listed
+                upload = await asyncio.to_thread(self._store.get, upload_id)
+                if upload is not None and upload.status == UploadStatus.ACTIVE:
+                    await self._adrop(upload_id)
+                    expired.append(upload)
+            finally:
+                with self._lock:
+                    del self._closing[upload_id]
+        if expired:
+            with self._lock:
+                self._counters["expired"] += len(expired)
+            logger.info("Expired %d abandoned uploads", len(expired))
+        return expired
+
+    async def expire_due(self) -> List[AudioUpload]:
+        """Expires the abandoned uploads if the last sweep is at least the sweep interval ago, see expire"""
+        with self._lock:
+            if time.time() - self._last_sweep < self._sweep_interval:
+                return []
+        return await self.expire()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def _check_open(self, upload_id: str):
+        """Raises UploadConflictError if the upload is being closed. Must be called holding the lock"""
+        if upload_id in self._closing:
+            raise UploadConflictError(f"Upload {upload_id} is {self._closing[upload_id]}")
+
+    def _start_closing(self, upload_id: str, action: str):
+        """
+        Marks the upload as being closed, so that it takes no more chunks. Must be called holding the lock
+        :raises UploadConflictError: if the upload is being closed already or chunks are still being written
+        """
+        self._check_open(upload_id)
+        if self._in_flight.get(upload_id):
+            raise UploadConflictError(f"Chunks of upload {upload_id} are still being written")
+        self._closing[upload_id] = action
+
+    async def _aactive(self, upload_id: str) -> AudioUpload:
+        """Returns the upload if it is active, or else raises UploadConflictError"""
+        upload = await self.aget(upload_id)
+        if upload.status != UploadStatus.ACTIVE:
+            raise UploadConflictError(f"Upload {upload_id} is {upload.status}")
+        return upload
+
+    async def _adrop(self, upload_id: str):
+        await asyncio.to_thread(self._store.remove, upload_id)
+        part_path = self._part_path(upload_id)
+        await asyncio.to_thread(lambda: os.path.exists(part_path) and os.remove(part_path))
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self._directory, f"{upload_id}.upload.part")
+
+    @staticmethod
+    def _allocate(part_path: str, total_size: int):
+        os.makedirs(os.path.dirname(part_path) or ".", exist_ok=True)
+        with open(part_path, "wb") as part:
+            part.truncate(total_size)
+
+    @staticmethod
+    def _write(part_path: str, offset: int, data: bytes):
+        # every chunk gets a descriptor of its own, so that chunks of one upload can be written in parallel
+        descriptor = os.open(part_path, os.O_WRONLY)
+        try:
+            os.pwrite(descriptor, data, offset)
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+    @staticmethod
+    def _checksum(part_path: str, chunk_bytes: int = 1024 * 1024) -> str:
+        checksum = hashlib.sha256()
+        with open(part_path, "rb") as part:
+            for chunk in iter(lambda: part.read(chunk_bytes), b""):
+                checksum.update(chunk)
+        return checksum.hexdigest()
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, Callable, Dict, List, Deque
+
+from langchain.pydantic_v1 import BaseModel
+
+from app.models.pydantic.sessions import Recording, RecordingStatus
+from app.models.repositories.recording import RecordingRepo
+from pydantic_models.evaluator import Errors, SummaryEvaluations
+from services.evaluators import TextEvaluator, SummaryEvaluator, GrammaticalEvaluator
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+
+class JobStatus:
+    QUEUED: str = "QUEUED"
+    RUNNING: str = "RUNNING"
+    SUCCEEDED: str = "SUCCEEDED"
+    FAILED: str = "FAILED"
+
+
+@dataclass
+class EvaluationJob:
+    id: int
+    recording_id: int
+    status: str
+    attempts: int
+    enqueued_at: float
+    next_attempt_at: float
+    error: Optional[str] = None
+
+
+class JobStore:
+    """SQLite store of the evaluation jobs, so that queued and interrupted jobs survive a restart"""
+    _COLUMNS = "id, recording_id, status, attempts, enqueued_at, next_attempt_at, error"
+
+    def __init__(self, db_path: str = ":memory:"):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                     "recording_id INTEGER NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL, "
+                                     "enqueued_at REAL NOT NULL, next_attempt_at REAL NOT NULL, error TEXT)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+            self._connection.commit()
+
+    def add(self, recording_id: int) -> EvaluationJob:
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.execute("INSERT INTO jobs (recording_id, status, attempts, enqueued_at, "
+                                              "next_attempt_at) VALUES (?, ?, 0, ?, ?)",
+                                              (recording_id, JobStatus.QUEUED, now, now))
+            self._connection.commit()
+        return EvaluationJob(cursor.lastrowid, recording_id, JobStatus.QUEUED, 0, now, now)
+
+    def update(self, job: EvaluationJob):
+        with self._lock:
+            self._connection.execute("UPDATE jobs SET status = ?, attempts = ?, next_attempt_at = ?, error = ? "
+                                     "WHERE id = ?",
+                                     (job.status, job.attempts, job.next_attempt_at, job.error, job.id))
+            self._connection.commit()
+
+    def get(self, job_id: int) -> Optional[EvaluationJob]:
+        with self._lock:
+            row = self._connection.execute(f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return EvaluationJob(*row) if row is not None else None
+
+    def unfinished(self) -> List[EvaluationJob]:
+        """Returns the queued jobs and the jobs that were running when the process stopped"""
+        with self._lock:
+            rows = self._connection.execute(f"SELECT {self._COLUMNS} FROM jobs WHERE status IN (?, ?) ORDER BY id",
+                                            (JobStatus.QUEUED, JobStatus.RUNNING)).fetchall()
+        return [EvaluationJob(*row) for row in rows]
+
+
+async def evaluate_recording(evaluator: TextEvaluator, recording: Recording) -> BaseModel:
+    """
+    Evaluates the transcript of the recording with the evaluator of its recording type
+    :raises ValueError: if the recording has no transcript
+    :raises RuntimeError: if no metric of a summary evaluation could be scored
+    """
+    if recording.transcript is None:
+        raise ValueError(f"No transcript to evaluate for recording with id: {recording.id}")
+    if isinstance(evaluator, SummaryEvaluator):
+        evaluation: SummaryEvaluations = await evaluator.aevaluate(recording.transcript, recording.document_id)
+        if all(item.score is None for item in evaluation.evaluations):
+            raise RuntimeError(f"No metric could be evaluated for recording with id: {recording.id}")
+        return evaluation
+    if isinstance(evaluator, GrammaticalEvaluator):
+        errors_per_sentence = await asyncio.to_thread(evaluator.evaluate_transcript, recording.transcript)
+        return Errors(error=[item for errors in errors_per_sentence for item in errors.error])
+    return await asyncio.to_thread(evaluator.evaluate, recording.transcript)
+
+
+class EvaluationJobQueue:
+    """
+    In-process queue of recording evaluations worked off by a bounded pool of asyncio workers. Workers move the
+    recording from PROCESSING_AUDIO to AUDIO_PROCESSED (or PROCESSING_FAILED once all attempts failed) and retry
+    failed evaluations with exponential backoff.
+    """
+
+    def __init__(self, recording_repo: RecordingRepo, evaluator_provider: Callable[[str], TextEvaluator],
+                 store: JobStore, concurrency: int = 4, max_attempts: int = 3, retry_base_delay: float = 2.0,
+                 latency_window: int = 1000, on_evaluated: Optional[Callable[[Recording, BaseModel], None]] = None):
+        """
+        :param evaluator_provider: returns the evaluator for a recording type
+        :param concurrency: number of workers, i.e. evaluations running at once against the LLM backend
+        :param max_attempts: attempts per job before the recording is marked as PROCESSING_FAILED
+        :param retry_base_delay: seconds before the first retry, doubled on every further retry
+        :param latency_window: number of latest jobs the latency statistics are computed over
+        :param on_evaluated: called off the event loop with the recording and its evaluation once it is stored,
+        e.g. to update analytics. Its failures are logged and do not fail the job
+        """
+        self._recording_repo = recording_repo
+        self._evaluator_provider = evaluator_provider
+        self._on_evaluated = on_evaluated
+        self._store = store
+        self._concurrency = max(1, concurrency)
+        self._max_attempts = max_attempts
+        self._retry_base_delay = retry_base_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._delayed: Dict[int, asyncio.TimerHandle] = {}
+        self._running = 0
+        self._counters: Dict[str, int] = {"enqueued": 0, "succeeded": 0, "failed": 0, "retried": 0}
+        self._wait_seconds: Deque[float] = deque(maxlen=latency_window)
+        self._run_seconds: Deque[float] = deque(maxlen=latency_window)
+
+    async def start(self):
+        """Starts the workers and requeues the jobs that were unfinished when the process stopped"""
+        self._queue = asyncio.Queue()
+        for job in await asyncio.to_thread(self._store.unfinished):
+            job.status = JobStatus.QUEUED
+            await asyncio.to_thread(self._store.update, job)
+            self._schedule(job)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self._concurrency)]
+        logger.info("Started %d evaluation workers", self._concurrency)
+
+    async def stop(self):
+        for handle in self._delayed.values():
+            handle.cancel()
+        self._delayed.clear()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def enqueue(self, recording_id: int) -> EvaluationJob:
+        """
+        Stores a job for the recording. Jobs enqueued before start are picked up by start. Must not be called on
+        the event loop while the queue is running, the job is committed to SQLite, use aenqueue there
+        """
+        return self._enqueued(self._store.add(recording_id))
+
+    async def aenqueue(self, recording_id: int) -> EvaluationJob:
+        """Async counterpart of enqueue, which commits the job off the event loop"""
+        return self._enqueued(await asyncio.to_thread(self._store.add, recording_id))
+
+    def _enqueued(self, job: EvaluationJob) -> EvaluationJob:
+        self._counters["enqueued"] += 1
+        if self._queue is not None:
+            self._schedule(job)
+        return job
+
+    async def join(self):
+        """Waits until all scheduled jobs are finished"""
+        while self._delayed or (self._queue is not None and self._queue.qsize()) or self._running:
+            await asyncio.sleep(0.01)
+
+    def stats(self) -> dict:
+        return dict(self._counters,
+                    queue_depth=(self._queue.qsize() if self._queue is not None else 0) + len(self._delayed),
+                    running=self._running,
+                    workers=len(self._workers),
+                    wait_seconds=_latency_stats(self._wait_seconds),
+                    run_seconds=_latency_stats(self._run_seconds))
+
+    def _schedule(self, job: EvaluationJob):
+        delay = job.next_attempt_at - time.time()
+        if delay <= 0:
+            self._queue.put_nowait(job.id)
+        else:
+            self._delayed[job.id] = asyncio.get_running_loop().call_later(delay, self._release, job.id)
+
+    def _release(self, job_id: int):
+        self._delayed.pop(job_id, None)
+        if self._queue is not None:
+            self._queue.put_nowait(job_id)
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            # counted as running while its job is read, so that join does not see the queue idle in between
+            self._running += 1
+            try:
+                job = await asyncio.to_thread(self._store.get, job_id)
+                if job is not None and job.status == JobStatus.QUEUED:
+                    await self._run(job)
+            except Exception as e:
+                logger.exception("Evaluation worker failed on job %d: %s", job_id, e)
+            finally:
+                self._running -= 1
+
+    async def _run(self, job: EvaluationJob):
+        started = time.time()
+        self._wait_seconds.append(started - job.next_attempt_at)
+        job.status, job.attempts = JobStatus.RUNNING, job.attempts + 1
+        await asyncio.to_thread(self._store.update, job)
+        try:
+            recording: Recording = await asyncio.to_thread(self._recording_repo.get_recording, job.recording_id)
+            evaluator = self._evaluator_provider(recording.type)
+            if evaluator is None:
+                raise ValueError(f"No evaluator available for recording type {recording.type}")
+            evaluation = await evaluate_recording(evaluator, recording)
+            # a job whose evaluation could not be stored is retried like a failed evaluation
+            await asyncio.to_thread(lambda: self._recording_repo.patch_recording_attributes(
+                job.recording_id, evaluation=evaluation, status=RecordingStatus.AUDIO_PROCESSED))
+        except Exception as e:
+            self._run_seconds.append(time.time() - started)
+            await self._handle_failure(job, e)
+            return
+        self._run_seconds.append(time.time() - started)
+        job.status, job.error = JobStatus.SUCCEEDED, None
+        await asyncio.to_thread(self._store.update, job)
+        self._counters["succeeded"] += 1
+        logger.info("Evaluated recording %d in %.2fs", job.recording_id, time.time() - started)
+        if self._on_evaluated is not None:
+            try:
+                await asyncio.to_thread(self._on_evaluated, recording, evaluation)
+            except Exception as e:
+                logger.exception("Handling the evaluation of recording %d failed: %s", job.recording_id, e)
+
+    async def _handle_failure(self, job: EvaluationJob, error: Exception):
+        job.error = str(error)
+        if job.attempts < self._max_attempts:
+            delay = self._retry_base_delay * 2 ** (job.attempts - 1)
+            logger.warning("Evaluation of recording %d failed (attempt %d), retrying in %.1fs: %s",
+                           job.recording_id, job.attempts, delay, error)
+            job.status, job.next_attempt_at = JobStatus.QUEUED, time.time() + delay
+            await asyncio.to_thread(self._store.update, job)
+            self._counters["retried"] += 1
+            self._schedule(job)
+            return
+        logger.error("Evaluation of recording %d failed after %d attempts: %s", job.recording_id, job.attempts,
+                     error)
+        job.status = JobStatus.FAILED
+        await asyncio.to_thread(self._store.update, job)
+        self._counters["failed"] += 1
+        await asyncio.to_thread(lambda: self._recording_repo.patch_recording_attributes(
+            job.recording_id, status=RecordingStatus.PROCESSING_FAILED))
+
+
+def _latency_stats(samples: Deque[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"count": 0, "mean": None, "p50": None, "p95": None}
+    ordered = sorted(samples)
+    return {"count": len(ordered),
+            "mean": sum(ordered) / len(ordered),
+            "p50": ordered[int(0.5 * (len(ordered) - 1))],
+            "p95": ordered[int(0.95 * (len(ordered) - 1))]}
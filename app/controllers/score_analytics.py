@@ -0,0 +1,336 @@
+import logging
+import threading
+import warnings
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain.pydantic_v1 import BaseModel
+
+from app.models.repositories.database import SqliteDatabase
+from app.models.repositories.recording import deserialize_evaluation
+from pydantic_models.evaluator import SummaryEvaluations, Errors, BatchErrors
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (25, 50, 75, 90)
+# error category of ErrorItems without a category
+UNCATEGORIZED = "uncategorized"
+# an evaluated recording: its id, the student and facilitator of its session (None if unknown) and its evaluation
+EvaluatedRecording = Tuple[int, Optional[int], Optional[int], BaseModel]
+
+
+class AnalyticsGroup:
+    STUDENT: str = "student"
+    CLASS: str = "class"  # the students of a facilitator
+
+
+class _Columns:
+    """Growable column store with one row per evaluated recording and one labelled column per metric or category"""
+
+    def __init__(self, labels: Iterable[str], dtype, fill):
+        self.labels: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._dtype, self._fill = dtype, fill
+        self.values = np.full((16, 0), fill, dtype=dtype)
+        for label in labels:
+            self.position(label)
+
+    def position(self, label: str) -> int:
+        """Returns the column of the label, adding the column if it is new"""
+        position = self._positions.get(label)
+        if position is None:
+            position = self._positions[label] = len(self.labels)
+            self.labels.append(label)
+            self.values = np.hstack([self.values, np.full((len(self.values), 1), self._fill, dtype=self._dtype)])
+        return position
+
+    def reserve(self, rows: int):
+        if rows > len(self.values):
+            grown = np.full((max(rows, 2 * len(self.values)), len(self.labels)), self._fill, dtype=self._dtype)
+            grown[:len(self.values)] = self.values
+            self.values = grown
+
+
+class _Aggregate:
+    """Running count, sum and sum of squares of the scores per metric and error counts per category of a group"""
+
+    def __init__(self):
+        self.evaluations = 0
+        self.score_counts = np.zeros(0)
+        self.score_sums = np.zeros(0)
+        self.score_squares = np.zeros(0)
+        self.error_counts = np.zeros(0, dtype=np.int64)
+
+    def apply(self, scores: np.ndarray, errors: np.ndarray, sign: int):
+        """Adds (sign 1) or removes (sign -1) the scores and error counts of one evaluation"""
+        self.score_counts, self.score_sums, self.score_squares = (_padded(array, len(scores)) for array in
+                                                                  (self.score_counts, self.score_sums,
+                                                                   self.score_squares))
+        self.error_counts = _padded(self.error_counts, len(errors))
+        scored = ~np.isnan(scores)
+        values = np.where(scored, scores, 0.0)
+        self.evaluations += sign
+        self.score_counts += sign * scored
+        self.score_sums += sign * values
+        self.score_squares += sign * values ** 2
+        self.error_counts += sign * errors.astype(np.int64)
+
+    def summary(self, metrics: List[str], categories: List[str]) -> dict:
+        counts = _padded(self.score_counts, len(metrics))
+        means = np.divide(_padded(self.score_sums, len(metrics)), counts, out=np.full(len(metrics), np.nan),
+                          where=counts > 0)
+        variances = np.divide(_padded(self.score_squares, len(metrics)), counts, out=np.full(len(metrics), np.nan),
+                              where=counts > 0) - means ** 2
+        stds = np.sqrt(np.maximum(variances, 0.0))
+        errors = _padded(self.error_counts, len(categories))
+        return {"evaluations": self.evaluations,
+                "metrics": {metric: {"count": int(counts[position]), "mean": _number(means[position]),
+                                     "std": _number(stds[position])} for position, metric in enumerate(metrics)},
+                "error_categories": {category: int(errors[position]) for position, category in enumerate(categories)
+                                     if errors[position]}}
+
+
+class ScoreAnalytics:
+    """
+    Scores of the summary evaluations per metric and error counts of the grammatical evaluations per category, held
+    in columnar NumPy arrays with one row per evaluated recording. Aggregates, percentiles and rolling trends of any
+    student or class are computed over the arrays in vectorized form. The count, mean and deviation of every student
+    and class are materialized: each new evaluation updates them in O(metrics), so dashboards never rescan the
+    evaluations. An evaluation landing again for a recording, e.g. a re-evaluation, replaces its previous one.
+    """
+
+    def __init__(self, metrics: Iterable[str] = (), rolling_window: int = 5):
+        """
+        :param metrics: metrics whose columns come first. Metrics of later evaluations get columns as they appear
+        :param rolling_window: evaluations the rolling means of the trends are taken over
+        """
+        self._rolling_window = max(1, rolling_window)
+        self._lock = threading.Lock()
+        self._loaded = False
+        # set while the stored evaluations are loaded: the evaluations added meanwhile, which the load replays
+        self._added_while_loading: Optional[List[Tuple[int, int, int, BaseModel]]] = None
+        self._load_finished: Optional[threading.Event] = None
+        self._size = 0
+        self._rows: Dict[int, int] = {}  # row of every recording id
+        self._recording_ids = np.zeros(16, dtype=np.int64)
+        self._student_ids = np.full(16, -1, dtype=np.int64)  # -1 if unknown
+        self._facilitator_ids = np.full(16, -1, dtype=np.int64)
+        self._scores = _Columns(metrics, np.float32, np.nan)
+        self._errors = _Columns((), np.int32, 0)
+        self._aggregates: Dict[Tuple[str, int], _Aggregate] = {}
+
+    def add(self, recording_id: int, student_id: Optional[int], facilitator_id: Optional[int],
+            evaluation: BaseModel) -> bool:
+        """
+        Adds the evaluation of the recording and updates the materialized aggregates of its student and class
+        :return: whether the evaluation holds scores or errors, other evaluations are ignored
+        """
+        if not isinstance(evaluation, (SummaryEvaluations, Errors, BatchErrors)):
+            return False
+        student_id = -1 if student_id is None else student_id
+        facilitator_id = -1 if facilitator_id is None else facilitator_id
+        with self._lock:
+            self._add(recording_id, student_id, facilitator_id, evaluation)
+            if self._added_while_loading is not None:
+                self._added_while_loading.append((recording_id, student_id, facilitator_id, evaluation))
+        return True
+
+    def load(self, evaluated_recordings: Iterable[EvaluatedRecording]) -> int:
+        """
+        Adds the stored evaluations once, later calls wait for the first one and are ignored. The stored evaluations
+        are added to arrays of their own without holding the lock, so that analytics requests and new evaluations
+        are not blocked by the scan; the arrays are swapped in at the end with the evaluations added meanwhile
+        replayed on top, as they are newer than the stored ones
+        :return: the number of stored evaluations added
+        """
+        with self._lock:
+            already_loaded, load_finished = self._loaded, self._load_finished
+            if not already_loaded and load_finished is None:
+                self._added_while_loading = []
+                self._load_finished = threading.Event()
+            metrics = list(self._scores.labels)
+        if already_loaded or load_finished is not None:
+            if load_finished is not None:
+                load_finished.wait()
+            return 0
+        loaded = ScoreAnalytics(metrics, self._rolling_window)
+        try:
+            added = sum(loaded.add(*evaluated_recording) for evaluated_recording in evaluated_recordings)
+            with self._lock:
+                for added_meanwhile in self._added_while_loading:
+                    loaded._add(*added_meanwhile)
+                self._size, self._rows = loaded._size, loaded._rows
+                self._recording_ids, self._student_ids = loaded._recording_ids, loaded._student_ids
+                self._facilitator_ids = loaded._facilitator_ids
+                self._scores, self._errors, self._aggregates = loaded._scores, loaded._errors, loaded._aggregates
+                self._loaded = True
+        finally:
+            with self._lock:
+                self._added_while_loading, load_finished, self._load_finished = None, self._load_finished, None
+            load_finished.set()
+        logger.info("Loaded %d evaluations into the score analytics", added)
+        return added
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def scores(self, student_id: Optional[int] = None, facilitator_id: Optional[int] = None,
+               rolling_window: Optional[int] = None) -> dict:
+        """
+        Aggregates, percentiles, the linear trend (score change per evaluation) and rolling means per metric and the
+        error counts per category of the evaluations of the student and/or class, all evaluations without either.
+        Evaluations are ordered by recording id
+        """
+        window = max(1, rolling_window or self._rolling_window)
+        with self._lock:
+            size = self._size
+            selected = np.ones(size, dtype=bool)
+            if student_id is not None:
+                selected &= self._student_ids[:size] == student_id
+            if facilitator_id is not None:
+                selected &= self._facilitator_ids[:size] == facilitator_id
+            order = np.argsort(self._recording_ids[:size][selected], kind="stable")
+            recording_ids = self._recording_ids[:size][selected][order]
+            scores = self._scores.values[:size][selected][order].astype(np.float64)
+            errors = self._errors.values[:size][selected].sum(axis=0)
+            metrics, categories = list(self._scores.labels), list(self._errors.labels)
+        scored = ~np.isnan(scores)
+        counts = scored.sum(axis=0)
+        # an empty selection is reduced as one row without scores
+        reduced = scores if len(scores) else np.full((1, len(metrics)), np.nan)
+        with warnings.catch_warnings():
+            # metrics without any score of the selection are reported as None
+            warnings.simplefilter("ignore", RuntimeWarning)
+            means, stds = np.nanmean(reduced, axis=0), np.nanstd(reduced, axis=0)
+            minima, maxima = np.nanmin(reduced, axis=0), np.nanmax(reduced, axis=0)
+            percentiles = np.nanpercentile(reduced, PERCENTILES, axis=0)
+        slopes = _slopes(scores, scored)
+        rolling_means = _rolling_means(scores, scored, window)
+        return {"evaluations": len(recording_ids),
+                "recording_ids": recording_ids.tolist(),
+                "rolling_window": window,
+                "metrics": {metric: {"count": int(counts[position]), "mean": _number(means[position]),
+                                     "std": _number(stds[position]), "min": _number(minima[position]),
+                                     "max": _number(maxima[position]),
+                                     "percentiles": {f"p{percentile}": _number(percentiles[index, position])
+                                                     for index, percentile in enumerate(PERCENTILES)},
+                                     "trend": _number(slopes[position]),
+                                     "rolling_means": [_number(mean) for mean in rolling_means[:, position]]}
+                            for position, metric in enumerate(metrics)},
+                "error_categories": {category: int(errors[position]) for position, category in enumerate(categories)
+                                     if errors[position]}}
+
+    def aggregates(self, group: str) -> Dict[int, dict]:
+        """
+        Returns the materialized aggregates of every student or class, keyed by student or facilitator id
+        :raises ValueError: if group is not one of AnalyticsGroup
+        """
+        if group not in (AnalyticsGroup.STUDENT, AnalyticsGroup.CLASS):
+            raise ValueError(f"Unknown analytics group {group}")
+        with self._lock:
+            metrics, categories = list(self._scores.labels), list(self._errors.labels)
+            return {group_id: aggregate.summary(metrics, categories)
+                    for (aggregate_group, group_id), aggregate in sorted(self._aggregates.items())
+                    if aggregate_group == group and aggregate.evaluations}
+
+    def _add(self, recording_id: int, student_id: int, facilitator_id: int, evaluation: BaseModel):
+        """Must be called holding the lock"""
+        row = self._rows.get(recording_id)
+        if row is not None:
+            # the previous evaluation of the recording is replaced
+            self._apply(row, -1)
+        else:
+            row = self._rows[recording_id] = self._size
+            self._size += 1
+            self._reserve(self._size)
+        self._recording_ids[row] = recording_id
+        self._student_ids[row], self._facilitator_ids[row] = student_id, facilitator_id
+        if isinstance(evaluation, SummaryEvaluations):
+            positions = [self._scores.position(item.metric) for item in evaluation.evaluations
+                         if getattr(item, "metric", None) is not None]
+            self._scores.values[row] = np.nan
+            self._scores.values[row, positions] = [np.nan if getattr(item, "score", None) is None else item.score
+                                                   for item in evaluation.evaluations
+                                                   if getattr(item, "metric", None) is not None]
+            self._errors.values[row] = 0
+        else:
+            positions = [self._errors.position(item.category or UNCATEGORIZED) for item in evaluation.error]
+            self._scores.values[row] = np.nan
+            self._errors.values[row] = 0
+            np.add.at(self._errors.values[row], positions, 1)
+        self._apply(row, 1)
+
+    def _apply(self, row: int, sign: int):
+        scores, errors = self._scores.values[row].astype(np.float64), self._errors.values[row]
+        for key in ((AnalyticsGroup.STUDENT, int(self._student_ids[row])),
+                    (AnalyticsGroup.CLASS, int(self._facilitator_ids[row]))):
+            if key[1] == -1:
+                continue
+            aggregate = self._aggregates.get(key)
+            if aggregate is None:
+                aggregate = self._aggregates[key] = _Aggregate()
+            aggregate.apply(scores, errors, sign)
+
+    def _reserve(self, rows: int):
+        if rows > len(self._recording_ids):
+            capacity = max(rows, 2 * len(self._recording_ids))
+            self._recording_ids = _padded(self._recording_ids, capacity)
+            self._student_ids = _padded(self._student_ids, capacity, -1)
+            self._facilitator_ids = _padded(self._facilitator_ids, capacity, -1)
+        self._scores.reserve(rows)
+        self._errors.reserve(rows)
+
+
+def _padded(array: np.ndarray, length: int, fill=0) -> np.ndarray:
+    if len(array) >= length:
+        return array
+    return np.concatenate([array, np.full(length - len(array), fill, dtype=array.dtype)])
+
+
+def _slopes(scores: np.ndarray, scored: np.ndarray) -> np.ndarray:
+    """Least squares slope of every score column against the position of its evaluation, ignoring missing scores"""
+    positions = np.broadcast_to(np.arange(len(scores), dtype=np.float64)[:, np.newaxis], scores.shape)
+    counts = scored.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_positions = np.where(scored, positions, 0.0).sum(axis=0) / counts
+        mean_scores = np.where(scored, scores, 0.0).sum(axis=0) / counts
+        centered = np.where(scored, positions - mean_positions, 0.0)
+        covariances = (centered * np.where(scored, scores - mean_scores, 0.0)).sum(axis=0)
+        variances = (centered ** 2).sum(axis=0)
+        return np.where(variances > 0, covariances / variances, np.nan)
+
+
+def _rolling_means(scores: np.ndarray, scored: np.ndarray, window: int) -> np.ndarray:
+    """Mean of the scores of the latest window evaluations up to every evaluation, ignoring missing scores"""
+    sums = np.vstack([np.zeros((1, scores.shape[1])), np.cumsum(np.where(scored, scores, 0.0), axis=0)])
+    counts = np.vstack([np.zeros((1, scores.shape[1])), np.cumsum(scored, axis=0)])
+    ends = np.arange(1, len(scores) + 1)
+    starts = np.maximum(ends - window, 0)
+    window_counts = counts[ends] - counts[starts]
+    return np.divide(sums[ends] - sums[starts], window_counts, out=np.full(window_counts.shape, np.nan),
+                     where=window_counts > 0)
+
+
+def _number(value) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 4)
+
+
+def stored_evaluations(database: SqliteDatabase, batch_size: int = 500) -> Iterator[EvaluatedRecording]:
+    """
+    Yields the stored evaluations with the student and facilitator of their session in batches of recording ids,
+    so that no connection is held while the evaluations are added
+    """
+    after = -1
+    while True:
+        rows = database.read(lambda connection: connection.execute(
+            "SELECT recordings.id, sessions.student_id, sessions.facilitator_id, recordings.evaluation_type, "
+            "recordings.evaluation FROM recordings LEFT JOIN sessions ON sessions.id = recordings.session_id "
+            "WHERE recordings.id > ? AND recordings.evaluation IS NOT NULL ORDER BY recordings.id LIMIT ?",
+            (after, batch_size)).fetchall())
+        for recording_id, student_id, facilitator_id, evaluation_type, payload in rows:
+            yield recording_id, student_id, facilitator_id, deserialize_evaluation(evaluation_type, payload)
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][0]
@@ -0,0 +1,10 @@
+from typing import Optional
+from pydantic import BaseModel
+
+
+class SourceDocument(BaseModel):
+    id: Optional[str] = None
+    text: Optional[str] = None
+    token_count: Optional[int] = None
+    digest: Optional[str] = None
+    digest_token_count: Optional[int] = None
@@ -8,12 +8,13 @@ class RecordingType:
     PRESENTATION: str = "PRESENTATION"
 
 
-class RecordingStatus(BaseModel):
+class RecordingStatus:
     AUDIO_PROCESSED: str = "AUDIO_PROCESSED"
     AUDIO_SAVED: str = "AUDIO_SAVED"
     SAVING_AUDIO: str = "SAVING_AUDIO"
     NO_AUDIO_SAVED: str = "NO_AUDIO_SAVED"
     PROCESSING_AUDIO: str = "PROCESSING_AUDIO"
+    PROCESSING_FAILED: str = "PROCESSING_FAILED"
 
 
 class Recording(BaseModel):
@@ -23,7 +24,11 @@ class Recording(BaseModel):
     start: Optional[str] = None
     end: Optional[str] = None
     audio_file_path: Optional[str] = None
-    status: Optional[RecordingStatus] = None
+    audio_size: Optional[int] = None  # bytes of the saved audio file
+    audio_sha256: Optional[str] = None  # checksum of the saved audio file
+    transcript: Optional[str] = None
+    document_id: Optional[str] = None  # source document of a COMPREHENSION recording
+    status: Optional[str] = None
     evaluation: Optional[BaseModel] = None
 
 
@@ -0,0 +1,23 @@
+from typing import Optional, List
+from pydantic import BaseModel
+
+
+class AudioUploadRequest(BaseModel):
+    filename: Optional[str] = None
+    total_size: Optional[int] = None  # bytes of the whole audio file
+
+
+class AudioUploadFinalization(BaseModel):
+    sha256: Optional[str] = None  # checksum of the whole audio file, verified if given
+
+
+class AudioUploadState(BaseModel):
+    id: Optional[str] = None
+    recording_id: Optional[int] = None
+    filename: Optional[str] = None
+    total_size: Optional[int] = None
+    received_bytes: Optional[int] = None
+    missing_ranges: Optional[List[List[int]]] = None  # byte ranges [start, end) that still have to be sent
+    status: Optional[str] = None
+    sha256: Optional[str] = None
+    duplicate_chunk: Optional[bool] = None  # the last chunk was a verified duplicate of a chunk received before
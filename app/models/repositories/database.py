@@ -0,0 +1,176 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+# a write of a batch: runs in the transaction of the batch and returns the result of the write
+Write = Callable[[sqlite3.Connection], Any]
+
+
+class SqliteDatabase:
+    """
+    SQLite database in WAL mode shared by the repositories. Reads take a connection of a pool, so that concurrent
+    readers neither block each other nor the writer. Writes are group committed: a writer thread with a connection of
+    its own, which polling readers cannot starve, applies all writes
+    pending at that moment in one transaction, so that concurrent status patches share a single commit (and fsync).
+    Every write runs in a savepoint of its own, a failing write does not roll back the others of its batch.
+    """
+
+    def __init__(self, db_path: str = ":memory:", pool_size: int = 4, max_batch_size: int = 256,
+                 busy_timeout_ms: int = 5000):
+        """
+        :param db_path: path of the database file. ":memory:" keeps a private database in memory, which is served by
+        a single connection shared by the readers and the writer
+        :param pool_size: connections of the pool of the readers
+        :param max_batch_size: most writes committed in one transaction
+        :param busy_timeout_ms: how long a connection waits for a lock held by another process
+        """
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db_path = db_path
+        self._max_batch_size = max(1, max_batch_size)
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(1 if db_path == ":memory:" else max(1, pool_size)):
+            self._pool.put(self._connect(busy_timeout_ms))
+        self._writer_connection: Optional[sqlite3.Connection] = \
+            None if db_path == ":memory:" else self._connect(busy_timeout_ms)
+        self._writes: "queue.Queue[Tuple[Write, Future]]" = queue.Queue()
+        self._counters_lock = threading.Lock()
+        self._counters: Dict[str, float] = {"reads": 0, "writes": 0, "failed_writes": 0, "batches": 0,
+                                            "commit_seconds": 0.0}
+        self._writer = threading.Thread(target=self._write_batches, name="sqlite-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self, busy_timeout_ms: int) -> sqlite3.Connection:
+        # transactions are begun explicitly, see _commit_batch
+        connection = sqlite3.connect(self._db_path, check_same_thread=False, isolation_level=None)
+        connection.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        if self._db_path != ":memory:":
+            connection.execute("PRAGMA journal_mode = WAL")
+            # WAL keeps the database consistent with NORMAL, only the last commits may be lost on a power failure
+            connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Lends a connection of the pool, blocking while all of them are in use"""
+        connection = self._pool.get()
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    @contextmanager
+    def _write_connection(self) -> Iterator[sqlite3.Connection]:
+        if self._writer_connection is not None:
+            yield self._writer_connection
+        else:
+            with self.connection() as connection:
+                yield connection
+
+    def read(self, query: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Runs the query on a pooled connection and returns its result"""
+        with self.connection() as connection:
+            result = query(connection)
+        with self._counters_lock:
+            self._counters["reads"] += 1
+        return result
+
+    def submit(self, write: Write) -> Future:
+        """Queues the write for the next batch. The future resolves to its result once the batch is committed"""
+        future: Future = Future()
+        self._writes.put((write, future))
+        return future
+
+    def write(self, write: Write) -> Any:
+        """Applies the write and returns its result once it is committed"""
+        return self.submit(write).result()
+
+    def execute_script(self, script: str):
+        """Runs a script of statements in a batch of its own, e.g. to create the schema"""
+        statements = [statement for statement in script.split(";") if statement.strip()]
+        self.write(lambda connection: [connection.execute(statement) for statement in statements])
+
+    def stats(self) -> dict:
+        with self._counters_lock:
+            batches = self._counters["batches"]
+            return dict(self._counters,
+                        mean_batch_size=self._counters["writes"] / batches if batches else None,
+                        pending_writes=self._writes.qsize())
+
+    def _write_batches(self):
+        while True:
+            batch: List[Tuple[Write, Future]] = [self._writes.get()]
+            while len(batch) < self._max_batch_size:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit_batch(batch)
+            except Exception as e:
+                logger.exception("Committing a batch of %d writes failed: %s", len(batch), e)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _commit_batch(self, batch: List[Tuple[Write, Future]]):
+        started = time.perf_counter()
+        results: List[Tuple[Future, Any, Optional[BaseException]]] = []
+        with self._write_connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for write, future in batch:
+                    connection.execute("SAVEPOINT batched_write")
+                    try:
+                        results.append((future, write(connection), None))
+                        connection.execute("RELEASE batched_write")
+                    except Exception as e:
+                        connection.execute("ROLLBACK TO batched_write")
+                        connection.execute("RELEASE batched_write")
+                        results.append((future, None, e))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        with self._counters_lock:
+            self._counters["batches"] += 1
+            self._counters["writes"] += len(batch)
+            self._counters["failed_writes"] += sum(error is not None for _, _, error in results)
+            self._counters["commit_seconds"] += time.perf_counter() - started
+        # futures are resolved after the commit, so that callers never see uncommitted results
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+# databases shared by the repositories of the process, keyed by their path
+_databases: Dict[str, SqliteDatabase] = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(storage_params: dict) -> SqliteDatabase:
+    """
+    Returns the process-wide database of the storage config section, created on first use
+    :param storage_params: storage section of the config
+    """
+    db_path = storage_params.get('DB_PATH') or ":memory:"
+    with _databases_lock:
+        database = _databases.get(db_path)
+        if database is None:
+            database = SqliteDatabase(db_path, pool_size=storage_params.get('POOL_SIZE', 4),
+                                      max_batch_size=storage_params.get('MAX_BATCH_SIZE', 256))
+            _databases[db_path] = database
+            logger.info("Opened database %s with %s", db_path, storage_params)
+    return database
@@ -1,54 +1,292 @@
+import asyncio
+import hashlib
+import logging
 import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
 from fastapi import UploadFile
+from langchain.pydantic_v1 import BaseModel
 from app.models.pydantic.sessions import Recording
+from app.models.repositories.database import SqliteDatabase
+from pydantic_models.evaluator import SummaryEvaluations, Errors, BatchErrors
 
 # Directory to save uploaded files
 UPLOAD_DIRECTORY = "uploads/"
 
+# init module logger
+logger = logging.getLogger(__name__)
+
+
+class AudioFileTooLargeError(Exception):
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        super().__init__(f"The audio file exceeds the maximum size of {max_bytes} bytes")
+
+
+class RecordingNotFoundError(KeyError):
+    pass
+
+
+# evaluation models a recording can hold, stored by their name
+EVALUATION_TYPES = {model.__name__: model for model in (SummaryEvaluations, Errors, BatchErrors)}
+
+# attributes of a recording stored in columns of their own. The evaluation is stored as evaluation_type and evaluation
+_COLUMNS = ("session_id", "type", "start", "end", "audio_file_path", "audio_size", "audio_sha256", "transcript",
+            "document_id", "status")
+_SELECT = f"SELECT id, {', '.join(f'[{column}]' for column in _COLUMNS)}, evaluation_type, evaluation FROM recordings"
+# attributes a listing of recordings can be projected on, the id is always included
+RECORDING_FIELDS = ("id",) + _COLUMNS + ("evaluation",)
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS recordings (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id INTEGER, type TEXT,
+    start TEXT, [end] TEXT, audio_file_path TEXT, audio_size INTEGER, audio_sha256 TEXT, transcript TEXT,
+    document_id TEXT, status TEXT, evaluation_type TEXT, evaluation BLOB);
+CREATE INDEX IF NOT EXISTS recordings_session_id ON recordings (session_id);
+CREATE INDEX IF NOT EXISTS recordings_status ON recordings (status);
+CREATE INDEX IF NOT EXISTS recordings_type ON recordings (type);
+"""
+
+
+def serialize_evaluation(evaluation: Optional[BaseModel]) -> Tuple[Optional[str], Optional[bytes]]:
+    """
+    Compact form of an evaluation: its model name and its zlib compressed JSON without whitespace and default values,
+    which the repeated metric names, reasons and corrections of an evaluation compress well
+    :raises ValueError: if the evaluation is not one of EVALUATION_TYPES
+    """
+    if evaluation is None:
+        return None, None
+    evaluation_type = type(evaluation).__name__
+    if EVALUATION_TYPES.get(evaluation_type) is not type(evaluation):
+        raise ValueError(f"Cannot store evaluations of type {evaluation_type}")
+    payload = evaluation.json(exclude_defaults=True, ensure_ascii=False, separators=(",", ":"))
+    return evaluation_type, zlib.compress(payload.encode("utf-8"))
+
+
+def deserialize_evaluation(evaluation_type: Optional[str], payload: Optional[bytes]) -> Optional[BaseModel]:
+    if evaluation_type is None or payload is None:
+        return None
+    return EVALUATION_TYPES[evaluation_type].parse_raw(zlib.decompress(payload))
+
+
+@dataclass
+class RecordingPage:
+    recordings: List[Recording]
+    next_cursor: Optional[int]  # id after which the next page starts, None on the last page
+    etag: str  # digest of the stored rows of the page and the projection
+
+
+def _recording(row: Optional[tuple], recording_id: int, columns: Tuple[str, ...] = _COLUMNS,
+               with_evaluation: bool = True) -> Recording:
+    if row is None:
+        raise RecordingNotFoundError(recording_id)
+    recording = Recording(id=row[0], **dict(zip(columns, row[1:1 + len(columns)])))
+    if with_evaluation:
+        # assigned after validation, the evaluation models are pydantic v1 models
+        recording.evaluation = deserialize_evaluation(*row[-2:])
+    return recording
+
 
 class RecordingRepo:
 
-    def __init__(self):
+    def __init__(self, max_audio_bytes: Optional[int] = None, chunk_bytes: int = 1024 * 1024,
+                 database: Optional[SqliteDatabase] = None):
+        """
+        :param max_audio_bytes: audio files above this size are rejected. None accepts any size
+        :param chunk_bytes: size of the chunks audio files are copied in
+        :param database: database the recordings are stored in. None stores them in a private in-memory database
+        """
+        self._max_audio_bytes: Optional[int] = max_audio_bytes
+        self._chunk_bytes: int = chunk_bytes
+        self._upload_lock = threading.Lock()
+        self._upload_counters: Dict[str, float] = {"files": 0, "rejected_files": 0, "bytes": 0, "seconds": 0.0}
+        self._database = database if database is not None else SqliteDatabase()
+        self._database.execute_script(_SCHEMA)
         # Ensure the directory exists
         os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 
     def get_recording(self, recording_id: int) -> Recording:
-        """
-        TODO implement
-        :param recording_id:
-        :return:
-        """
-        return Recording()
+        """:raises RecordingNotFoundError: if there is no recording with the id"""
+        row = self._database.read(lambda connection: connection.execute(f"{_SELECT} WHERE id = ?",
+                                                                        (recording_id,)).fetchone())
+        return _recording(row, recording_id)
 
     def update_recording(self, recording: Recording) -> Recording:
         """
-        TODO implement
-        :param recording:
-        :return:
+        Replaces all attributes of the stored recording with those of the recording
+        :raises RecordingNotFoundError: if there is no recording with its id
         """
-        return Recording()
+        attributes = {column: getattr(recording, column) for column in _COLUMNS}
+        return self.patch_recording_attributes(recording.id, evaluation=recording.evaluation, **attributes)
 
     def patch_recording_attributes(self, recording_id: int, **attributes) -> Recording:
         """
-         TODO implement
-         :param recording_id:
-         :return:
-         """
-        for attr, value in attributes.items():
-            pass
-        return self.get_recording(recording_id)
+        Sets the given attributes of the recording. Patches of concurrent callers are committed in one transaction
+        :return: the patched recording
+        :raises RecordingNotFoundError: if there is no recording with the id
+        :raises ValueError: if an attribute is not one of Recording
+        """
+        assignments = self._assignments(attributes)
+
+        def patch(connection: sqlite3.Connection) -> Recording:
+            if assignments:
+                connection.execute(f"UPDATE recordings SET {', '.join(f'[{column}] = ?' for column in assignments)} "
+                                   f"WHERE id = ?", (*assignments.values(), recording_id))
+            return _recording(connection.execute(f"{_SELECT} WHERE id = ?", (recording_id,)).fetchone(),
+                              recording_id)
+
+        return self._database.write(patch)
 
     def create_recording(self, recording: Recording) -> Recording:
+        """Stores the recording under a new id and returns it with the id set"""
+        assignments = self._assignments({column: getattr(recording, column) for column in _COLUMNS})
+        assignments.update(self._assignments({"evaluation": recording.evaluation}))
+
+        def create(connection: sqlite3.Connection) -> int:
+            return connection.execute(f"INSERT INTO recordings ({', '.join(f'[{column}]' for column in assignments)}) "
+                                      f"VALUES ({', '.join('?' for _ in assignments)})",
+                                      tuple(assignments.values())).lastrowid
+
+        recording.id = self._database.write(create)
+        return recording
+
+    def list_session_recordings(self, session_id: int, after: Optional[int] = None, limit: int = 50,
+                                fields: Optional[Iterable[str]] = None) -> RecordingPage:
         """
-        TODO implement
-        :param recording:
-        :return:
+        Returns a page of the recordings of the session ordered by id. Pages are found by keyset (the index on
+        session_id holds the ids), so a page costs the same however deep it is, and concurrent inserts do not shift
+        pages the way offsets would
+        :param after: id of the last recording of the previous page. None starts with the first recording
+        :param limit: most recordings of the page
+        :param fields: attributes of the recordings to load, all but the evaluation by default. Columns not loaded,
+        e.g. the evaluation payloads, are left None
+        :raises ValueError: if a field is not one of RECORDING_FIELDS
         """
-        return Recording()
+        fields = set(fields) if fields is not None else set(RECORDING_FIELDS) - {"evaluation"}
+        unknown = fields - set(RECORDING_FIELDS)
+        if unknown:
+            raise ValueError(f"Recording has no attributes {sorted(unknown)}")
+        columns = tuple(column for column in _COLUMNS if column in fields)
+        with_evaluation = "evaluation" in fields
+        selected = ["id"] + [f"[{column}]" for column in columns] + \
+            (["evaluation_type", "evaluation"] if with_evaluation else [])
+        rows = self._database.read(lambda connection: connection.execute(
+            f"SELECT {', '.join(selected)} FROM recordings WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (session_id, after if after is not None else -1, limit + 1)).fetchall())
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        rows = rows[:limit]
+        etag = hashlib.blake2b(repr((selected, rows, next_cursor)).encode("utf-8"), digest_size=16).hexdigest()
+        return RecordingPage([_recording(row, row[0], columns, with_evaluation) for row in rows], next_cursor, etag)
+
+    async def aget_recording(self, recording_id: int) -> Recording:
+        return await asyncio.to_thread(self.get_recording, recording_id)
+
+    async def apatch_recording_attributes(self, recording_id: int, **attributes) -> Recording:
+        return await asyncio.to_thread(lambda: self.patch_recording_attributes(recording_id, **attributes))
+
+    async def acreate_recording(self, recording: Recording) -> Recording:
+        return await asyncio.to_thread(self.create_recording, recording)
+
+    async def alist_session_recordings(self, session_id: int, after: Optional[int] = None, limit: int = 50,
+                                       fields: Optional[Iterable[str]] = None) -> RecordingPage:
+        return await asyncio.to_thread(self.list_session_recordings, session_id, after, limit, fields)
+
+    def storage_stats(self) -> dict:
+        """Reads, writes and the mean number of writes per commit of the database"""
+        return self._database.stats()
+
+    @staticmethod
+    def _assignments(attributes: dict) -> dict:
+        """Maps the attributes to the values of their columns"""
+        assignments = {}
+        for attribute, value in attributes.items():
+            if attribute == "evaluation":
+                assignments["evaluation_type"], assignments["evaluation"] = serialize_evaluation(value)
+            elif attribute in _COLUMNS:
+                assignments[attribute] = value
+            else:
+                raise ValueError(f"Recording has no attribute {attribute}")
+        return assignments
 
     async def save_audio_file(self, file: UploadFile, recording: Recording) -> Recording:
-        file_path = f"{UPLOAD_DIRECTORY}/{recording.session_id}_{recording.id}_{file.filename}"
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
+        """
+        Streams the uploaded audio file to disk in fixed-size chunks, so the file is never held in memory as a whole
+        and the event loop is not blocked by disk writes. The file is written to a temporary file next to its target,
+        checksummed while it is copied and only renamed to its target path once it is complete.
+        :raises AudioFileTooLargeError: if the file exceeds max_audio_bytes. Nothing is saved then
+        :return: the recording with audio_file_path, audio_size and audio_sha256 set
+        """
+        file_path = self.audio_file_path(recording, file.filename)
+        temp_path = f"{file_path}.{uuid.uuid4().hex}.part"
+        checksum = hashlib.sha256()
+        size = 0
+        started = time.perf_counter()
+        buffer: BinaryIO = await asyncio.to_thread(open, temp_path, "wb")
+        try:
+            while True:
+                chunk = await file.read(self._chunk_bytes)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if self._max_audio_bytes is not None and size > self._max_audio_bytes:
+                    raise AudioFileTooLargeError(self._max_audio_bytes)
+                await asyncio.to_thread(_write_chunk, buffer, checksum, chunk)
+            await asyncio.to_thread(_close_synced, buffer)
+            await asyncio.to_thread(os.replace, temp_path, file_path)
+        except BaseException as e:
+            await asyncio.to_thread(_discard, buffer, temp_path)
+            if isinstance(e, AudioFileTooLargeError):
+                self._record_upload(0, 0.0, rejected=True)
+            raise
+        seconds = time.perf_counter() - started
+        self._record_upload(size, seconds)
+        logger.info("Saved %d bytes of audio to %s in %.3fs (%.1f MB/s)", size, file_path, seconds,
+                    size / seconds / 1e6 if seconds else 0.0)
         recording.audio_file_path = file_path
+        recording.audio_size = size
+        recording.audio_sha256 = checksum.hexdigest()
         return recording
+
+    @staticmethod
+    def audio_file_path(recording: Recording, filename: Optional[str]) -> str:
+        """Returns the path the audio file of the recording is saved at"""
+        return os.path.join(UPLOAD_DIRECTORY,
+                            f"{recording.session_id}_{recording.id}_{os.path.basename(filename or 'audio')}")
+
+    def audio_upload_stats(self) -> dict:
+        """Returns the number of saved and rejected audio files, their bytes and the mean throughput"""
+        with self._upload_lock:
+            seconds = self._upload_counters["seconds"]
+            return dict(self._upload_counters,
+                        throughput_bytes_per_second=self._upload_counters["bytes"] / seconds if seconds else None)
+
+    def _record_upload(self, size: int, seconds: float, rejected: bool = False):
+        with self._upload_lock:
+            if rejected:
+                self._upload_counters["rejected_files"] += 1
+                return
+            self._upload_counters["files"] += 1
+            self._upload_counters["bytes"] += size
+            self._upload_counters["seconds"] += seconds
+
+
+def _write_chunk(buffer: BinaryIO, checksum, chunk: bytes):
+    checksum.update(chunk)
+    buffer.write(chunk)
+
+
+def _close_synced(buffer: BinaryIO):
+    buffer.flush()
+    os.fsync(buffer.fileno())
+    buffer.close()
+
+
+def _discard(buffer: BinaryIO, temp_path: str):
+    buffer.close()
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
@@ -1,41 +1,83 @@
+import asyncio
+import sqlite3
+from typing import Optional
+
 from app.models.pydantic.sessions import Session
+from app.models.repositories.database import SqliteDatabase
+
+# attributes of a session stored in the sessions table. Its recordings are stored by the RecordingRepo
+_COLUMNS = ("start", "end", "facilitator_id", "student_id")
+_SELECT = f"SELECT id, {', '.join(f'[{column}]' for column in _COLUMNS)} FROM sessions"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (id INTEGER PRIMARY KEY AUTOINCREMENT, start TEXT, [end] TEXT,
+    facilitator_id INTEGER, student_id INTEGER);
+CREATE INDEX IF NOT EXISTS sessions_student_id ON sessions (student_id);
+"""
+
+
+class SessionNotFoundError(KeyError):
+    pass
+
+
+def _session(row: Optional[tuple], session_id: int) -> Session:
+    if row is None:
+        raise SessionNotFoundError(session_id)
+    return Session(id=row[0], **dict(zip(_COLUMNS, row[1:])))
 
 
 class SessionRepo:
 
-    def __init__(self):
-        pass
+    def __init__(self, database: Optional[SqliteDatabase] = None):
+        """:param database: database the sessions are stored in. None stores them in a private in-memory database"""
+        self._database = database if database is not None else SqliteDatabase()
+        self._database.execute_script(_SCHEMA)
 
     def get_session(self, session_id: int) -> Session:
-        """
-        TODO implement
-        :param session_id:
-        :return:
-        """
-        return Session()
+        """:raises SessionNotFoundError: if there is no session with the id"""
+        row = self._database.read(lambda connection: connection.execute(f"{_SELECT} WHERE id = ?",
+                                                                        (session_id,)).fetchone())
+        return _session(row, session_id)
 
     def update_session(self, session: Session) -> Session:
         """
-        TODO implement
-        :param session:
-        :return:
+        Replaces all attributes of the stored session with those of the session
+        :raises SessionNotFoundError: if there is no session with its id
         """
-        return Session()
+        return self.patch_session_attributes(session.id, **{column: getattr(session, column) for column in _COLUMNS})
 
     def patch_session_attributes(self, session_id: int, **attributes) -> Session:
         """
-         TODO implement
-         :param session_id:
-         :return:
-         """
-        for attr, value in attributes.items():
-            pass
-        return self.get_session(session_id)
+        Sets the given attributes of the session
+        :return: the patched session
+        :raises SessionNotFoundError: if there is no session with the id
+        :raises ValueError: if an attribute is not stored with the session
+        """
+        unknown = [attribute for attribute in attributes if attribute not in _COLUMNS]
+        if unknown:
+            raise ValueError(f"Session has no attributes {unknown}")
+
+        def patch(connection: sqlite3.Connection) -> Session:
+            if attributes:
+                connection.execute(f"UPDATE sessions SET {', '.join(f'[{column}] = ?' for column in attributes)} "
+                                   f"WHERE id = ?", (*attributes.values(), session_id))
+            return _session(connection.execute(f"{_SELECT} WHERE id = ?", (session_id,)).fetchone(), session_id)
+
+        return self._database.write(patch)
 
     def create_session(self, session: Session) -> Session:
-        """
-        TODO implement
-        :param session:
-        :return:
-        """
-        return Session()
+        """Stores the session under a new id and returns it with the id set"""
+        values = tuple(getattr(session, column) for column in _COLUMNS)
+        session.id = self._database.write(lambda connection: connection.execute(
+            f"INSERT INTO sessions ({', '.join(f'[{column}]' for column in _COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in _COLUMNS)})", values).lastrowid)
+        return session
+
+    async def aget_session(self, session_id: int) -> Session:
+        return await asyncio.to_thread(self.get_session, session_id)
+
+    async def apatch_session_attributes(self, session_id: int, **attributes) -> Session:
+        return await asyncio.to_thread(lambda: self.patch_session_attributes(session_id, **attributes))
+
+    async def acreate_session(self, session: Session) -> Session:
+        return await asyncio.to_thread(self.create_session, session)
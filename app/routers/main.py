@@ -1,7 +1,18 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.routers import sessions
+from services.llm_clients import llm_client_registry
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await sessions.evaluation_queue.start()
+    yield
+    await sessions.evaluation_queue.stop()
+    await llm_client_registry.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(sessions.router)
 
 
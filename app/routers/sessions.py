@@ -1,16 +1,79 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, APIRouter
+import os
+import json
+import asyncio
+import logging
+from typing import AsyncIterator, Optional
+
+from fastapi import FastAPI, File, UploadFile, HTTPException, APIRouter, Request, Header, Query
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from app.controllers.audio_uploads import AudioUploadManager, UploadStore, AudioUpload, UploadNotFoundError, \
+    UploadConflictError, ChunkChecksumMismatchError, IncompleteUploadError
+from app.controllers.evaluation_jobs import EvaluationJobQueue, JobStore
+from app.controllers.score_analytics import ScoreAnalytics, AnalyticsGroup, stored_evaluations
+from app.models.pydantic.documents import SourceDocument
+from app.models.pydantic.uploads import AudioUploadRequest, AudioUploadState, AudioUploadFinalization
 from app.models.pydantic.sessions import Session, Recording, RecordingStatus, RecordingType
-from app.models.repositories.recording import RecordingRepo
-from app.models.repositories.session import SessionRepo
-from services.evaluators_factory import TextEvaluatorFactory
+from app.models.repositories.recording import RecordingRepo, AudioFileTooLargeError, UPLOAD_DIRECTORY, \
+    RECORDING_FIELDS
+from app.models.repositories.database import get_database
+from app.models.repositories.session import SessionRepo, SessionNotFoundError
+from configs.configurator import Config
+from services.documents import get_document_registry, Document
+from services.evaluators import TextEvaluator, SummaryEvaluator
+from services.evaluators_factory import TextEvaluatorFactory, prompt_compaction_report
+from services.llm_clients import llm_client_registry
+from services.scheduler import get_llm_scheduler
+from services.semantic_cache import get_semantic_cache
+from services.token_accounting import get_token_accountant
+from static.summary_metrics import evaluation_metrics
 from langchain.pydantic_v1 import BaseModel
 
+CONFIG_FILE_PATH = os.path.join(os.getcwd(), "configs", "config.yaml")
+
 app = FastAPI()
 
-recording_repo = RecordingRepo()
-session_repo = SessionRepo()
+config = Config(CONFIG_FILE_PATH)
+audio_upload_params = config.get_audio_upload_params()
+database = get_database(config.get_storage_params())
+recording_repo = RecordingRepo(max_audio_bytes=audio_upload_params.get('MAX_FILE_BYTES'),
+                               chunk_bytes=audio_upload_params.get('CHUNK_BYTES', 1024 * 1024), database=database)
+session_repo = SessionRepo(database)
+audio_uploads = AudioUploadManager(UploadStore(audio_upload_params.get('RESUMABLE_DB_PATH', ':memory:')),
+                                   UPLOAD_DIRECTORY, max_audio_bytes=audio_upload_params.get('MAX_FILE_BYTES'),
+                                   max_chunk_bytes=audio_upload_params.get('MAX_RESUMABLE_CHUNK_BYTES',
+                                                                           8 * 1024 * 1024),
+                                   upload_ttl_seconds=audio_upload_params.get('RESUMABLE_UPLOAD_TTL_SECONDS',
+                                                                              24 * 60 * 60),
+                                   sweep_interval_seconds=audio_upload_params.get('RESUMABLE_SWEEP_INTERVAL_SECONDS',
+                                                                                  60 * 60))
 router = APIRouter()
 
+score_analytics = ScoreAnalytics(evaluation_metrics,
+                                 rolling_window=config.get_analytics_params().get('ROLLING_WINDOW', 5))
+
+
+def _add_to_analytics(recording: Recording, evaluation: BaseModel):
+    try:
+        session = session_repo.get_session(recording.session_id) if recording.session_id is not None else None
+    except SessionNotFoundError:
+        session = None
+    score_analytics.add(recording.id, session.student_id if session is not None else None,
+                        session.facilitator_id if session is not None else None, evaluation)
+
+
+job_queue_params = config.get_job_queue_params()
+evaluation_queue = EvaluationJobQueue(
+    recording_repo,
+    lambda recording_type: TextEvaluatorFactory(recording_type, config).get_evaluator(),
+    JobStore(job_queue_params.get('DB_PATH', ':memory:')),
+    concurrency=job_queue_params.get('BACKEND_CONCURRENCY', {}).get(config.get_llm_setup_name(), 1),
+    max_attempts=job_queue_params.get('MAX_ATTEMPTS', 3),
+    retry_base_delay=job_queue_params.get('RETRY_BASE_DELAY_SECONDS', 2),
+    on_evaluated=_add_to_analytics)
+
+# init module logger
+logger = logging.getLogger(__name__)
+
 
 def _attributes_not_none(obj, attributes: list):
     for attribute in attributes:
@@ -24,8 +87,7 @@ async def create_session(session: Session) -> Session:
     client_atts = ["facilitator_id", "student_id"]
     if _attributes_not_none(session, client_atts):
         session.start = ""  # TODO implement
-        session_repo.create_session(session)
-        return session
+        return await session_repo.acreate_session(session)
     else:
         raise HTTPException(status_code=400,
                             detail=f"Missing required attributes {str(client_atts)} in {str(session.__class__.__name__)}")
@@ -33,7 +95,11 @@ async def create_session(session: Session) -> Session:
 
 @router.patch("/session/{session_id}")
 async def finish_session(session_id: int) -> Session:
-    session: Session = session_repo.patch_session_attributes(session_id, end="")
+    try:
+        session: Session = await session_repo.apatch_session_attributes(session_id, end="")
+    except Exception as e:
+        raise HTTPException(status_code=500,
+                            detail=f"Could not find session with id: {session_id}\n{str(e)}")
     return session
 
 
@@ -44,17 +110,16 @@ async def create_recording(session_id: int, recording: Recording) -> Recording:
         recording.session_id = session_id
         recording.start = ""  # TODO implement
         recording.status = RecordingStatus.NO_AUDIO_SAVED
-        recording_repo.create_recording(recording)
-        return recording
+        return await recording_repo.acreate_recording(recording)
     else:
         raise HTTPException(status_code=400,
                             detail=f"Missing required attributes {str(client_atts)} in {str(recording.__class__.__name__)}")
 
 
-@router.patch("recording/{recording_id}/audio")
+@router.patch("/recording/{recording_id}/audio")
 async def finish_recording(recording_id: int, file: UploadFile = File(...)) -> Recording:
     try:
-        recording: Recording = recording_repo.get_recording(recording_id)
+        recording: Recording = await recording_repo.aget_recording(recording_id)
     except Exception as e:
         raise HTTPException(status_code=500,
                             detail=f"Could not find recording with id: {recording_id}\n{str(e)}")
@@ -65,21 +130,173 @@ async def finish_recording(recording_id: int, file: UploadFile = File(...)) -> R
         raise HTTPException(status_code=500,
                             detail=f"Currently saving audio for recording with id: {recording_id}")
 
+    await recording_repo.apatch_recording_attributes(recording.id, status=RecordingStatus.SAVING_AUDIO)
     try:
         #  save audio
-        await recording_repo.save_audio_file(file, recording)
+        recording = await recording_repo.save_audio_file(file, recording)
+    except AudioFileTooLargeError as e:
+        await recording_repo.apatch_recording_attributes(recording.id, status=RecordingStatus.NO_AUDIO_SAVED)
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
+        await recording_repo.apatch_recording_attributes(recording.id, status=RecordingStatus.NO_AUDIO_SAVED)
         raise HTTPException(status_code=500, detail=f"File saving failed: {str(e)}")
-    recording_status = RecordingStatus.SAVING_AUDIO
+    recording_status = RecordingStatus.AUDIO_SAVED
     # patch recording and return it
-    recording = recording_repo.patch_recording_attributes(recording.id, end=recording_end, status=recording_status)
+    recording = await recording_repo.apatch_recording_attributes(recording.id, end=recording_end,
+                                                                 status=recording_status,
+                                                                 audio_file_path=recording.audio_file_path,
+                                                                 audio_size=recording.audio_size,
+                                                                 audio_sha256=recording.audio_sha256)
     return recording
 
 
-@router.post("recording/{recording_id}/evaluation")
+@router.post("/recording/{recording_id}/audio/uploads")
+async def create_audio_upload(recording_id: int, upload_request: AudioUploadRequest) -> AudioUploadState:
+    """Starts a resumable upload of the audio file of the recording, whose chunks are then sent with PATCH"""
+    if not upload_request.total_size:
+        raise HTTPException(status_code=400, detail="Missing required attribute total_size in AudioUploadRequest")
+    await _expire_uploads()
+    recording = await _get_recording(recording_id)
+    if recording.status == RecordingStatus.SAVING_AUDIO:
+        raise HTTPException(status_code=409, detail=f"Currently saving audio for recording with id: {recording_id}")
+    try:
+        upload = await audio_uploads.create(recording_id, upload_request.filename, upload_request.total_size)
+    except AudioFileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await recording_repo.apatch_recording_attributes(recording_id, status=RecordingStatus.SAVING_AUDIO)
+    return _upload_state(upload)
+
+
+@router.get("/recording/{recording_id}/audio/uploads/{upload_id}")
+async def get_audio_upload(recording_id: int, upload_id: str) -> AudioUploadState:
+    """The received bytes and missing byte ranges of the upload, to resume it after a failure"""
+    return _upload_state(await _get_upload(recording_id, upload_id))
+
+
+@router.patch("/recording/{recording_id}/audio/uploads/{upload_id}")
+async def upload_audio_chunk(recording_id: int, upload_id: str, request: Request,
+                             upload_offset: int = Header(...),
+                             upload_checksum: Optional[str] = Header(None)) -> AudioUploadState:
+    """
+    Writes the request body at byte offset Upload-Offset of the upload. Chunks may be sent in any order and in
+    parallel. Upload-Checksum ("sha256 <hex digest>") verifies the chunk; a chunk sent again is verified against the
+    chunk received before
+    """
+    await _get_upload(recording_id, upload_id)
+    content_length = request.headers.get("content-length")
+    if content_length is not None and not content_length.isdigit():
+        raise HTTPException(status_code=400, detail="Content-Length must be a non-negative integer")
+    if content_length is not None and int(content_length) > audio_uploads.max_chunk_bytes:
+        raise HTTPException(status_code=413, detail=f"Chunks may hold at most {audio_uploads.max_chunk_bytes} bytes")
+    sha256 = None
+    if upload_checksum is not None:
+        algorithm, _, sha256 = upload_checksum.partition(" ")
+        if algorithm.lower() != "sha256" or not sha256:
+            raise HTTPException(status_code=400, detail="Upload-Checksum must be 'sha256 <hex digest>'")
+    try:
+        upload, duplicate = await audio_uploads.write_chunk(upload_id, upload_offset, await _read_chunk(request),
+                                                            sha256)
+    except ChunkChecksumMismatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except UploadConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _upload_state(upload, duplicate)
+
+
+async def _read_chunk(request: Request) -> bytes:
+    """Reads the request body, rejecting it as soon as it exceeds max_chunk_bytes, also without a Content-Length"""
+    body = bytearray()
+    async for data in request.stream():
+        body.extend(data)
+        if len(body) > audio_uploads.max_chunk_bytes:
+            raise HTTPException(status_code=413,
+                                detail=f"Chunks may hold at most {audio_uploads.max_chunk_bytes} bytes")
+    return bytes(body)
+
+
+@router.post("/recording/{recording_id}/audio/uploads/{upload_id}/finalize")
+async def finalize_audio_upload(recording_id: int, upload_id: str,
+                                finalization: Optional[AudioUploadFinalization] = None) -> Recording:
+    """Checks that every byte of the upload arrived, saves the audio file and moves the recording to AUDIO_SAVED"""
+    upload = await _get_upload(recording_id, upload_id)
+    recording = await _get_recording(recording_id)
+    audio_file_path = recording_repo.audio_file_path(recording, upload.filename)
+    try:
+        upload = await audio_uploads.finalize(upload_id, audio_file_path,
+                                              finalization.sha256 if finalization is not None else None)
+    except IncompleteUploadError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ChunkChecksumMismatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except UploadConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return await recording_repo.apatch_recording_attributes(
+        recording_id, status=RecordingStatus.AUDIO_SAVED,
+        audio_file_path=audio_file_path, audio_size=upload.total_size, audio_sha256=upload.sha256)
+
+
+@router.delete("/recording/{recording_id}/audio/uploads/{upload_id}")
+async def abort_audio_upload(recording_id: int, upload_id: str) -> AudioUploadState:
+    """Drops an active upload. Finalized uploads and uploads with chunks being written cannot be aborted"""
+    upload = await _get_upload(recording_id, upload_id)
+    try:
+        await audio_uploads.abort(upload_id)
+    except UploadConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    await recording_repo.apatch_recording_attributes(recording_id, status=RecordingStatus.NO_AUDIO_SAVED)
+    return _upload_state(upload)
+
+
+async def _get_recording(recording_id: int) -> Recording:
+    try:
+        return await recording_repo.aget_recording(recording_id)
+    except Exception as e:
+        raise HTTPException(status_code=500,
+                            detail=f"Could not find recording with id: {recording_id}\n{str(e)}")
+
+
+async def _get_upload(recording_id: int, upload_id: str) -> AudioUpload:
+    try:
+        upload = await audio_uploads.aget(upload_id)
+    except UploadNotFoundError:
+        upload = None
+    if upload is None or upload.recording_id != recording_id:
+        raise HTTPException(status_code=404,
+                            detail=f"Could not find upload {upload_id} of recording with id: {recording_id}")
+    return upload
+
+
+async def _expire_uploads():
+    """Expires the abandoned uploads once per sweep interval and frees their recordings for a new upload"""
+    for upload in await audio_uploads.expire_due():
+        try:
+            recording = await recording_repo.aget_recording(upload.recording_id)
+            if recording.status == RecordingStatus.SAVING_AUDIO:
+                await recording_repo.apatch_recording_attributes(recording.id, status=RecordingStatus.NO_AUDIO_SAVED)
+        except Exception as e:
+            logger.warning("Could not reset recording %d of expired upload %s: %s", upload.recording_id, upload.id, e)
+
+
+def _upload_state(upload: AudioUpload, duplicate_chunk: Optional[bool] = None) -> AudioUploadState:
+    return AudioUploadState(id=upload.id, recording_id=upload.recording_id, filename=upload.filename,
+                            total_size=upload.total_size, received_bytes=upload.received_bytes,
+                            missing_ranges=[list(missing) for missing in upload.missing_ranges()],
+                            status=upload.status, sha256=upload.sha256, duplicate_chunk=duplicate_chunk)
+
+
+@router.get("/audio/uploads/stats")
+async def get_audio_upload_stats() -> dict:
+    return dict(recording_repo.audio_upload_stats(), resumable=audio_uploads.stats())
+
+
+@router.post("/recording/{recording_id}/evaluation")
 async def process_recording(recording_id: int) -> Recording:
     try:
-        recording: Recording = recording_repo.get_recording(recording_id)
+        recording: Recording = await recording_repo.aget_recording(recording_id)
     except Exception as e:
         raise HTTPException(status_code=500,
                             detail=f"Could not find recording with id: {recording_id}\n{str(e)}")
@@ -89,39 +306,236 @@ async def process_recording(recording_id: int) -> Recording:
         raise HTTPException(status_code=500,
                             detail=f"Cannot process audio because of current status {recording.status} of recording id"
                                    f": {recording_id}")
-    txt_proc_fact = TextEvaluatorFactory(recording.type)
-    evaluator = txt_proc_fact.get_evaluator()
-    # TODO logic with processor: async processor.process(recording: Recording, recording_repo: RecordingRepo)
-    #  recording.evaluation = evaluator.evaluate(summary)
-    # update status to PROCESSING_AUDIO
+    # update status to PROCESSING_AUDIO, the evaluation job moves it on to AUDIO_PROCESSED
     recording_status = RecordingStatus.PROCESSING_AUDIO
-    recording = recording_repo.patch_recording_attributes(recording.id, status=recording_status)
+    recording = await recording_repo.apatch_recording_attributes(recording_id, status=recording_status)
+    await evaluation_queue.aenqueue(recording_id)
     return recording
 
 
-@router.get("recording/{recording_id}/evaluation")
+@router.get("/recording/{recording_id}/evaluation")
 async def get_recording_evaluation(recording_id: int) -> BaseModel:
     try:
-        recording: Recording = recording_repo.get_recording(recording_id)
+        recording: Recording = await recording_repo.aget_recording(recording_id)
     except Exception as e:
         raise HTTPException(status_code=500,
                             detail=f"Could not find recording with id: {recording_id}\n{str(e)}")
     return recording.evaluation
 
 
-@router.get("recording/{recording_id}/status")
-async def get_recording_status(recording_id: int) -> RecordingStatus:
+@router.get("/recording/{recording_id}/evaluation/stream")
+async def stream_recording_evaluation(recording_id: int) -> StreamingResponse:
+    """
+    Evaluates the transcript of the recording and streams the result as Server-Sent Events: one event per
+    SummaryEvaluationItem or ErrorItem as soon as it is available, followed by an "end" event. With pre-scoring
+    enabled, a PreScoresItem event comes first.
+    """
     try:
-        recording: Recording = recording_repo.get_recording(recording_id)
+        recording: Recording = await recording_repo.aget_recording(recording_id)
+    except Exception as e:
+        raise HTTPException(status_code=500,
+                            detail=f"Could not find recording with id: {recording_id}\n{str(e)}")
+    if recording.transcript is None:
+        raise HTTPException(status_code=400,
+                            detail=f"No transcript to evaluate for recording with id: {recording_id}")
+    evaluator = TextEvaluatorFactory(recording.type, config).get_evaluator()
+    if evaluator is None:
+        raise HTTPException(status_code=500,
+                            detail=f"No evaluator available for recording type {recording.type}")
+    return StreamingResponse(_stream_evaluation_events(evaluator, recording),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def _stream_evaluation_events(evaluator: TextEvaluator, recording: Recording) -> AsyncIterator[str]:
+    if isinstance(evaluator, SummaryEvaluator):
+        items = evaluator.astream_evaluate(recording.transcript, recording.document_id)
+    else:
+        items = evaluator.astream_evaluate(recording.transcript)
+    try:
+        async for item in items:
+            yield _sse_event(type(item).__name__, item.json())
+    except Exception as e:
+        logger.exception("Streaming evaluation failed: %s", e)
+        yield _sse_event("error", json.dumps({"detail": str(e)}))
+    yield _sse_event("end", "{}")
+
+
+def _sse_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+@router.get("/recording/{recording_id}/status")
+async def get_recording_status(recording_id: int) -> str:
+    try:
+        recording: Recording = await recording_repo.aget_recording(recording_id)
     except Exception as e:
         raise HTTPException(status_code=500,
                             detail=f"Could not find recording with id: {recording_id}\n{str(e)}")
     return recording.status
 
 
+@router.post("/document/")
+async def register_document(document: SourceDocument) -> SourceDocument:
+    """Stores the source document of comprehension recordings once, identified by the hash of its text"""
+    if not document.text or not document.text.strip():
+        raise HTTPException(status_code=400, detail="Missing required attribute text in SourceDocument")
+    registered = await asyncio.to_thread(get_document_registry(config.get_document_params()).register, document.text)
+    return _source_document(registered, with_text=False)
+
+
+@router.get("/document/{document_id}")
+async def get_document(document_id: str) -> SourceDocument:
+    document = await asyncio.to_thread(get_document_registry(config.get_document_params()).get, document_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail=f"Could not find document with id: {document_id}")
+    return _source_document(document, with_text=True)
+
+
+def _source_document(document: Document, with_text: bool) -> SourceDocument:
+    return SourceDocument(id=document.id, text=document.text if with_text else None,
+                          token_count=document.token_count, digest=document.digest,
+                          digest_token_count=document.digest_token_count)
+
+
+@router.get("/storage/stats")
+async def get_storage_stats() -> dict:
+    """Reads, writes and the mean number of writes group committed per transaction of the session database"""
+    return database.stats()
+
+
+@router.get("/analytics/scores")
+async def get_score_analytics(student_id: Optional[int] = None, facilitator_id: Optional[int] = None,
+                              window: Optional[int] = Query(None, ge=1)) -> dict:
+    """
+    Count, mean, deviation, percentiles, trend (score change per evaluation) and rolling means of the scores per
+    metric, and the error counts per category, of the evaluations of a student and/or the class of a facilitator
+    """
+    analytics = await _loaded_score_analytics()
+    return await asyncio.to_thread(analytics.scores, student_id, facilitator_id, window)
+
+
+@router.get("/analytics/{group}")
+async def get_score_aggregates(group: str) -> dict:
+    """Materialized count, mean and deviation of the scores and error counts of every student or class"""
+    analytics = await _loaded_score_analytics()
+    try:
+        return await asyncio.to_thread(analytics.aggregates, group)
+    except ValueError as e:
+        raise HTTPException(status_code=404,
+                            detail=f"{str(e)}, group must be {AnalyticsGroup.STUDENT} or {AnalyticsGroup.CLASS}")
+
+
+async def _loaded_score_analytics() -> ScoreAnalytics:
+    """The score analytics, with the stored evaluations loaded on first use"""
+    if not score_analytics.loaded:
+        await asyncio.to_thread(lambda: score_analytics.load(stored_evaluations(database)))
+    return score_analytics
+
+
+@router.get("/evaluation/jobs/stats")
+async def get_evaluation_jobs_stats() -> dict:
+    return evaluation_queue.stats()
+
+
+@router.get("/evaluation/semantic_cache/stats")
+async def get_semantic_cache_stats() -> dict:
+    """Hits, misses and indexed evaluations of the semantic cache, with the model versions of the current evaluators"""
+    semantic_cache = get_semantic_cache(config.get_semantic_cache_params())
+    if semantic_cache is None:
+        raise HTTPException(status_code=404, detail="The semantic cache is disabled")
+    model_versions = {}
+    for recording_type in (RecordingType.COMPREHENSION, RecordingType.LANGUAGE_PRODUCTION):
+        evaluator = TextEvaluatorFactory(recording_type, config).get_evaluator()
+        if evaluator is not None:
+            model_versions[recording_type] = evaluator.model_version()
+    return dict(semantic_cache.stats(), current_model_versions=model_versions)
+
+
+@router.delete("/evaluation/semantic_cache")
+async def invalidate_semantic_cache(document_id: Optional[str] = None, model_version: Optional[str] = None) -> dict:
+    """Drops the cached evaluations of the document and/or model version, all of them without either"""
+    semantic_cache = get_semantic_cache(config.get_semantic_cache_params())
+    if semantic_cache is None:
+        raise HTTPException(status_code=404, detail="The semantic cache is disabled")
+    return {"invalidated": semantic_cache.invalidate(document_id, model_version)}
+
+
+@router.get("/llm/scheduler/stats")
+async def get_llm_scheduler_stats() -> dict:
+    scheduler = get_llm_scheduler(config.get_llm_setup_name(), config.get_llm_scheduler_params())
+    if scheduler is None:
+        raise HTTPException(status_code=404,
+                            detail=f"No scheduler configured for llm setup {config.get_llm_setup_name()}")
+    return scheduler.stats()
+
+
+@router.get("/llm/cascade/stats")
+async def get_llm_cascade_stats() -> dict:
+    """Escalation counters and rates of the model cascade per recording type"""
+    stats = {}
+    for recording_type in (RecordingType.COMPREHENSION, RecordingType.LANGUAGE_PRODUCTION):
+        evaluator = TextEvaluatorFactory(recording_type, config).get_evaluator()
+        escalation_stats = evaluator.escalation_stats() if evaluator is not None else None
+        if escalation_stats is not None:
+            stats[recording_type] = escalation_stats
+    if not stats:
+        raise HTTPException(status_code=404,
+                            detail=f"No model cascade configured for llm setup {config.get_llm_setup_name()}")
+    return stats
+
+
+@router.get("/llm/tokens/stats")
+async def get_llm_token_stats() -> dict:
+    """Tokens of the chain invocations per recording type and metric, and the tokens saved by prompt compaction"""
+    accountant = get_token_accountant(config.get_token_accounting_params())
+    return {"invocations": accountant.stats() if accountant is not None else None,
+            "prompt_templates": prompt_compaction_report()}
+
+
+@router.get("/llm/hosts/stats")
+async def get_llm_host_stats() -> dict:
+    return llm_client_registry.host_stats()
+
+
 @router.get("/session/{session_id}/recording/")
-async def get_session_recordings(session_id: int) -> list[Recording]:
-    pass
+async def get_session_recordings(session_id: int, request: Request, after: Optional[int] = None,
+                                 limit: int = Query(50, ge=1, le=500),
+                                 fields: Optional[str] = None) -> list[Recording]:
+    """
+    Lists the recordings of the session ordered by id, one page at a time: the Link header (rel="next") holds the url
+    of the next page, whose recordings follow the id given by after. fields is a comma separated projection of the
+    recordings, all attributes but the evaluation by default. A response carries an ETag; polling with it in
+    If-None-Match returns 304 Not Modified while the page is unchanged
+    """
+    projection = [field.strip() for field in fields.split(",") if field.strip()] if fields is not None else None
+    try:
+        page = await recording_repo.alist_session_recordings(session_id, after, limit, projection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{str(e)}, fields must be of {list(RECORDING_FIELDS)}")
+    headers = {"ETag": f'W/"{page.etag}"', "Cache-Control": "no-cache"}
+    if page.next_cursor is not None:
+        headers["Link"] = f'<{request.url.include_query_params(after=page.next_cursor)}>; rel="next"'
+    if _etag_matches(request.headers.get("if-none-match"), page.etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse([_recording_content(recording, projection) for recording in page.recordings],
+                        headers=headers)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of If-None-Match with the etag, as for conditional GET requests"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/").strip('"') == etag for tag in tags)
+
+
+def _recording_content(recording: Recording, projection: Optional[list]) -> dict:
+    content = recording.model_dump(include=set(projection) | {"id"} if projection is not None else None,
+                                   exclude={"evaluation"})
+    if projection is not None and "evaluation" in projection:
+        content["evaluation"] = json.loads(recording.evaluation.json()) if recording.evaluation is not None else None
+    return content
 
 
 @router.get("/test_endpoint")
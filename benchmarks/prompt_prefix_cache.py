@@ -0,0 +1,151 @@
+"""
+Time to first token of the per-metric summary prompts on a repeated-document workload, comparing the cache-friendly
+layout of SummaryChainWrapper (static instructions and source text first, metric and summary last) with the previous
+metric-first layout.
+
+By default the LLM is a simulated backend with a prompt prefix cache, whose time to first token grows with the prompt
+tokens not already cached, like Ollama's context reuse and OpenAI prompt caching. With --setup the prompts are sent to
+a configured llm setup instead, e.g. LOCAL_OLLAMA_LLAMA3.
+
+    python -m benchmarks.prompt_prefix_cache [--setup LOCAL_OLLAMA_LLAMA3] [--summaries 4]
+"""
+import argparse
+import os
+import statistics
+import time
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from langchain_core.prompts import PromptTemplate
+
+from configs.configurator import Config
+from services.evaluators import SummaryChainWrapper
+from services.llm_clients import llm_client_registry
+from services.tokens import count_tokens
+from static.summary_example_text import afrikaans_OPENAI_doc, afrikaans_OPENAI_summary_good, \
+    afrikaans_OPENAI_summary_bad
+from static.summary_metrics import evaluation_metrics
+
+CONFIG_FILE_PATH = os.path.join(os.getcwd(), "configs", "config.yaml")
+SUMMARIES = [afrikaans_OPENAI_summary_good, afrikaans_OPENAI_summary_bad,
+             "OpenAI ontwikkel KI-stelsels en wil hê dat almal daarby baat vind.",
+             "Die artikel beskryf hoe KI-modelle in gesondheidsorg en onderwys gebruik word."]
+
+
+class MetricFirstSummaryChainWrapper(SummaryChainWrapper):
+    """The previous layout: the metric, its criteria and steps come before the source text"""
+
+    def _create_prompt(self):
+        evaluation_prompt_template = """
+                You will be given one afrikaans summary written for an AFRIKAANS article. Your task is to rate the
+                summary on one metric.
+                Please make sure you read and understand these instructions very carefully.
+                Please keep this document open while reviewing, and refer to it as needed.
+
+                Metric Name:
+                {metric_name}
+
+                Evaluation Criteria:
+
+                {criteria}
+
+                Evaluation Steps:
+
+                {steps}
+
+                Source Text:
+
+                {document}
+
+                Summary:
+
+                {summary}
+
+                Provide your evaluation in the following format:
+
+                \n{format_instructions}\n
+
+                """
+
+        self.prompt_template = PromptTemplate(
+            input_variables=["document", "summary", "metric_name", "criteria", "steps"],
+            template=evaluation_prompt_template,
+            partial_variables={"format_instructions": self.output_parser.get_format_instructions()}
+        )
+
+
+class PrefixCachingLLM(LLM):
+    """
+    Simulated backend keeping the prompts of its last requests cached: a prompt only pays prompt evaluation time for
+    its tokens after the longest prefix it shares with a cached prompt
+    """
+    seconds_per_prompt_token: float = 0.0005
+    cache_slots: int = 4
+    cached_prompts: List[str] = []
+    uncached_tokens: List[int] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "prefix-caching-simulation"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None,
+                **kwargs: Any) -> Iterator[GenerationChunk]:
+        cached_prefix = max((os.path.commonprefix([prompt, cached]) for cached in self.cached_prompts),
+                            key=len, default="")
+        uncached_tokens = count_tokens(prompt[len(cached_prefix):])
+        self.uncached_tokens.append(uncached_tokens)
+        self.cached_prompts = (self.cached_prompts + [prompt])[-self.cache_slots:]
+        time.sleep(uncached_tokens * self.seconds_per_prompt_token)
+        yield GenerationChunk(text='{"metric": "", "score": 7, "reason": ""}')
+
+
+def time_to_first_token(llm: BaseLanguageModel, prompt: str) -> float:
+    started = time.perf_counter()
+    for _ in llm.stream(prompt):
+        break
+    return time.perf_counter() - started
+
+
+def run(chain_wrapper: SummaryChainWrapper, llm: BaseLanguageModel, summaries: List[str]) -> List[float]:
+    """Sends the prompt of every metric of every summary of the document and returns their times to first token"""
+    timings = []
+    for summary in summaries:
+        for metric_name, (criteria, steps) in evaluation_metrics.items():
+            prompt = chain_wrapper.prompt_template.format(document=afrikaans_OPENAI_doc, summary=summary,
+                                                          metric_name=metric_name, criteria=criteria, steps=steps)
+            timings.append(time_to_first_token(llm, prompt))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--setup", help="llm setup of the config to benchmark instead of the simulated backend")
+    parser.add_argument("--summaries", type=int, default=len(SUMMARIES), help="summaries evaluated per layout")
+    args = parser.parse_args()
+    summaries = (SUMMARIES * args.summaries)[:args.summaries]
+
+    results = {}
+    for name, chain_wrapper in [("metric first", MetricFirstSummaryChainWrapper()),
+                                ("document first", SummaryChainWrapper())]:
+        if args.setup:
+            config = Config(CONFIG_FILE_PATH, args.setup)
+            llm = llm_client_registry.get_llm(args.setup, config.get_llm_setup_params(),
+                                              config.get_llm_http_pool_params())
+        else:
+            llm = PrefixCachingLLM(cached_prompts=[], uncached_tokens=[])
+        timings = run(chain_wrapper, llm, summaries)
+        results[name] = statistics.mean(timings)
+        uncached = f", mean uncached prompt tokens {statistics.mean(llm.uncached_tokens):.0f}" \
+            if isinstance(llm, PrefixCachingLLM) else ""
+        print(f"{name}: mean time to first token {results[name] * 1000:.0f} ms over {len(timings)} prompts"
+              f"{uncached}")
+    print(f"speedup: {results['metric first'] / results['document first']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
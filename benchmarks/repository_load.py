@@ -0,0 +1,97 @@
+"""
+Read and write throughput of the SQLite recording repository under concurrent status polling: poller threads read
+recordings like clients polling /recording/{id}/status every poll interval, while writer threads patch their status
+like the upload endpoints and evaluation workers. The run is repeated without group commit (one transaction per
+write) to compare.
+
+    python -m benchmarks.repository_load [--pollers 64] [--poll-interval 0.005] [--writers 8] [--seconds 5]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from typing import List
+
+from app.models.pydantic.sessions import Recording, RecordingStatus, RecordingType
+from app.models.repositories.database import SqliteDatabase
+from app.models.repositories.recording import RecordingRepo
+from pydantic_models.evaluator import SummaryEvaluations, SummaryEvaluationItem
+from static.summary_metrics import evaluation_metrics
+
+STATUSES = [RecordingStatus.SAVING_AUDIO, RecordingStatus.AUDIO_SAVED, RecordingStatus.PROCESSING_AUDIO,
+            RecordingStatus.AUDIO_PROCESSED]
+EVALUATION = SummaryEvaluations(evaluations=[SummaryEvaluationItem(metric=metric, score=7,
+                                                                   reason="The summary covers the main points.")
+                                             for metric in evaluation_metrics])
+
+
+def run(db_path: str, pollers: int, poll_interval: float, writers: int, seconds: float, recordings: int,
+        max_batch_size: int) -> dict:
+    database = SqliteDatabase(db_path, pool_size=4, max_batch_size=max_batch_size)
+    repo = RecordingRepo(database=database)
+    ids = [repo.create_recording(Recording(session_id=index // 10, type=RecordingType.COMPREHENSION,
+                                           status=RecordingStatus.NO_AUDIO_SAVED)).id for index in range(recordings)]
+    read_latencies: List[List[float]] = [[] for _ in range(pollers)]
+    write_latencies: List[List[float]] = [[] for _ in range(writers)]
+    stop = threading.Event()
+
+    def poll(latencies: List[float]):
+        while not stop.is_set():
+            started = time.perf_counter()
+            repo.get_recording(random.choice(ids))
+            latencies.append(time.perf_counter() - started)
+            stop.wait(poll_interval)
+
+    def write(latencies: List[float]):
+        while not stop.is_set():
+            started = time.perf_counter()
+            status = random.choice(STATUSES)
+            if status == RecordingStatus.AUDIO_PROCESSED:
+                repo.patch_recording_attributes(random.choice(ids), status=status, evaluation=EVALUATION)
+            else:
+                repo.patch_recording_attributes(random.choice(ids), status=status)
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=poll, args=(latencies,)) for latencies in read_latencies] + \
+        [threading.Thread(target=write, args=(latencies,)) for latencies in write_latencies]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    reads = [latency for latencies in read_latencies for latency in latencies]
+    writes = [latency for latencies in write_latencies for latency in latencies]
+    return {"reads_per_second": len(reads) / seconds, "writes_per_second": len(writes) / seconds,
+            "read_p95_ms": _percentile(reads, 0.95) * 1000, "write_p95_ms": _percentile(writes, 0.95) * 1000,
+            "mean_batch_size": database.stats()["mean_batch_size"]}
+
+
+def _percentile(samples: List[float], quantile: float) -> float:
+    return statistics.quantiles(samples, n=100)[int(quantile * 100) - 1] if len(samples) > 1 else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pollers", type=int, default=64)
+    parser.add_argument("--poll-interval", type=float, default=0.005, help="seconds between the reads of a poller")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--recordings", type=int, default=1000)
+    args = parser.parse_args()
+    print(f"{args.pollers} pollers every {args.poll_interval}s, {args.writers} writers, {args.recordings} recordings, "
+          f"{args.seconds}s per run")
+    for name, max_batch_size in (("group commit", 256), ("commit per write", 1)):
+        with tempfile.TemporaryDirectory() as directory:
+            result = run(os.path.join(directory, "sessions.sqlite3"), args.pollers, args.poll_interval, args.writers,
+                         args.seconds, args.recordings, max_batch_size)
+        print(f"{name:>16}: {result['reads_per_second']:8.0f} reads/s (p95 {result['read_p95_ms']:.2f} ms), "
+              f"{result['writes_per_second']:7.0f} writes/s (p95 {result['write_p95_ms']:.2f} ms), "
+              f"{result['mean_batch_size']:.1f} writes per commit")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
+import copy
 import yaml
 import logging.config
 from dataclasses import dataclass
+from typing import Optional
 
 
 @dataclass
@@ -26,16 +28,61 @@ class Config:
     def _set_logger(self):
         logging.config.dictConfig(self._config_dict['logging'])
 
+    def for_setup(self, setup_name: str) -> "Config":
+        """Returns a copy of the config for another llm setup, sharing the loaded configuration"""
+        config = copy.copy(self)
+        config._setup_name = setup_name
+        return config
+
     # getters
     def get_llm_setup_name(self):
         return self._setup_name
 
-    def get_llm_setup_params(self):
-        return self._config_dict['llm'][self._setup_name]
+    def get_llm_setup_params(self, setup_name: Optional[str] = None):
+        return self._config_dict['llm'][setup_name or self._setup_name]
 
     def get_llm_output_parser_type(self, recording_type: str):
         return self._config_dict['llm_parser'][recording_type]
 
+    def get_audio_upload_params(self) -> dict:
+        return self._config_dict.get('audio_upload') or {}
+
+    def get_storage_params(self) -> dict:
+        return self._config_dict.get('storage') or {}
+
+    def get_evaluation_params(self) -> dict:
+        return self._config_dict.get('evaluation') or {}
+
+    def get_llm_cache_params(self) -> dict:
+        return self._config_dict.get('llm_cache') or {}
+
+    def get_llm_http_pool_params(self) -> dict:
+        return self._config_dict.get('llm_http_pool') or {}
+
+    def get_llm_scheduler_params(self, setup_name: Optional[str] = None) -> dict:
+        return (self._config_dict.get('llm_scheduler') or {}).get(setup_name or self._setup_name) or {}
+
+    def get_llm_tier_params(self) -> dict:
+        return (self._config_dict.get('llm_tiers') or {}).get(self._setup_name) or {}
+
+    def get_semantic_cache_params(self) -> dict:
+        return self._config_dict.get('semantic_cache') or {}
+
+    def get_token_accounting_params(self) -> dict:
+        return self._config_dict.get('token_accounting') or {}
+
+    def get_model_cascade_params(self) -> dict:
+        return (self._config_dict.get('model_cascade') or {}).get(self._setup_name) or {}
+
+    def get_document_params(self) -> dict:
+        return self._config_dict.get('documents') or {}
+
+    def get_job_queue_params(self) -> dict:
+        return self._config_dict.get('job_queue') or {}
+
+    def get_analytics_params(self) -> dict:
+        return self._config_dict.get('analytics') or {}
+
 
 class ColoredFormatter(logging.Formatter):
     # Define the color codes
@@ -1,5 +1,5 @@
 from langchain.pydantic_v1 import BaseModel, Field
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Dict
 from langchain.output_parsers import ResponseSchema
 
 
@@ -35,6 +35,24 @@ summary_evaluation_item_schema: List[ResponseSchema] = [
 class SummaryEvaluations(BaseModel):
     evaluations: List[Union[
         SummaryEvaluationItem, BaseModel]] = []  # Field(..., description="A list of scores of all considered evaluation metrics for the provided summary")
+    answered_by: Dict[str, str] = {}  # name of the llm tier that answered, per metric (empty without llm tiers)
+    pre_scores: Dict[str, float] = {}  # lexical pre-scores of the summary against the document (empty without)
+    escalation_reasons: List[str] = []  # why a model cascade escalated the evaluation (empty if not escalated)
+
+
+class PreScoresItem(BaseModel):
+    pre_scores: Dict[str, float] = {}  # lexical pre-scores of the summary against the document, streamed first
+
+
+class MultiMetricSummaryEvaluations(BaseModel):
+    evaluations: List[SummaryEvaluationItem] = Field(..., description="One evaluation for each of the given metrics, "
+                                                                      "in the order the metrics are given")
+
+
+class DocumentDigest(BaseModel):
+    main_topic: str = Field(..., description="The main topic of the article in one sentence.")
+    key_points: List[str] = Field(..., description="The key points and main facts of the article, one short sentence "
+                                                   "each, in the order the article presents them.")
 
 
 class ErrorItem(BaseModel):
@@ -49,6 +67,17 @@ class Errors(BaseModel):
                                                "errors in the sentence.")
 
 
+class PositionedErrorItem(ErrorItem):
+    sentence_index: int = Field(..., description="The number in brackets of the sentence the error was found in.")
+    start: Optional[int] = Field(None, description="Character offset of the error within the sentence.")
+    end: Optional[int] = Field(None, description="Character offset of the end of the error within the sentence.")
+
+
+class BatchErrors(BaseModel):
+    error: List[PositionedErrorItem] = Field(..., description="A list of errors representing all possible "
+                                                              "grammatical errors in all of the sentences.")
+
+
 grammatical_errors_schema: List[ResponseSchema] = [
     ResponseSchema(name="grammatical_errors",
                    description="A list of strings. Each string corresponding to a grammatical error found in the sentence.",
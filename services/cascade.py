@@ -0,0 +1,105 @@
+import logging
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+from pydantic_models.evaluator import SummaryEvaluations, Errors
+from services.segmentation import locate_fragment
+
+if TYPE_CHECKING:
+    from services.evaluators import TextEvaluator
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+# reasons an evaluation of the first stage of a cascade is escalated for
+PARSE_FAILURE = "parse_failure"
+BORDERLINE_SCORE = "borderline_score"
+METRIC_DISAGREEMENT = "metric_disagreement"
+UNLOCATED_ERROR = "unlocated_error"
+UNCHANGED_CORRECTION = "unchanged_correction"
+TOO_MANY_ERRORS = "too_many_errors"
+
+
+class ModelEscalation:
+    """
+    Second stage of a model cascade: the evaluator of an expensive llm setup, the confidence checks deciding which
+    evaluations of the cheap first stage are escalated to it, and the escalation counters. Summary evaluations are
+    escalated for unscored metrics, scores in the borderline range and metrics disagreeing by more than the allowed
+    spread; grammar evaluations for failed calls, errors that are not part of the text, corrections equal to the
+    error and more errors than the text plausibly has.
+    """
+
+    def __init__(self, evaluator: "TextEvaluator", name: str, borderline_scores: Optional[Sequence[int]] = (4, 6),
+                 max_metric_spread: Optional[int] = 5, max_errors_per_word: Optional[float] = 0.5):
+        """
+        :param evaluator: evaluator of the expensive llm setup the doubtful evaluations are escalated to
+        :param name: name of the expensive llm setup
+        :param borderline_scores: lowest and highest summary score (inclusive) that is escalated. None disables the
+        check
+        :param max_metric_spread: largest difference between the scores of the metrics of one summary that is not
+        escalated. None disables the check
+        :param max_errors_per_word: grammar evaluations finding more errors per word of the text are escalated. None
+        disables the check
+        """
+        self.evaluator = evaluator
+        self.name = name
+        self._borderline_scores = tuple(borderline_scores) if borderline_scores else None
+        self._max_metric_spread = max_metric_spread
+        self._max_errors_per_word = max_errors_per_word
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {"evaluations": 0, "escalations": 0, "escalation_failures": 0}
+        self._reasons: Dict[str, int] = {}
+
+    def summary_reasons(self, evaluation: SummaryEvaluations) -> List[str]:
+        """Returns why the summary evaluation of the first stage is doubtful, an empty list if it is kept"""
+        reasons = []
+        scores = [item.score for item in evaluation.evaluations]
+        if any(score is None for score in scores):
+            reasons.append(PARSE_FAILURE)
+        scores = [score for score in scores if score is not None]
+        if self._borderline_scores is not None and \
+                any(self._borderline_scores[0] <= score <= self._borderline_scores[1] for score in scores):
+            reasons.append(BORDERLINE_SCORE)
+        if self._max_metric_spread is not None and scores and max(scores) - min(scores) > self._max_metric_spread:
+            reasons.append(METRIC_DISAGREEMENT)
+        return reasons
+
+    def errors_reasons(self, text: str, errors: Optional[Errors]) -> List[str]:
+        """
+        Returns why the grammar evaluation of the first stage is doubtful, an empty list if it is kept
+        :param errors: errors found by the first stage, None if its evaluation failed
+        """
+        if errors is None:
+            return [PARSE_FAILURE]
+        reasons = []
+        if any(locate_fragment(text, item.error)[0] is None for item in errors.error):
+            reasons.append(UNLOCATED_ERROR)
+        if any(item.error.strip() == item.correction.strip() for item in errors.error):
+            reasons.append(UNCHANGED_CORRECTION)
+        if self._max_errors_per_word is not None and \
+                len(errors.error) > max(1.0, self._max_errors_per_word * len(text.split())):
+            reasons.append(TOO_MANY_ERRORS)
+        return reasons
+
+    def record(self, reasons: List[str]):
+        """Counts an evaluation of the first stage and, if it has reasons, its escalation"""
+        with self._lock:
+            self._counters["evaluations"] += 1
+            if reasons:
+                self._counters["escalations"] += 1
+            for reason in reasons:
+                self._reasons[reason] = self._reasons.get(reason, 0) + 1
+
+    def record_failure(self, error: Exception):
+        """Counts an escalation that failed, whose first stage evaluation is kept"""
+        logger.exception("Escalation to llm setup %s failed, keeping the first evaluation: %s", self.name, error)
+        with self._lock:
+            self._counters["escalation_failures"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            evaluations = self._counters["evaluations"]
+            return dict(self._counters,
+                        escalation_setup=self.name,
+                        escalation_rate=self._counters["escalations"] / evaluations if evaluations else None,
+                        reasons=dict(self._reasons))
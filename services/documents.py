@@ -0,0 +1,187 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, Optional, Tuple
+
+from services.tokens import count_tokens
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Document:
+    id: str
+    text: str
+    token_count: int
+    created_at: float
+    digest: Optional[str] = None
+    digest_token_count: Optional[int] = None
+
+
+class DocumentRegistry:
+    """
+    SQLite store of the source documents summaries are evaluated against. Every document is stored once, keyed by the
+    hash of its content, with its token count and a key point digest extracted by the LLM on first use, so that the
+    summary prompts can carry the compact digest instead of the full document. The most recently used documents are
+    kept in memory, as a document only changes once, when its digest is extracted.
+    """
+    _COLUMNS = "id, text, token_count, created_at, digest, digest_token_count"
+
+    def __init__(self, db_path: str = ":memory:", digest_min_tokens: int = 0, digest_retry_seconds: float = 60.0,
+                 digest_max_retry_seconds: float = 3600.0, memory_max_documents: int = 256):
+        """
+        :param db_path: SQLite file of the registry, ":memory:" keeps it for the lifetime of the process
+        :param digest_min_tokens: documents with fewer tokens are not digested, their full text is short enough
+        :param digest_retry_seconds: seconds the extraction of a digest is not retried after it failed, doubled with
+        every consecutive failure of the document
+        :param digest_max_retry_seconds: longest wait before the extraction of a digest is retried
+        :param memory_max_documents: maximum number of documents kept in memory
+        """
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._digest_min_tokens = digest_min_tokens
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._memory_max_documents = memory_max_documents
+        self._memory: "OrderedDict[str, Document]" = OrderedDict()
+        # one lock per document, so that concurrent evaluations extract its digest only once
+        self._digest_locks: Dict[str, threading.Lock] = {}
+        self._digest_retry_seconds = digest_retry_seconds
+        self._digest_max_retry_seconds = digest_max_retry_seconds
+        # consecutive failed digest extractions of a document and the time they may be retried
+        self._digest_failures: Dict[str, Tuple[int, float]] = {}
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, text TEXT NOT NULL, "
+                                     "token_count INTEGER NOT NULL, created_at REAL NOT NULL, digest TEXT, "
+                                     "digest_token_count INTEGER)")
+            self._connection.commit()
+
+    @staticmethod
+    def make_id(text: str) -> str:
+        return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+    def register(self, text: str) -> Document:
+        """Stores the document unless a document with the same content is stored already, and returns it"""
+        document_id = self.make_id(text)
+        document = self.get(document_id)
+        if document is not None:
+            return document
+        document = Document(document_id, text.strip(), count_tokens(text), time.time())
+        with self._lock:
+            self._connection.execute("INSERT OR IGNORE INTO documents (id, text, token_count, created_at) "
+                                     "VALUES (?, ?, ?, ?)",
+                                     (document.id, document.text, document.token_count, document.created_at))
+            self._connection.commit()
+            self._memory_put(document)
+        logger.info("Registered document %s with %d tokens", document.id, document.token_count)
+        return document
+
+    def get(self, document_id: str) -> Optional[Document]:
+        with self._lock:
+            document = self._memory.get(document_id)
+            if document is not None:
+                self._memory.move_to_end(document_id)
+                return document
+            row = self._connection.execute(f"SELECT {self._COLUMNS} FROM documents WHERE id = ?",
+                                           (document_id,)).fetchone()
+            if row is None:
+                return None
+            document = Document(*row)
+            self._memory_put(document)
+        return document
+
+    def digest(self, document: Document, extract_digest: Callable[[str], str]) -> Optional[str]:
+        """
+        Returns the digest of the document, extracted with extract_digest on first use. None if the document is short,
+        the extraction fails or the digest is not shorter than the document. A failed extraction is only retried once
+        its backoff has passed
+        """
+        if document.token_count < self._digest_min_tokens:
+            return None
+        if document.digest is None:
+            document = self._extract_digest(document, extract_digest)
+        if document.digest is None or document.digest_token_count >= document.token_count:
+            return None
+        return document.digest
+
+    def stats(self) -> dict:
+        with self._lock:
+            row = self._connection.execute("SELECT COUNT(*), COUNT(digest), SUM(token_count), "
+                                           "SUM(digest_token_count) FROM documents").fetchone()
+            failed_digests = len(self._digest_failures)
+        return {"documents": row[0], "digests": row[1], "document_tokens": row[2] or 0, "digest_tokens": row[3] or 0,
+                "failed_digests": failed_digests}
+
+    def _extract_digest(self, document: Document, extract_digest: Callable[[str], str]) -> Document:
+        with self._lock:
+            digest_lock = self._digest_locks.setdefault(document.id, threading.Lock())
+        with digest_lock:
+            stored = self.get(document.id)
+            if stored.digest is not None:
+                return stored
+            with self._lock:
+                failures, retry_at = self._digest_failures.get(document.id, (0, 0.0))
+            if time.time() < retry_at:
+                return stored
+            try:
+                digest = extract_digest(document.text)
+            except Exception as e:
+                backoff = min(self._digest_retry_seconds * 2 ** failures, self._digest_max_retry_seconds)
+                with self._lock:
+                    self._digest_failures[document.id] = (failures + 1, time.time() + backoff)
+                logger.exception("Digest extraction of document %s failed, using its full text for %.0f s: %s",
+                                 document.id, backoff, e)
+                return stored
+            # documents are shared by the readers of the memory, so the digested document replaces the stored one
+            stored = replace(stored, digest=digest, digest_token_count=count_tokens(digest))
+            with self._lock:
+                self._digest_failures.pop(document.id, None)
+                self._connection.execute("UPDATE documents SET digest = ?, digest_token_count = ? WHERE id = ?",
+                                         (stored.digest, stored.digest_token_count, stored.id))
+                self._connection.commit()
+                self._memory_put(stored)
+        logger.info("Extracted digest of document %s: %d instead of %d tokens", document.id,
+                    stored.digest_token_count, stored.token_count)
+        return stored
+
+    def _memory_put(self, document: Document):
+        """Must be called holding the lock"""
+        self._memory[document.id] = document
+        self._memory.move_to_end(document.id)
+        while len(self._memory) > self._memory_max_documents:
+            self._memory.popitem(last=False)
+
+
+# registries shared by all evaluators of the process, keyed by their configuration
+_registries: Dict[str, DocumentRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_document_registry(document_params: dict) -> DocumentRegistry:
+    """
+    Returns the process-wide document registry for the documents config section
+    :param document_params: documents section of the config
+    """
+    key = json.dumps(document_params or {}, sort_keys=True, default=str)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            document_params = document_params or {}
+            registry = DocumentRegistry(db_path=document_params.get('DB_PATH') or ":memory:",
+                                        digest_min_tokens=document_params.get('DIGEST_MIN_TOKENS', 0),
+                                        digest_retry_seconds=document_params.get('DIGEST_RETRY_SECONDS', 60.0),
+                                        digest_max_retry_seconds=document_params.get('DIGEST_MAX_RETRY_SECONDS',
+                                                                                     3600.0),
+                                        memory_max_documents=document_params.get('MEMORY_MAX_DOCUMENTS', 256))
+            _registries[key] = registry
+            logger.info("Created document registry with %s", document_params)
+        return registry
@@ -1,20 +1,54 @@
+import asyncio
 import logging
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import List, Dict, Union
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from functools import lru_cache
+from typing import List, Dict, Union, Tuple, Optional, AsyncIterator, Type
 
-from langchain.pydantic_v1 import BaseModel
+from langchain.pydantic_v1 import BaseModel, ValidationError
 from langchain.output_parsers import ResponseSchema, StructuredOutputParser
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import HumanMessagePromptTemplate, ChatPromptTemplate, PromptTemplate
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableLambda
 
-from pydantic_models.evaluator import SummaryEvaluationItem, SummaryEvaluations, Errors, grammatical_errors_schema, \
-    summary_evaluation_item_schema, ModelFieldNotFoundError
-from static.summary_metrics import evaluation_metrics
+from app.models.pydantic.sessions import RecordingType
+from pydantic_models.evaluator import SummaryEvaluationItem, SummaryEvaluations, Errors, ErrorItem, \
+    grammatical_errors_schema, summary_evaluation_item_schema, ModelFieldNotFoundError, \
+    MultiMetricSummaryEvaluations, BatchErrors, PositionedErrorItem, DocumentDigest, PreScoresItem
+from services.cascade import ModelEscalation
+from services.documents import DocumentRegistry, Document
+from services.incremental_json import IncrementalJsonArrayParser
+from services.llm_cache import LlmResponseCache
+from services.llm_tiers import TieredLlmCaller, LlmTier
+from services.prescoring import LexicalPreScorer
+from services.prompt_compaction import compact_prompt_template, prompt_overhead_tokens
+from services.scheduler import LlmScheduler
+from services.semantic_cache import SemanticResultCache, model_version, changes_within, normalized_text
+from services.segmentation import split_sentences, pack_batches, locate_fragment, chunk_text
+from services.structured_output import NativeOutputParser, bind_structured_output, response_text
+from services.sentence_store import SentenceErrorsStore
+from services.token_accounting import TokenAccountant
+from services.tokens import count_tokens
+from static.summary_metrics import evaluation_metrics, RELEVANCE, CONSISTENCY
 
 # init module logger
 logger = logging.getLogger(__name__)
 
+# metrics evaluated on every excerpt of a long document, the others look at its digest or its first excerpt
+CHUNKED_METRICS = (RELEVANCE, CONSISTENCY)
+# metrics evaluated against the full text of the document, never its digest, as the digest paraphrases the facts the
+# summary has to be consistent with
+FULL_TEXT_METRICS = (CONSISTENCY,)
+# answered_by of the metrics of summaries settled by the pre-scoring gates
+PRESCORING_TIER = "lexical_prescoring"
+# answered_by of the metrics of summaries reusing the evaluation of a near-duplicate summary
+SEMANTIC_CACHE_TIER = "semantic_cache"
+
 
 class SchemaChainWrapper(ABC):
     @abstractmethod
@@ -22,12 +56,224 @@ class SchemaChainWrapper(ABC):
         """Transforms schema to pydantic Basemodel"""
 
 
+class NativeChainWrapper(ABC):
+    """
+    Chain components using the native structured output of the llm (OpenAI tool calls, Ollama format=json) instead
+    of parsing free text: the prompt only carries a compact JSON skeleton of the output model, and malformed output is
+    repaired locally
+    """
+    output_model: Type[BaseModel]
+
+    def _create_output_parser(self):
+        """Creates native output parser with the output model"""
+        self.output_parser = NativeOutputParser(pydantic_object=self.output_model)
+
+    def _bind_llm(self, llm: BaseLanguageModel) -> Runnable:
+        return bind_structured_output(llm, self.output_model)
+
+
 class ChainWrapper(ABC):
-    def __init__(self):
+    # recording type and metric the tokens of the chain are accounted to, unless the inputs name a metric_name
+    recording_type: Optional[str] = None
+    metric: Optional[str] = None
+
+    def __init__(self, cache: Optional[LlmResponseCache] = None, scheduler: Optional[LlmScheduler] = None,
+                 accountant: Optional[TokenAccountant] = None, compact_prompts: bool = True):
+        """
+        :param cache: cache of raw LLM responses consulted before every LLM call. None calls the LLM every time
+        :param scheduler: admission control every LLM call has to pass. None calls the LLM right away
+        :param accountant: records the prompt and completion tokens of every invocation. None does not account them
+        :param compact_prompts: normalizes the whitespace of the prompt template once it is built. The original
+        template is kept as original_prompt_template, and the tokens it adds to every prompt as
+        compaction_saved_tokens
+        """
         self.output_parser = None
         self.prompt_template = None
+        self.original_prompt_template = None
+        self.compaction_saved_tokens: Optional[int] = None
+        self._cache: Optional[LlmResponseCache] = cache
+        self._scheduler: Optional[LlmScheduler] = scheduler
+        self._accountant: Optional[TokenAccountant] = accountant
+        # compiled prompt | llm | parser chains by id of the llm (the llm is kept alive so that its id is not reused)
+        self._chains: Dict[int, Tuple[BaseLanguageModel, Runnable]] = {}
+        # schedulers of llms of other setups, e.g. fallback tiers, by id of the llm (kept alive like in _chains)
+        self._llm_schedulers: Dict[int, Tuple[BaseLanguageModel, Optional[LlmScheduler]]] = {}
+        self._chains_lock = threading.Lock()
         self._create_output_parser()
         self._create_prompt()
+        if compact_prompts:
+            self.original_prompt_template = self.prompt_template
+            self.prompt_template = compact_prompt_template(self.prompt_template)
+            # the inputs are rendered alike by both templates, so the difference is the same for every prompt
+            self.compaction_saved_tokens = prompt_overhead_tokens(self.original_prompt_template) - \
+                prompt_overhead_tokens(self.prompt_template)
+
+    def _get_chain(self, llm: BaseLanguageModel) -> Runnable:
+        """Returns the chain of prompt template, llm and output parser, composing it only on the first call per llm"""
+        compiled = self._chains.get(id(llm))
+        if compiled is None:
+            with self._chains_lock:
+                compiled = self._chains.get(id(llm))
+                if compiled is None:
+                    if self._cache is None and self._scheduler_of(llm) is None and self._accountant is None:
+                        compiled = (llm, self.prompt_template | self._bind_llm(llm) | self.output_parser)
+                    else:
+                        compiled = (llm, self._managed_chain(llm))
+                    self._chains[id(llm)] = compiled
+        return compiled[1]
+
+    async def astream_items(self, llm: BaseLanguageModel, array_key: str, inputs: dict) -> AsyncIterator[dict]:
+        """
+        Streams the LLM response for the prompt inputs and yields every object of the JSON array under array_key as
+        soon as it is complete. Cached responses are replayed, and a streamed response is cached once the output
+        parser accepts it.
+        """
+        prompt_value: PromptValue = await self.prompt_template.ainvoke(inputs)
+        prompt = prompt_value.to_string()
+        parser = IncrementalJsonArrayParser(array_key)
+        key = self._cache_key(prompt, llm)
+        if key is not None:
+            response = await asyncio.to_thread(self._cache.get, key)
+            if response is not None:
+                self._account(inputs, prompt, response, cached=True)
+                for item in parser.feed(response):
+                    yield item
+                return
+        chunks: List[str] = []
+        async for chunk in self._astream_llm(self._bind_llm(llm), prompt_value, prompt, self._scheduler_of(llm)):
+            chunks.append(chunk)
+            for item in parser.feed(chunk):
+                yield item
+        self._account(inputs, prompt, "".join(chunks))
+        if key is not None:
+            response = "".join(chunks)
+            try:
+                self.output_parser.parse(response)
+            except Exception as e:
+                logger.warning("Not caching unparsable streamed response: %s", e)
+            else:
+                await asyncio.to_thread(self._cache.put, key, response)
+
+    def set_cache(self, cache: Optional[LlmResponseCache]):
+        with self._chains_lock:
+            self._cache = cache
+            self._chains.clear()
+
+    def set_scheduler(self, scheduler: Optional[LlmScheduler]):
+        with self._chains_lock:
+            self._scheduler = scheduler
+            self._chains.clear()
+
+    def set_llm_scheduler(self, llm: BaseLanguageModel, scheduler: Optional[LlmScheduler]):
+        """Schedules the calls to llm, e.g. of a fallback tier, with the scheduler of its own setup"""
+        with self._chains_lock:
+            self._llm_schedulers[id(llm)] = (llm, scheduler)
+            self._chains.pop(id(llm), None)
+
+    def set_accountant(self, accountant: Optional[TokenAccountant]):
+        with self._chains_lock:
+            self._accountant = accountant
+            self._chains.clear()
+
+    def _managed_chain(self, llm: BaseLanguageModel) -> Runnable:
+        """
+        Returns a runnable that renders the prompt for its inputs, answers it from the cache or else calls the llm
+        through the scheduler, and accounts its tokens. The raw response is only cached once the output parser
+        accepted it, so malformed responses are retried on the next call.
+        """
+        bound_llm = self._bind_llm(llm)
+        scheduler = self._scheduler_of(llm)
+
+        def invoke(inputs: dict):
+            prompt_value: PromptValue = self.prompt_template.invoke(inputs)
+            prompt = prompt_value.to_string()
+            key = self._cache_key(prompt, llm)
+            response = self._cache.get(key) if key is not None else None
+            if response is not None:
+                self._account(inputs, prompt, response, cached=True)
+                return self.output_parser.parse(response)
+            response = self._call_llm(bound_llm, prompt_value, prompt, scheduler)
+            self._account(inputs, prompt, response)
+            parsed = self.output_parser.parse(response)
+            if key is not None:
+                self._cache.put(key, response)
+            return parsed
+
+        async def ainvoke(inputs: dict):
+            prompt_value: PromptValue = await self.prompt_template.ainvoke(inputs)
+            prompt = prompt_value.to_string()
+            key = self._cache_key(prompt, llm)
+            # the persistent tier of the cache is SQLite, which must not block the event loop
+            response = await asyncio.to_thread(self._cache.get, key) if key is not None else None
+            if response is not None:
+                self._account(inputs, prompt, response, cached=True)
+                return self.output_parser.parse(response)
+            response = await self._acall_llm(bound_llm, prompt_value, prompt, scheduler)
+            self._account(inputs, prompt, response)
+            parsed = self.output_parser.parse(response)
+            if key is not None:
+                await asyncio.to_thread(self._cache.put, key, response)
+            return parsed
+
+        return RunnableLambda(invoke, afunc=ainvoke)
+
+    def _account(self, inputs: dict, prompt: str, response: str, cached: bool = False):
+        """Records the tokens of an invocation, and the prompt tokens the uncompacted prompt would have cost"""
+        if self._accountant is None:
+            return
+        prompt_tokens = count_tokens(prompt)
+        original_prompt_tokens = None
+        if self.compaction_saved_tokens is not None:
+            original_prompt_tokens = prompt_tokens + self.compaction_saved_tokens
+        self._accountant.record(self.recording_type or "UNKNOWN", inputs.get("metric_name") or self.metric or "all",
+                                prompt_tokens, count_tokens(response), original_prompt_tokens, cached)
+
+    def _bind_llm(self, llm: BaseLanguageModel) -> Runnable:
+        """Returns the llm with the call options of the chain bound to it"""
+        return llm
+
+    def _cache_key(self, prompt: str, llm: BaseLanguageModel) -> Optional[str]:
+        if self._cache is None:
+            return None
+        return self._cache.make_key(prompt, llm, type(self).__name__)
+
+    def _scheduler_of(self, llm: BaseLanguageModel) -> Optional[LlmScheduler]:
+        """Returns the scheduler set for the llm, or else the scheduler of the chain"""
+        llm_scheduler = self._llm_schedulers.get(id(llm))
+        return llm_scheduler[1] if llm_scheduler is not None else self._scheduler
+
+    @staticmethod
+    def _call_llm(llm: Runnable, prompt_value: PromptValue, prompt: str, scheduler: Optional[LlmScheduler]) -> str:
+        if scheduler is None:
+            return response_text(llm.invoke(prompt_value))
+        with scheduler.slot(count_tokens(prompt)) as call:
+            response = response_text(llm.invoke(prompt_value))
+            call.completion_tokens = count_tokens(response)
+        return response
+
+    @staticmethod
+    async def _acall_llm(llm: Runnable, prompt_value: PromptValue, prompt: str,
+                         scheduler: Optional[LlmScheduler]) -> str:
+        if scheduler is None:
+            return response_text(await llm.ainvoke(prompt_value))
+        async with scheduler.aslot(count_tokens(prompt)) as call:
+            response = response_text(await llm.ainvoke(prompt_value))
+            call.completion_tokens = count_tokens(response)
+        return response
+
+    @staticmethod
+    async def _astream_llm(llm: Runnable, prompt_value: PromptValue, prompt: str,
+                           scheduler: Optional[LlmScheduler]) -> AsyncIterator[str]:
+        async with AsyncExitStack() as stack:
+            call = None
+            if scheduler is not None:
+                call = await stack.enter_async_context(scheduler.aslot(count_tokens(prompt)))
+            chunks: List[str] = []
+            async for chunk in llm.astream(prompt_value):
+                chunks.append(response_text(chunk))
+                yield chunks[-1]
+            if call is not None:
+                call.completion_tokens = count_tokens("".join(chunks))
 
     @abstractmethod
     def _create_prompt(self):
@@ -41,16 +287,33 @@ class ChainWrapper(ABC):
     def invoke(self, **kwargs) -> BaseModel:
         """Creates chain from output parser and prompt and calls invoke function from created chain"""
 
+    async def ainvoke(self, **kwargs) -> BaseModel:
+        """
+        Async counterpart of invoke. Falls back to running the sync invoke in the default executor for wrappers that
+        do not implement a native async chain call.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: self.invoke(**kwargs))
+
 
 class GrammaticalErrorsChainWrapper(ChainWrapper):
+    recording_type = RecordingType.LANGUAGE_PRODUCTION
+    metric = "grammar"
 
     def invoke(self, **kwargs) -> Errors:
         llm: BaseLanguageModel = kwargs.get("llm")
         text = kwargs.get("sentence")
-        chain = self.prompt_template | llm | self.output_parser
+        chain = self._get_chain(llm)
         errors: Errors = chain.invoke({"sentence": text})
         return errors
 
+    async def ainvoke(self, **kwargs) -> Errors:
+        llm: BaseLanguageModel = kwargs.get("llm")
+        text = kwargs.get("sentence")
+        chain = self._get_chain(llm)
+        errors: Errors = await chain.ainvoke({"sentence": text})
+        return errors
+
     def _create_prompt(self):
         """Creates prompt template for grammatical errors"""
         # The format instructions that LangChain makes. Let's look at them
@@ -70,11 +333,22 @@ class GrammaticalErrorsChainWrapper(ChainWrapper):
         self.output_parser = PydanticOutputParser(pydantic_object=Errors)
 
 
+class NativeGrammaticalErrorsChainWrapper(NativeChainWrapper, GrammaticalErrorsChainWrapper):
+    output_model = Errors
+
+
 class SchemaGrammaticalErrorsChainWrapper(GrammaticalErrorsChainWrapper, SchemaChainWrapper):
 
     def invoke(self, **kwargs):
         raise NotImplementedError("Unable to invoke chain from schema for grammatical errors.")
 
+    async def ainvoke(self, **kwargs):
+        raise NotImplementedError("Unable to invoke chain from schema for grammatical errors.")
+
+    async def astream_items(self, llm: BaseLanguageModel, array_key: str, inputs: dict) -> AsyncIterator[dict]:
+        raise NotImplementedError("Unable to stream chain from schema for grammatical errors.")
+        yield
+
     def transform_schema2model(self, response_schema: dict[str: str]) -> BaseModel:
         raise NotImplementedError("Unable to transform schema to model for grammatical errors.")
 
@@ -100,7 +374,54 @@ class SchemaGrammaticalErrorsChainWrapper(GrammaticalErrorsChainWrapper, SchemaC
         self.output_parser = StructuredOutputParser.from_response_schemas(response_schemas)
 
 
+class BatchGrammaticalErrorsChainWrapper(GrammaticalErrorsChainWrapper):
+    """
+    Extracts the grammatical errors of several numbered sentences with a single prompt. Every error is tagged with the
+    index of its sentence and its character offsets within that sentence.
+    """
+    metric = "grammar_batch"
+
+    def invoke(self, **kwargs) -> BatchErrors:
+        llm: BaseLanguageModel = kwargs.get("llm")
+        sentences: List[str] = kwargs.get("sentences")
+        chain = self._get_chain(llm)
+        errors: BatchErrors = chain.invoke({"sentences": self.number_sentences(sentences)})
+        return errors
+
+    async def ainvoke(self, **kwargs) -> BatchErrors:
+        llm: BaseLanguageModel = kwargs.get("llm")
+        sentences: List[str] = kwargs.get("sentences")
+        chain = self._get_chain(llm)
+        errors: BatchErrors = await chain.ainvoke({"sentences": self.number_sentences(sentences)})
+        return errors
+
+    @staticmethod
+    def number_sentences(sentences: List[str]) -> str:
+        return "\n".join(f"[{index}] {sentence}" for index, sentence in enumerate(sentences))
+
+    def _create_prompt(self):
+        """Creates prompt template for grammatical errors of numbered sentences"""
+        format_instructions = self.output_parser.get_format_instructions()
+
+        grammatical_errors_template = """Given the following numbered sentences, extract the grammatical errors of every sentence. Tag each error with the number of its sentence and the character offsets of the error within that sentence.\n{format_instructions}\n{sentences}"""
+
+        self.prompt_template = PromptTemplate(
+            input_variables=["sentences"],
+            template=grammatical_errors_template,
+            partial_variables={"format_instructions": format_instructions}
+        )
+
+    def _create_output_parser(self):
+        """Creates pydantic model output parser with BatchErrors"""
+        self.output_parser = PydanticOutputParser(pydantic_object=BatchErrors)
+
+
+class NativeBatchGrammaticalErrorsChainWrapper(NativeChainWrapper, BatchGrammaticalErrorsChainWrapper):
+    output_model = BatchErrors
+
+
 class SummaryChainWrapper(ChainWrapper):
+    recording_type = RecordingType.COMPREHENSION
     def invoke(self, **kwargs) -> Union[SummaryEvaluationItem, dict]:
         llm: BaseLanguageModel = kwargs.get("llm")
         criteria = kwargs.get("criteria")
@@ -108,13 +429,22 @@ class SummaryChainWrapper(ChainWrapper):
         eval_type = kwargs.get("metric_name")
         steps = kwargs.get("steps")
         text = kwargs.get("summary")
-        chain = self.prompt_template | llm | self.output_parser
+        chain = self._get_chain(llm)
         evaluation_result: Union[SummaryEvaluationItem, dict] = chain.invoke(
             {"criteria": criteria, "document": document,
              "metric_name": eval_type,
              "steps": steps, "summary": text})
         return evaluation_result
 
+    async def ainvoke(self, **kwargs) -> Union[SummaryEvaluationItem, dict]:
+        llm: BaseLanguageModel = kwargs.get("llm")
+        chain = self._get_chain(llm)
+        evaluation_result: Union[SummaryEvaluationItem, dict] = await chain.ainvoke(
+            {"criteria": kwargs.get("criteria"), "document": kwargs.get("document"),
+             "metric_name": kwargs.get("metric_name"),
+             "steps": kwargs.get("steps"), "summary": kwargs.get("summary")})
+        return evaluation_result
+
     def _create_prompt(self):
         """Returns prompt"""
         # The format instructions that LangChain makes. Let's look at them
@@ -126,6 +456,14 @@ class SummaryChainWrapper(ChainWrapper):
                 Please make sure you read and understand these instructions very carefully. 
                 Please keep this document open while reviewing, and refer to it as needed.
                 
+                Provide your evaluation in the following format:
+                
+                \n{format_instructions}\n
+
+                Source Text:
+
+                {document}
+
                 Metric Name:
                 {metric_name}
 
@@ -137,17 +475,9 @@ class SummaryChainWrapper(ChainWrapper):
 
                 {steps}
 
-                Source Text:
-
-                {document}
-
                 Summary:
 
                 {summary}
-                
-                Provide your evaluation in the following format:
-                
-                \n{format_instructions}\n
 
                 """
 
@@ -163,6 +493,10 @@ class SummaryChainWrapper(ChainWrapper):
         self.output_parser = PydanticOutputParser(pydantic_object=SummaryEvaluationItem)
 
 
+class NativeSummaryChainWrapper(NativeChainWrapper, SummaryChainWrapper):
+    output_model = SummaryEvaluationItem
+
+
 class SchemaSummaryChainWrapper(SummaryChainWrapper, SchemaChainWrapper):
     def invoke(self, **kwargs) -> SummaryEvaluationItem:
         llm: BaseLanguageModel = kwargs.get("llm")
@@ -176,6 +510,11 @@ class SchemaSummaryChainWrapper(SummaryChainWrapper, SchemaChainWrapper):
         evaluation_result_transformed: SummaryEvaluationItem = self.transform_schema2model(evaluation_result)
         return evaluation_result_transformed
 
+    async def ainvoke(self, **kwargs) -> SummaryEvaluationItem:
+        evaluation_result: dict = await super().ainvoke(**kwargs)
+        evaluation_result_transformed: SummaryEvaluationItem = self.transform_schema2model(evaluation_result)
+        return evaluation_result_transformed
+
     def _create_output_parser(self):
         """Creates pydantic model output parser with SummaryEvaluationItem"""
         # The parser that will look for the LLM output in my schema and return it back to me
@@ -195,10 +534,141 @@ class SchemaSummaryChainWrapper(SummaryChainWrapper, SchemaChainWrapper):
         return summary_evaluation_item
 
 
+class MultiMetricSummaryChainWrapper(SummaryChainWrapper):
+    """
+    Scores the summary on all metrics of evaluation_metrics with a single prompt, so the document is sent to the LLM
+    once per evaluation instead of once per metric.
+    """
+    metric = "all_metrics"
+
+    def invoke(self, **kwargs) -> SummaryEvaluations:
+        llm: BaseLanguageModel = kwargs.get("llm")
+        chain = self._get_chain(llm)
+        evaluation_result: MultiMetricSummaryEvaluations = chain.invoke(
+            {"document": kwargs.get("document"), "summary": kwargs.get("summary")})
+        return SummaryEvaluations(evaluations=evaluation_result.evaluations)
+
+    async def ainvoke(self, **kwargs) -> SummaryEvaluations:
+        llm: BaseLanguageModel = kwargs.get("llm")
+        chain = self._get_chain(llm)
+        evaluation_result: MultiMetricSummaryEvaluations = await chain.ainvoke(
+            {"document": kwargs.get("document"), "summary": kwargs.get("summary")})
+        return SummaryEvaluations(evaluations=evaluation_result.evaluations)
+
+    def _create_prompt(self):
+        """Returns prompt with the criteria and steps of every metric"""
+        format_instructions = self.output_parser.get_format_instructions()
+        metrics = "\n".join(f"Metric Name: {metric_name}\n\nEvaluation Criteria:\n{criteria}\n"
+                            f"Evaluation Steps:\n{steps}"
+                            for metric_name, (criteria, steps) in evaluation_metrics.items())
+
+        evaluation_prompt_template = """
+                You will be given one afrikaans summary written for an AFRIKAANS article. Your task is to rate the 
+                summary on each of the following metrics: {metric_names}.
+                Please make sure you read and understand these instructions very carefully. 
+                Please keep this document open while reviewing, and refer to it as needed.
+
+                {metrics}
+
+                Provide one evaluation per metric in the following format:
+
+                \n{format_instructions}\n
+
+                Source Text:
+
+                {document}
+
+                Summary:
+
+                {summary}
+
+                """
+
+        self.prompt_template = PromptTemplate(
+            input_variables=["document", "summary"],
+            template=evaluation_prompt_template,
+            partial_variables={"format_instructions": format_instructions,
+                               "metric_names": ", ".join(evaluation_metrics.keys()),
+                               "metrics": metrics}
+        )
+
+    def _create_output_parser(self):
+        """Creates pydantic model output parser with MultiMetricSummaryEvaluations"""
+        self.output_parser = PydanticOutputParser(pydantic_object=MultiMetricSummaryEvaluations)
+
+
+class DocumentDigestChainWrapper(ChainWrapper):
+    """Extracts the main topic and key points of a source document, which summaries are then evaluated against"""
+    recording_type = RecordingType.COMPREHENSION
+    metric = "document_digest"
+
+    def invoke(self, **kwargs) -> DocumentDigest:
+        llm: BaseLanguageModel = kwargs.get("llm")
+        chain = self._get_chain(llm)
+        digest: DocumentDigest = chain.invoke({"document": kwargs.get("document")})
+        return digest
+
+    async def ainvoke(self, **kwargs) -> DocumentDigest:
+        llm: BaseLanguageModel = kwargs.get("llm")
+        chain = self._get_chain(llm)
+        digest: DocumentDigest = await chain.ainvoke({"document": kwargs.get("document")})
+        return digest
+
+    @staticmethod
+    def render(digest: DocumentDigest) -> str:
+        """Renders the digest as the source text of the summary evaluation prompts"""
+        key_points = "\n".join(f"{index}. {key_point}" for index, key_point in enumerate(digest.key_points, 1))
+        return (f"Main topic of the article: {digest.main_topic}\n"
+                f"Key points and main facts of the article, in the order the article presents them:\n{key_points}")
+
+    @staticmethod
+    def merge(digests: List[DocumentDigest]) -> DocumentDigest:
+        """
+        Merges the digests of consecutive excerpts of a document: the main topic of the first excerpt, and the key
+        points of all excerpts in order, without the repeated key points of the text the excerpts share
+        """
+        key_points = list(dict.fromkeys(key_point.strip() for digest in digests for key_point in digest.key_points))
+        return DocumentDigest(main_topic=digests[0].main_topic, key_points=key_points)
+
+    def _create_prompt(self):
+        """Returns prompt"""
+        format_instructions = self.output_parser.get_format_instructions()
+
+        digest_prompt_template = """
+                You will be given an AFRIKAANS article. Summaries of the article will later be evaluated against your 
+                notes instead of the article, so your notes must contain everything needed to judge whether a summary 
+                covers the important content of the article and is factually consistent with it.
+                Identify the main topic of the article, and list its key points and main facts (names, numbers, dates, 
+                causes and consequences) in Afrikaans, one short sentence each.
+
+                Provide your notes in the following format:
+
+                \n{format_instructions}\n
+
+                Article:
+
+                {document}
+
+                """
+
+        self.prompt_template = PromptTemplate(
+            input_variables=["document"],
+            template=digest_prompt_template,
+            partial_variables={"format_instructions": format_instructions}
+        )
+
+    def _create_output_parser(self):
+        """Creates pydantic model output parser with DocumentDigest"""
+        self.output_parser = PydanticOutputParser(pydantic_object=DocumentDigest)
+
+
 class TextEvaluator(ABC):
     def __init__(self, llm: BaseLanguageModel, chain_comps: ChainWrapper):
         self._llm: BaseLanguageModel = llm
         self._chain_comps = chain_comps
+        self._escalation: Optional[ModelEscalation] = None
+        self._semantic_cache: Optional[SemanticResultCache] = None
+        self._semantic_threshold: Optional[float] = None
 
     def set_llm(self, llm):
         self._llm = llm
@@ -206,13 +676,62 @@ class TextEvaluator(ABC):
     def set_chain_comps(self, chain_comps: ChainWrapper):
         self._chain_comps = chain_comps
 
+    def set_escalation(self, escalation: Optional[ModelEscalation]):
+        """
+        Makes this evaluator the first stage of a model cascade: its doubtful evaluations are escalated to the
+        evaluator of the escalation. None evaluates with this evaluator only
+        """
+        self._escalation = escalation
+
+    def escalation_stats(self) -> Optional[dict]:
+        """Returns the escalation counters of the model cascade, or None if this evaluator does not escalate"""
+        return None if self._escalation is None else self._escalation.stats()
+
+    def set_semantic_cache(self, semantic_cache: Optional[SemanticResultCache], threshold: Optional[float] = None):
+        """
+        Reuses the evaluations of near-duplicate texts from the semantic cache, and stores new evaluations in it.
+        None evaluates every text
+        :param threshold: similarity from which evaluations are reused. None uses the threshold of the cache
+        """
+        self._semantic_cache = semantic_cache
+        self._semantic_threshold = threshold
+
+    def model_version(self) -> str:
+        """
+        Version of the llm, prompt and output parser the evaluations are produced with, and of the escalation
+        evaluator in a model cascade. Evaluations of another model version are never reused
+        """
+        return model_version(self._llm._llm_type, getattr(self._llm, "model_name", None) or
+                             getattr(self._llm, "model", None), getattr(self._llm, "temperature", None),
+                             type(self._chain_comps).__name__, self._chain_comps.prompt_template,
+                             None if self._escalation is None else self._escalation.evaluator.model_version())
+
     def evaluate(self, text) -> BaseModel:
         ...
 
+    def astream_evaluate(self, text) -> AsyncIterator[BaseModel]:
+        """Yields the items of the evaluation of text as soon as each of them is available"""
+        raise NotImplementedError(f"{type(self).__name__} does not support streaming evaluations")
+
 
 class GrammaticalEvaluator(TextEvaluator):
-    def __init__(self, llm: BaseLanguageModel, chain_comps: ChainWrapper):
+    def __init__(self, llm: BaseLanguageModel, chain_comps: ChainWrapper,
+                 batch_chain_comps: Optional[BatchGrammaticalErrorsChainWrapper] = None,
+                 max_batch_tokens: int = 1000, max_concurrency: int = 4,
+                 sentence_store: Optional[SentenceErrorsStore] = None):
+        """
+        :param batch_chain_comps: chain components evaluating several sentences per prompt, used by evaluate_many and
+        evaluate_transcript. None evaluates every text with its own prompt
+        :param max_batch_tokens: maximum number of sentence tokens packed into one batch prompt
+        :param max_concurrency: maximum number of batch prompts sent to the LLM at once
+        :param sentence_store: store of the errors per sentence. If set, evaluate_transcript only sends sentences to
+        the LLM that have not been evaluated before
+        """
         super().__init__(llm, chain_comps)
+        self._batch_chain_comps: Optional[BatchGrammaticalErrorsChainWrapper] = batch_chain_comps
+        self._sentence_store: Optional[SentenceErrorsStore] = sentence_store
+        self._max_batch_tokens: int = max_batch_tokens
+        self._max_concurrency: int = max(1, max_concurrency)
 
     def evaluate(self, text: str) -> Errors:
         """
@@ -220,32 +739,755 @@ class GrammaticalEvaluator(TextEvaluator):
         :param text:
         :return: Errors (BaseModel)
         """
-        errors = self._chain_comps.invoke(sentence=text, llm=self._llm)
+        errors = self._cached_errors(text)
+        if errors is None:
+            errors = self._escalated([text], [self._evaluate_single(text)])[0]
+            self._cache_errors(text, errors)
+        return errors
+
+    async def astream_evaluate(self, text: str) -> AsyncIterator[ErrorItem]:
+        """
+        Streams the LLM response and yields every ErrorItem as soon as it has been parsed from the streamed tokens
+        :param text:
+        :return: ErrorItem's in the order the LLM found them. In a model cascade the items are only yielded once the
+        first stage finished, as a doubtful evaluation is replaced by the stream of the escalation evaluator
+        """
+        errors = self._cached_errors(text)
+        if errors is not None:
+            for item in errors.error:
+                yield item
+            return
+        items: List[ErrorItem] = []
+        async for item in self._astream_evaluate(text):
+            items.append(item)
+            yield item
+        self._cache_errors(text, Errors(error=items))
+
+    async def _astream_evaluate(self, text: str) -> AsyncIterator[ErrorItem]:
+        if self._escalation is None:
+            async for item in self._astream_items(text):
+                yield item
+            return
+        try:
+            errors: Optional[Errors] = Errors(error=[item async for item in self._astream_items(text)])
+        except Exception as e:
+            logger.warning("Streamed grammatical evaluation failed: %r", e)
+            errors = None
+        reasons = self._escalation.errors_reasons(text, errors)
+        self._escalation.record(reasons)
+        if not reasons:
+            for item in errors.error:
+                yield item
+            return
+        logger.info("Escalating the grammatical evaluation to %s: %s", self._escalation.name, reasons)
+        async for item in self._escalation.evaluator.astream_evaluate(text):
+            yield item
+
+    async def _astream_items(self, text: str) -> AsyncIterator[ErrorItem]:
+        async for item in self._chain_comps.astream_items(self._llm, "error", {"sentence": text}):
+            try:
+                yield ErrorItem.parse_obj(item)
+            except ValidationError as e:
+                logger.warning("Skipping invalid streamed error item %s: %s", item, e)
+        logger.info("The grammatical evaluation was streamed")
+
+    def evaluate_many(self, texts: List[str]) -> List[Errors]:
+        """
+        Finds the grammatical errors of several texts. The texts are packed into token bounded batches and each batch
+        is evaluated with a single prompt. The errors are PositionedErrorItem's whose sentence_index is the index of
+        their text and whose offsets are relative to that text.
+        :param texts: sentences or short texts
+        :return: one Errors per text, in the order of texts
+        """
+        if self._semantic_cache is None:
+            return self._evaluate_many(texts)
+        errors_per_text: List[Optional[Errors]] = [self._cached_errors(text, index) for index, text in enumerate(texts)]
+        missing = [index for index, errors in enumerate(errors_per_text) if errors is None]
+        if missing:
+            for index, errors in zip(missing, self._evaluate_many([texts[index] for index in missing])):
+                for error_item in errors.error:
+                    if isinstance(error_item, PositionedErrorItem):
+                        error_item.sentence_index = index
+                self._cache_errors(texts[index], errors)
+                errors_per_text[index] = errors
+        return errors_per_text
+
+    def _evaluate_many(self, texts: List[str]) -> List[Errors]:
+        if self._batch_chain_comps is None:
+            return self._escalated(texts, [self._evaluate_single(text) for text in texts])
+        batches = pack_batches(texts, self._max_batch_tokens)
+        errors_per_text: List[Optional[Errors]] = [None] * len(texts)
+        with ThreadPoolExecutor(max_workers=max(1, min(self._max_concurrency, len(batches)))) as executor:
+            for batch, batch_errors in zip(batches, executor.map(lambda b: self._evaluate_batch(texts, b), batches)):
+                for index, errors in zip(batch, batch_errors):
+                    errors_per_text[index] = errors
+        logger.info("The grammatical evaluation of %d texts in %d batches was performed", len(texts), len(batches))
+        return self._escalated(texts, errors_per_text)
+
+    def evaluate_transcript(self, text: str) -> List[Errors]:
+        """
+        Splits text into sentences and finds the grammatical errors of all sentences in batches. With a sentence
+        store, only new or changed sentences are sent to the LLM and the errors of the others are reused. Offsets of
+        the errors are relative to text and sentence_index is the index of the sentence in text.
+        :param text: transcript of a recording
+        :return: one Errors per sentence, in the order of the sentences
+        """
+        sentences = split_sentences(text)
+        sentence_texts = [sentence.text for sentence in sentences]
+        if self._sentence_store is None:
+            errors_per_sentence = self.evaluate_many(sentence_texts)
+        else:
+            errors_per_sentence = self._evaluate_changed_sentences(sentence_texts)
+        for sentence, errors in zip(sentences, errors_per_sentence):
+            for error_item in errors.error:
+                if isinstance(error_item, PositionedErrorItem) and error_item.start is not None:
+                    error_item.start += sentence.start
+                    error_item.end += sentence.start
+        return errors_per_sentence
+
+    def _evaluate_changed_sentences(self, sentences: List[str]) -> List[Errors]:
+        """Reuses the stored errors of known sentences and evaluates (each distinct) unknown sentence once"""
+        errors_per_sentence: List[Optional[Errors]] = [self._sentence_store.get(sentence, index)
+                                                       for index, sentence in enumerate(sentences)]
+        unknown: Dict[str, List[int]] = {}
+        for index, (sentence, errors) in enumerate(zip(sentences, errors_per_sentence)):
+            if errors is None:
+                unknown.setdefault(SentenceErrorsStore.make_key(sentence), []).append(index)
+        unknown_sentences = [sentences[indices[0]] for indices in unknown.values()]
+        for indices, sentence, errors in zip(unknown.values(), unknown_sentences,
+                                             self.evaluate_many(unknown_sentences)):
+            self._sentence_store.put(sentence, errors)
+            for index in indices:
+                errors_per_sentence[index] = self._sentence_store.get(sentences[index], index)
+        logger.info("Re-evaluated %d of %d sentences", len(unknown_sentences), len(sentences))
+        return errors_per_sentence
+
+    def _evaluate_batch(self, texts: List[str], batch: List[int]) -> List[Errors]:
+        batch_texts = [texts[index] for index in batch]
+        try:
+            batch_errors: BatchErrors = self._batch_chain_comps.invoke(llm=self._llm, sentences=batch_texts)
+        except Exception as e:
+            logger.exception("Batch evaluation of %d texts failed, evaluating them one by one: %s", len(batch), e)
+            return [self._evaluate_single(text) for text in batch_texts]
+        error_items: List[List[PositionedErrorItem]] = [[] for _ in batch]
+        for error_item in batch_errors.error:
+            batch_index = error_item.sentence_index
+            if not 0 <= batch_index < len(batch):
+                logger.warning("Dropping error '%s' of unknown sentence %d", error_item.error, batch_index)
+                continue
+            error_item.start, error_item.end = locate_fragment(batch_texts[batch_index], error_item.error,
+                                                               error_item.start, error_item.end)
+            error_item.sentence_index = batch[batch_index]
+            error_items[batch_index].append(error_item)
+        return [Errors(error=items) for items in error_items]
+
+    def _evaluate_single(self, text: str) -> Optional[Errors]:
+        """
+        Evaluates the text with a prompt of its own. In a model cascade a failed evaluation returns None, to be
+        escalated, otherwise the error is raised
+        """
+        try:
+            errors = self._chain_comps.invoke(sentence=text, llm=self._llm)
+        except Exception as e:
+            if self._escalation is None:
+                raise
+            logger.warning("Grammatical evaluation failed, escalating it: %r", e)
+            return None
         logger.info("The grammatical evaluation was performed")
         return errors
 
+    def _cached_errors(self, text: str, sentence_index: Optional[int] = None) -> Optional[Errors]:
+        """
+        Returns the errors of a near-duplicate text from the semantic cache, or None. The errors of a near-duplicate are
+        only reused if the texts differ only where errors were found, as a new error elsewhere would go unnoticed;
+        errors the text no longer contains (it fixed them) are dropped and the others are located in the text
+        """
+        if self._semantic_cache is None:
+            return None
+        cached = self._semantic_cache.get(self._chain_comps.recording_type, None, self.model_version(), text,
+                                          accept=lambda cached_text, errors: self._reusable(cached_text, errors, text),
+                                          threshold=self._semantic_threshold)
+        if cached is None:
+            return None
+        errors, similarity = cached
+        error_items = []
+        for error_item in errors.error:
+            start, end = locate_fragment(text, error_item.error)
+            if start is None:
+                continue
+            if sentence_index is not None:
+                error_item = PositionedErrorItem(**dict(error_item.dict(), sentence_index=sentence_index))
+            if isinstance(error_item, PositionedErrorItem):
+                error_item.start, error_item.end = start, end
+            error_items.append(error_item)
+        errors.error = error_items
+        logger.info("Reusing the grammatical evaluation of a near-duplicate text (similarity %.3f)", similarity)
+        return errors
+
+    @staticmethod
+    def _reusable(cached_text: str, errors: Errors, text: str) -> bool:
+        spans = [locate_fragment(cached_text, error_item.error, getattr(error_item, "start", None),
+                                 getattr(error_item, "end", None)) for error_item in errors.error]
+        return all(start is not None for start, _ in spans) and changes_within(cached_text, text, spans)
+
+    def _cache_errors(self, text: str, errors: Errors):
+        if self._semantic_cache is not None:
+            self._semantic_cache.put(self._chain_comps.recording_type, None, self.model_version(), text, errors)
+
+    def _escalated(self, texts: List[str], errors_per_text: List[Optional[Errors]]) -> List[Errors]:
+        """Replaces the errors of the texts the escalation doubts by the errors the escalation evaluator finds"""
+        if self._escalation is None:
+            return errors_per_text
+        doubtful: List[int] = []
+        for index, (text, errors) in enumerate(zip(texts, errors_per_text)):
+            reasons = self._escalation.errors_reasons(text, errors)
+            self._escalation.record(reasons)
+            if reasons:
+                logger.info("Escalating the grammatical evaluation of text %d to %s: %s", index,
+                            self._escalation.name, reasons)
+                doubtful.append(index)
+        if not doubtful:
+            return errors_per_text
+        escalated = self._escalation.evaluator.evaluate_many([texts[index] for index in doubtful])
+        for index, errors in zip(doubtful, escalated):
+            for error_item in errors.error:
+                if isinstance(error_item, PositionedErrorItem):
+                    error_item.sentence_index = index
+            errors_per_text[index] = errors
+        return errors_per_text
+
 
 class SummaryEvaluator(TextEvaluator):
-    def __init__(self, llm: BaseLanguageModel, chain_comps: ChainWrapper, document: str):
+    def __init__(self, llm: BaseLanguageModel, chain_comps: ChainWrapper, documents: DocumentRegistry,
+                 default_document_id: Optional[str] = None, max_concurrency: int = len(evaluation_metrics),
+                 llm_tiers: Optional[TieredLlmCaller] = None, evaluation_timeout: Optional[float] = None,
+                 digest_chain_comps: Optional[DocumentDigestChainWrapper] = None,
+                 long_document_tokens: Optional[int] = None, chunk_tokens: int = 1500,
+                 chunk_overlap_tokens: int = 150, prescorer: Optional[LexicalPreScorer] = None):
+        """
+        :param documents: registry of the source documents the summaries are evaluated against
+        :param default_document_id: document of evaluations that do not name one
+        :param max_concurrency: maximum number of metric chains sent to the LLM at once. 1 evaluates the metrics
+        sequentially.
+        :param llm_tiers: tiers the metric chains run against, with per call timeouts, hedged requests and fallbacks.
+        None runs them against llm only
+        :param evaluation_timeout: seconds an evaluation may take. Metrics not scored by then are returned unscored
+        :param digest_chain_comps: chain components extracting the key point digest of a document, which is then sent
+        to the LLM instead of the full document for the metrics outside of FULL_TEXT_METRICS. The digest of a long
+        document is extracted per excerpt and merged. Unused by multi metric chain components, whose prompt includes
+        the metrics in FULL_TEXT_METRICS. None sends the full document
+        :param long_document_tokens: registered documents with more tokens are split into overlapping excerpts, the
+        metrics in CHUNKED_METRICS are evaluated per excerpt and reduced to one item per metric. None never splits
+        documents
+        :param chunk_tokens: maximum number of tokens per excerpt
+        :param chunk_overlap_tokens: tokens consecutive excerpts share
+        :param prescorer: lexical pre-scoring against the document. Summaries its gates flag are scored without the
+        LLM, the pre-scores of the others are attached to their evaluation. None skips pre-scoring
+        """
         super().__init__(llm, chain_comps)
-        self._document: str = document
+        self._documents: DocumentRegistry = documents
+        self._default_document_id: Optional[str] = default_document_id
+        self._digest_chain_comps: Optional[DocumentDigestChainWrapper] = digest_chain_comps
+        self._max_concurrency: int = max(1, max_concurrency)
+        if llm_tiers is None and evaluation_timeout is not None:
+            llm_tiers = TieredLlmCaller([LlmTier("primary", llm)])
+        self._llm_tiers: Optional[TieredLlmCaller] = llm_tiers
+        self._schedule_tiers(chain_comps)
+        self._evaluation_timeout: Optional[float] = evaluation_timeout
+        self._long_document_tokens: Optional[int] = long_document_tokens
+        self._chunk_tokens: int = chunk_tokens
+        self._chunk_overlap_tokens: int = chunk_overlap_tokens
+        self._prescorer: Optional[LexicalPreScorer] = prescorer
+
+    def set_chain_comps(self, chain_comps: ChainWrapper):
+        self._schedule_tiers(chain_comps)
+        super().set_chain_comps(chain_comps)
 
-    def evaluate(self, text: str) -> SummaryEvaluations:
+    def _schedule_tiers(self, chain_comps: ChainWrapper):
         """
-        :param document:
-        :param text:
-        :return:
+        Has the chain components schedule the calls to the fallback tiers with the schedulers of their own setups,
+        instead of taking a slot of the scheduler of the setup of llm
         """
+        for tier in self._llm_tiers.tiers if self._llm_tiers is not None else []:
+            if tier.llm is not self._llm:
+                chain_comps.set_llm_scheduler(tier.llm, tier.scheduler)
 
-        evaluation: SummaryEvaluations = SummaryEvaluations()
-        for eval_type, (criteria, steps) in evaluation_metrics.items():
-            evaluation_result: BaseModel = self._chain_comps.invoke(llm=self._llm, criteria=criteria,
-                                                                    document=self._document,
-                                                                    metric_name=eval_type, steps=steps, summary=text)
-            evaluation.evaluations.append(evaluation_result)
+    def evaluate(self, text: str, document_id: Optional[str] = None) -> SummaryEvaluations:
+        """
+        Evaluates the summary on every metric in evaluation_metrics. Metric chains run concurrently on a bounded
+        thread pool; the evaluations keep the order of evaluation_metrics.
+        :param text: summary to evaluate
+        :param document_id: registered document the summary was written for. None uses the default document
+        :return: SummaryEvaluations (BaseModel)
+        """
+        return self.evaluate_many([text], document_id)[0]
 
+    def evaluate_many(self, texts: List[str], document_id: Optional[str] = None) -> List[SummaryEvaluations]:
+        """
+        Evaluates several summaries of the same document. The summaries are pre-scored together, and only the ones
+        the pre-scoring gates do not settle are sent to the LLM.
+        :param texts: summaries to evaluate
+        :param document_id: registered document the summaries were written for. None uses the default document
+        :return: one SummaryEvaluations per summary, in the order of texts
+        """
+        pre_scores = self._pre_score(texts, document_id)
+        evaluations: List[SummaryEvaluations] = []
+        for text, text_pre_scores in zip(texts, pre_scores):
+            evaluation = self._gated_evaluation(text_pre_scores)
+            if evaluation is None:
+                evaluation = self._cached_evaluation(text, document_id)
+                if evaluation is None:
+                    evaluation = self._escalated(text, document_id, self._evaluate_with_llm(text, document_id))
+                    self._cache_evaluation(text, document_id, evaluation)
+                evaluation.pre_scores = text_pre_scores or {}
+            evaluations.append(evaluation)
+        return evaluations
+
+    def _evaluate_with_llm(self, text: str, document_id: Optional[str]) -> SummaryEvaluations:
+        deadline = self._deadline()
+        excerpts, digest = self._sources(document_id)
+        answered_by: Dict[str, str] = {}
+        if isinstance(self._chain_comps, MultiMetricSummaryChainWrapper):
+            evaluations = self._map(lambda excerpt: self._evaluate_all_metrics(text, excerpt, deadline), excerpts)
+            logger.info("The summary evaluation was performed")
+            return self._reduce_all_metrics(evaluations, answered_by)
+
+        calls = [(eval_type, criteria, steps, source) for eval_type, (criteria, steps) in evaluation_metrics.items()
+                 for source in self._metric_sources(excerpts, digest, eval_type)]
+        outcomes = self._map(lambda call: self._evaluate_call(text, call[3], *call[:3], deadline), calls)
+        results = [self._reduce_metric(eval_type, [outcome for call, outcome in zip(calls, outcomes)
+                                                   if call[0] == eval_type], answered_by)
+                   for eval_type in evaluation_metrics]
+
+        evaluation: SummaryEvaluations = SummaryEvaluations(evaluations=results, answered_by=answered_by)
         logger.info("The summary evaluation was performed")
         return evaluation
 
-    def set_document(self, document: str):
-        self._document = document
+    async def aevaluate(self, text: str, document_id: Optional[str] = None) -> SummaryEvaluations:
+        """
+        Async counterpart of evaluate. All metric chains are awaited together, bounded by max_concurrency.
+        :param text: summary to evaluate
+        :param document_id: registered document the summary was written for. None uses the default document
+        :return: SummaryEvaluations (BaseModel)
+        """
+        pre_scores = (await self._apre_score([text], document_id))[0]
+        evaluation = self._gated_evaluation(pre_scores)
+        if evaluation is None:
+            evaluation = await self._acached_evaluation(text, document_id)
+            if evaluation is None:
+                evaluation = await self._aescalated(text, document_id,
+                                                    await self._aevaluate_with_llm(text, document_id))
+                self._cache_evaluation(text, document_id, evaluation)
+            evaluation.pre_scores = pre_scores or {}
+        return evaluation
+
+    async def _aevaluate_with_llm(self, text: str, document_id: Optional[str]) -> SummaryEvaluations:
+        deadline = self._deadline()
+        excerpts, digest = await self._asources(document_id)
+        answered_by: Dict[str, str] = {}
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+        if isinstance(self._chain_comps, MultiMetricSummaryChainWrapper):
+            evaluations = await asyncio.gather(*(self._aevaluate_all_metrics(text, excerpt, semaphore, deadline)
+                                                 for excerpt in excerpts))
+            logger.info("The summary evaluation was performed")
+            return self._reduce_all_metrics(list(evaluations), answered_by)
+
+        results = await asyncio.gather(*(self._aevaluate_metric(text, self._metric_sources(excerpts, digest, eval_type),
+                                                                eval_type, criteria, steps, semaphore, deadline,
+                                                                answered_by)
+                                         for eval_type, (criteria, steps) in evaluation_metrics.items()))
+        evaluation: SummaryEvaluations = SummaryEvaluations(evaluations=list(results), answered_by=answered_by)
+        logger.info("The summary evaluation was performed")
+        return evaluation
+
+    async def astream_evaluate(self, text: str, document_id: Optional[str] = None
+                               ) -> AsyncIterator[SummaryEvaluationItem]:
+        """
+        Yields the evaluation of every metric as soon as it is finished, so in order of completion rather than in the
+        order of evaluation_metrics. In a model cascade the items are only yielded once the whole evaluation is
+        finished, as the escalation depends on all metrics, and so are the items of multi metric chains with llm
+        tiers. With a prescorer, the lexical pre-scores of the summary are yielded first, whether the evaluation is
+        gated, cached or scored by the LLM.
+        :param text: summary to evaluate
+        :param document_id: registered document the summary was written for. None uses the default document
+        :return: a PreScoresItem with a prescorer, then SummaryEvaluationItem's
+        """
+        pre_scores = (await self._apre_score([text], document_id))[0]
+        if pre_scores is not None:
+            yield PreScoresItem(pre_scores=pre_scores)
+        evaluation = self._gated_evaluation(pre_scores) or await self._acached_evaluation(text, document_id)
+        if evaluation is not None:
+            for item in evaluation.evaluations:
+                yield item
+            return
+        items: List[SummaryEvaluationItem] = []
+        async for item in self._astream_evaluate(text, document_id):
+            items.append(item)
+            yield item
+        self._cache_evaluation(text, document_id, self._order_by_metric(SummaryEvaluations(evaluations=items)))
+
+    async def _astream_evaluate(self, text: str, document_id: Optional[str]) -> AsyncIterator[SummaryEvaluationItem]:
+        if self._escalation is not None:
+            for item in (await self._aescalated(text, document_id,
+                                                await self._aevaluate_with_llm(text, document_id))).evaluations:
+                yield item
+            return
+        excerpts, digest = await self._asources(document_id)
+        if isinstance(self._chain_comps, MultiMetricSummaryChainWrapper):
+            if len(excerpts) > 1 or self._llm_tiers is not None:
+                # the items of a long document are only known once all excerpts are reduced, and the tiers time out,
+                # hedge and fall back whole calls rather than streams
+                for item in (await self._aevaluate_with_llm(text, document_id)).evaluations:
+                    yield item
+                return
+            async for item in self._chain_comps.astream_items(self._llm, "evaluations",
+                                                              {"document": excerpts[0], "summary": text}):
+                try:
+                    yield SummaryEvaluationItem.parse_obj(item)
+                except ValidationError as e:
+                    logger.warning("Skipping invalid streamed evaluation item %s: %s", item, e)
+            logger.info("The summary evaluation was streamed")
+            return
+
+        deadline = self._deadline()
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+        tasks = [asyncio.ensure_future(self._aevaluate_metric(text, self._metric_sources(excerpts, digest, eval_type),
+                                                              eval_type, criteria, steps, semaphore, deadline))
+                 for eval_type, (criteria, steps) in evaluation_metrics.items()]
+        try:
+            for next_finished in asyncio.as_completed(tasks):
+                yield await next_finished
+        finally:
+            for task in tasks:
+                task.cancel()
+        logger.info("The summary evaluation was streamed")
+
+    def _escalation_reasons(self, evaluation: SummaryEvaluations) -> List[str]:
+        if self._escalation is None:
+            return []
+        reasons = self._escalation.summary_reasons(evaluation)
+        self._escalation.record(reasons)
+        if reasons:
+            logger.info("Escalating the summary evaluation to %s: %s", self._escalation.name, reasons)
+        return reasons
+
+    def _escalated(self, text: str, document_id: Optional[str],
+                   evaluation: SummaryEvaluations) -> SummaryEvaluations:
+        """Returns the evaluation of the escalation evaluator if the escalation doubts evaluation, else evaluation"""
+        reasons = self._escalation_reasons(evaluation)
+        if not reasons:
+            return evaluation
+        try:
+            escalated = self._escalation.evaluator._evaluate_with_llm(text, document_id)
+        except Exception as e:
+            self._escalation.record_failure(e)
+            return evaluation
+        return self._merge_escalated(evaluation, escalated, reasons)
+
+    async def _aescalated(self, text: str, document_id: Optional[str],
+                          evaluation: SummaryEvaluations) -> SummaryEvaluations:
+        reasons = self._escalation_reasons(evaluation)
+        if not reasons:
+            return evaluation
+        try:
+            escalated = await self._escalation.evaluator._aevaluate_with_llm(text, document_id)
+        except Exception as e:
+            self._escalation.record_failure(e)
+            return evaluation
+        return self._merge_escalated(evaluation, escalated, reasons)
+
+    def _merge_escalated(self, evaluation: SummaryEvaluations, escalated: SummaryEvaluations,
+                         reasons: List[str]) -> SummaryEvaluations:
+        """Takes the metrics of the escalated evaluation, except the ones it could not score but the first stage did"""
+        items, answered_by = [], {}
+        for item, escalated_item in zip(evaluation.evaluations, escalated.evaluations):
+            if escalated_item.score is None and item.score is not None:
+                items.append(item)
+                if item.metric in evaluation.answered_by:
+                    answered_by[item.metric] = evaluation.answered_by[item.metric]
+            else:
+                items.append(escalated_item)
+                answered_by[escalated_item.metric] = escalated.answered_by.get(escalated_item.metric,
+                                                                               self._escalation.name)
+        return SummaryEvaluations(evaluations=items, answered_by=answered_by, escalation_reasons=reasons)
+
+    def _cached_evaluation(self, text: str, document_id: Optional[str]) -> Optional[SummaryEvaluations]:
+        """
+        Returns the evaluation of a near-duplicate summary of the document from the semantic cache, or None. The
+        consistency of a summary that is not identical to the cached one is scored again, as a single changed word can
+        make it contradict the document
+        """
+        evaluation, rescore = self._semantic_cache_hit(text, document_id)
+        if evaluation is None or not rescore:
+            return evaluation
+        excerpts, digest = self._sources(document_id)
+        criteria, steps = evaluation_metrics[CONSISTENCY]
+        deadline = self._deadline()
+        answered_by: Dict[str, str] = {}
+        outcomes = self._map(lambda source: self._evaluate_call(text, source, CONSISTENCY, criteria, steps, deadline),
+                             self._metric_sources(excerpts, digest, CONSISTENCY))
+        return self._rescored(evaluation, self._reduce_metric(CONSISTENCY, outcomes, answered_by), answered_by)
+
+    async def _acached_evaluation(self, text: str, document_id: Optional[str]) -> Optional[SummaryEvaluations]:
+        """Async counterpart of _cached_evaluation"""
+        evaluation, rescore = self._semantic_cache_hit(text, document_id)
+        if evaluation is None or not rescore:
+            return evaluation
+        excerpts, digest = await self._asources(document_id)
+        criteria, steps = evaluation_metrics[CONSISTENCY]
+        answered_by: Dict[str, str] = {}
+        item = await self._aevaluate_metric(text, self._metric_sources(excerpts, digest, CONSISTENCY), CONSISTENCY,
+                                            criteria, steps, asyncio.Semaphore(self._max_concurrency),
+                                            self._deadline(), answered_by)
+        return self._rescored(evaluation, item, answered_by)
+
+    def _semantic_cache_hit(self, text: str, document_id: Optional[str]) -> Tuple[Optional[SummaryEvaluations], bool]:
+        """
+        Returns the evaluation of a near-duplicate summary from the semantic cache, or None, and whether its consistency
+        has to be scored again. Multi metric chain components cannot score it alone, so they only reuse the evaluation
+        of an identical summary
+        """
+        if self._semantic_cache is None:
+            return None, False
+        normalized = normalized_text(text)
+        rescorable = not isinstance(self._chain_comps, MultiMetricSummaryChainWrapper)
+        identical: List[bool] = []
+
+        def accept(cached_text: str, _: BaseModel) -> bool:
+            identical.append(normalized_text(cached_text) == normalized)
+            return identical[-1] or rescorable
+
+        cached = self._semantic_cache.get(self._chain_comps.recording_type, self._document_id(document_id),
+                                          self.model_version(), text, accept=accept,
+                                          threshold=self._semantic_threshold)
+        if cached is None:
+            return None, False
+        evaluation, similarity = cached
+        logger.info("Reusing the summary evaluation of a near-duplicate summary (similarity %.3f)", similarity)
+        evaluation.answered_by = {item.metric: SEMANTIC_CACHE_TIER for item in evaluation.evaluations}
+        return evaluation, not identical[-1]
+
+    @staticmethod
+    def _rescored(evaluation: SummaryEvaluations, item: SummaryEvaluationItem,
+                  answered_by: Dict[str, str]) -> Optional[SummaryEvaluations]:
+        """Replaces the consistency of the cached evaluation with its new score, or returns None if it is unscored"""
+        if item.score is None:
+            return None
+        evaluation.evaluations = [item if cached_item.metric == CONSISTENCY else cached_item
+                                  for cached_item in evaluation.evaluations]
+        evaluation.answered_by.pop(CONSISTENCY, None)
+        evaluation.answered_by.update(answered_by)
+        return evaluation
+
+    def _cache_evaluation(self, text: str, document_id: Optional[str], evaluation: SummaryEvaluations):
+        """Stores the evaluation in the semantic cache, unless a metric is unscored"""
+        if self._semantic_cache is not None and all(item.score is not None for item in evaluation.evaluations):
+            self._semantic_cache.put(self._chain_comps.recording_type, self._document_id(document_id),
+                                     self.model_version(), text, evaluation)
+
+    def _pre_score(self, texts: List[str], document_id: Optional[str]) -> List[Optional[Dict[str, float]]]:
+        """Returns the lexical pre-scores of the summaries against the full text of the document"""
+        if self._prescorer is None:
+            return [None] * len(texts)
+        return self._prescorer.score_batch(self._document(document_id).text, texts)
+
+    async def _apre_score(self, texts: List[str], document_id: Optional[str]) -> List[Optional[Dict[str, float]]]:
+        # the n-gram tables of a document not scored before are built in a Python loop over its words
+        if self._prescorer is None:
+            return [None] * len(texts)
+        return await asyncio.to_thread(self._pre_score, texts, document_id)
+
+    def _gated_evaluation(self, pre_scores: Optional[Dict[str, float]]) -> Optional[SummaryEvaluations]:
+        """Returns the deterministic evaluation of a summary the pre-scoring gates settle, otherwise None"""
+        if pre_scores is None:
+            return None
+        reason = self._prescorer.gate(pre_scores)
+        if reason is None:
+            return None
+        logger.info("The summary evaluation was settled by pre-scoring: %s", reason)
+        return SummaryEvaluations(
+            evaluations=[SummaryEvaluationItem(metric=eval_type, score=self._prescorer.gate_score, reason=reason)
+                         for eval_type in evaluation_metrics],
+            answered_by={eval_type: PRESCORING_TIER for eval_type in evaluation_metrics},
+            pre_scores=pre_scores)
+
+    def _document_id(self, document_id: Optional[str]) -> str:
+        """:raises ValueError: if no document is given and there is no default document"""
+        document_id = document_id or self._default_document_id
+        if document_id is None:
+            raise ValueError("No document to evaluate the summary against")
+        return document_id
+
+    def _document(self, document_id: Optional[str]) -> Document:
+        """
+        :raises ValueError: if no document is given and there is no default document
+        :raises KeyError: if the document is not registered
+        """
+        document_id = self._document_id(document_id)
+        document = self._documents.get(document_id)
+        if document is None:
+            raise KeyError(f"No document registered with id: {document_id}")
+        return document
+
+    def _sources(self, document_id: Optional[str]) -> Tuple[List[str], Optional[str]]:
+        """
+        Returns the source texts the metric prompts carry: the excerpts of the document, its full text as only item
+        unless its registered token count exceeds long_document_tokens, and its digest if digest chain components are
+        set and the chain components evaluate one metric per prompt (None otherwise, or if the document is too short
+        to be digested, or its extraction failed)
+        :raises ValueError: if no document is given and there is no default document
+        :raises KeyError: if the document is not registered
+        """
+        document = self._document(document_id)
+        long = self._long_document_tokens is not None and document.token_count > self._long_document_tokens
+        excerpts = list(_document_excerpts(document.text, self._chunk_tokens, self._chunk_overlap_tokens)) \
+            if long else [document.text]
+        if self._digest_chain_comps is None or isinstance(self._chain_comps, MultiMetricSummaryChainWrapper):
+            return excerpts, None
+        return excerpts, self._documents.digest(document, lambda text: self._extract_digest(text, long))
+
+    async def _asources(self, document_id: Optional[str]) -> Tuple[List[str], Optional[str]]:
+        # extracting a missing digest blocks on the LLM and on the other evaluations extracting it
+        return await asyncio.to_thread(self._sources, document_id)
+
+    def _extract_digest(self, text: str, long: bool) -> str:
+        """Extracts the digest of a document in one prompt, or of a long document per excerpt and merges them"""
+        chunks = chunk_text(text, self._chunk_tokens, self._chunk_overlap_tokens) if long else [text]
+        digests = self._map(lambda chunk: self._digest_chain_comps.invoke(llm=self._llm, document=chunk), chunks)
+        return DocumentDigestChainWrapper.render(DocumentDigestChainWrapper.merge(digests))
+
+    @staticmethod
+    def _metric_sources(excerpts: List[str], digest: Optional[str], eval_type: str) -> List[str]:
+        """
+        Metrics in CHUNKED_METRICS are evaluated on every excerpt of a long document. The others are evaluated on the
+        digest of the document if there is one, except for the metrics in FULL_TEXT_METRICS, or else on its first
+        excerpt.
+        """
+        if len(excerpts) > 1 and eval_type in CHUNKED_METRICS:
+            return excerpts
+        return [digest] if digest is not None and eval_type not in FULL_TEXT_METRICS else excerpts[:1]
+
+    def _map(self, function, items: list) -> list:
+        if self._max_concurrency == 1 or len(items) == 1:
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self._max_concurrency, len(items))) as executor:
+            return list(executor.map(function, items))
+
+    def _evaluate_call(self, text: str, document: str, eval_type: str, criteria: str, steps: str,
+                       deadline: Optional[float] = None) -> Tuple[BaseModel, Optional[str]]:
+        try:
+            return self._invoke(self._metric_inputs(text, document, eval_type, criteria, steps), deadline)
+        except Exception as e:
+            return self._failed_metric(eval_type, e), None
+
+    async def _aevaluate_call(self, text: str, document: str, eval_type: str, criteria: str, steps: str,
+                              semaphore: asyncio.Semaphore,
+                              deadline: Optional[float] = None) -> Tuple[BaseModel, Optional[str]]:
+        async with semaphore:
+            try:
+                return await self._ainvoke(self._metric_inputs(text, document, eval_type, criteria, steps), deadline)
+            except Exception as e:
+                return self._failed_metric(eval_type, e), None
+
+    async def _aevaluate_metric(self, text: str, sources: List[str], eval_type: str, criteria: str, steps: str,
+                                semaphore: asyncio.Semaphore, deadline: Optional[float] = None,
+                                answered_by: Optional[Dict[str, str]] = None) -> BaseModel:
+        outcomes = await asyncio.gather(*(self._aevaluate_call(text, source, eval_type, criteria, steps, semaphore,
+                                                               deadline)
+                                          for source in sources))
+        return self._reduce_metric(eval_type, list(outcomes), answered_by)
+
+    def _evaluate_all_metrics(self, text: str, document: str,
+                              deadline: Optional[float]) -> Tuple[SummaryEvaluations, Optional[str]]:
+        """Evaluates all metrics with one multi metric prompt"""
+        try:
+            evaluation, tier = self._invoke(dict(document=document, summary=text), deadline)
+        except Exception as e:
+            return SummaryEvaluations(evaluations=[self._failed_metric(eval_type, e)
+                                                   for eval_type in evaluation_metrics]), None
+        return self._order_by_metric(evaluation), tier
+
+    async def _aevaluate_all_metrics(self, text: str, document: str, semaphore: asyncio.Semaphore,
+                                     deadline: Optional[float]) -> Tuple[SummaryEvaluations, Optional[str]]:
+        async with semaphore:
+            try:
+                evaluation, tier = await self._ainvoke(dict(document=document, summary=text), deadline)
+            except Exception as e:
+                return SummaryEvaluations(evaluations=[self._failed_metric(eval_type, e)
+                                                       for eval_type in evaluation_metrics]), None
+        return self._order_by_metric(evaluation), tier
+
+    def _reduce_all_metrics(self, evaluations: List[Tuple[SummaryEvaluations, Optional[str]]],
+                            answered_by: Dict[str, str]) -> SummaryEvaluations:
+        """Reduces the multi metric evaluations of the excerpts, which are ordered by metric, to one evaluation"""
+        return SummaryEvaluations(evaluations=[
+            self._reduce_metric(eval_type, [(evaluation.evaluations[index], tier) for evaluation, tier in evaluations],
+                                answered_by)
+            for index, eval_type in enumerate(evaluation_metrics)], answered_by=answered_by)
+
+    @staticmethod
+    def _reduce_metric(eval_type: str, outcomes: List[Tuple[BaseModel, Optional[str]]],
+                       answered_by: Optional[Dict[str, str]] = None) -> BaseModel:
+        """
+        Reduces the evaluations of a metric on the excerpts of a document to one item. Consistency takes the best
+        excerpt, as a statement of the summary only has to be supported by one of them; the other metrics take the
+        mean. Unscored excerpts are left out.
+        """
+        tiers = sorted({tier for _, tier in outcomes if tier is not None})
+        if answered_by is not None and tiers:
+            answered_by[eval_type] = ",".join(tiers)
+        if len(outcomes) == 1:
+            return outcomes[0][0]
+        scored = [item for item, _ in outcomes if getattr(item, "score", None) is not None]
+        if not scored:
+            return outcomes[0][0]
+        if eval_type == CONSISTENCY:
+            best = max(scored, key=lambda item: item.score)
+            return SummaryEvaluationItem(metric=eval_type, score=best.score, reason=best.reason)
+        lowest = min(scored, key=lambda item: item.score)
+        return SummaryEvaluationItem(metric=eval_type, score=round(sum(item.score for item in scored) / len(scored)),
+                                     reason=f"Mean of {len(scored)} excerpts, lowest: {lowest.reason}")
+
+    def _invoke(self, inputs: dict, deadline: Optional[float]) -> Tuple[BaseModel, Optional[str]]:
+        """Invokes the chain, through the llm tiers if configured, and returns the name of the tier that answered"""
+        if self._llm_tiers is None:
+            return self._chain_comps.invoke(llm=self._llm, **inputs), None
+        return self._llm_tiers.call(lambda llm: self._chain_comps.invoke(llm=llm, **inputs), deadline)
+
+    async def _ainvoke(self, inputs: dict, deadline: Optional[float]) -> Tuple[BaseModel, Optional[str]]:
+        if self._llm_tiers is None:
+            return await self._chain_comps.ainvoke(llm=self._llm, **inputs), None
+        return await self._llm_tiers.acall(lambda llm: self._chain_comps.ainvoke(llm=llm, **inputs), deadline)
+
+    def _deadline(self) -> Optional[float]:
+        return None if self._evaluation_timeout is None else time.time() + self._evaluation_timeout
+
+    @staticmethod
+    def _metric_inputs(text: str, document: str, eval_type: str, criteria: str, steps: str) -> dict:
+        return dict(criteria=criteria, document=document, metric_name=eval_type, steps=steps, summary=text)
+
+    @staticmethod
+    def _order_by_metric(evaluation: SummaryEvaluations) -> SummaryEvaluations:
+        """
+        Orders the items of a multi metric evaluation like evaluation_metrics. Metrics the LLM skipped get an unscored
+        item, metrics not in evaluation_metrics are dropped.
+        """
+        items = {item.metric: item for item in evaluation.evaluations}
+        return SummaryEvaluations(evaluations=[
+            items.get(eval_type, SummaryEvaluationItem(metric=eval_type, score=None,
+                                                       reason="Metric missing from LLM response"))
+            for eval_type in evaluation_metrics])
+
+    @staticmethod
+    def _failed_metric(eval_type: str, error: Exception) -> SummaryEvaluationItem:
+        """Isolates a failing metric chain: logs the error and returns an unscored item for that metric"""
+        logger.exception("Evaluation of metric %s failed: %s", eval_type, error)
+        return SummaryEvaluationItem(metric=eval_type, score=None, reason=f"Evaluation failed: {error}")
+
+
+@lru_cache(maxsize=64)
+def _document_excerpts(document: str, chunk_tokens: int, chunk_overlap_tokens: int) -> Tuple[str, ...]:
+    """Splits a long document into overlapping chunks, each introduced as an excerpt of the source text"""
+    chunks = chunk_text(document, chunk_tokens, chunk_overlap_tokens)
+    return tuple(f"(Excerpt {index} of {len(chunks)} of the source text, evaluate the summary against this excerpt)"
+                 f"\n{chunk}" for index, chunk in enumerate(chunks, 1))
@@ -1,21 +1,38 @@
-import os
+import json
 import logging
-from dotenv import load_dotenv
+import threading
+from functools import lru_cache
+from typing import Dict, Tuple, Optional
 from langchain_core.language_models import BaseLanguageModel
-from langchain_community.chat_models import ChatOpenAI
-from langchain_community.llms import ollama
 
 from static.summary_example_text import afrikaans_OPENAI_doc
 
 from app.models.pydantic.sessions import RecordingType
 from .evaluators import TextEvaluator, GrammaticalEvaluator, GrammaticalErrorsChainWrapper, SummaryChainWrapper, \
-    SummaryEvaluator, SchemaSummaryChainWrapper, ChainWrapper, SchemaGrammaticalErrorsChainWrapper
+    SummaryEvaluator, SchemaSummaryChainWrapper, ChainWrapper, SchemaGrammaticalErrorsChainWrapper, \
+    MultiMetricSummaryChainWrapper, BatchGrammaticalErrorsChainWrapper, DocumentDigestChainWrapper, \
+    NativeSummaryChainWrapper, NativeGrammaticalErrorsChainWrapper, NativeBatchGrammaticalErrorsChainWrapper
 
 from configs.configurator import Config
+from .cascade import ModelEscalation
+from .documents import get_document_registry
+from .llm_cache import get_llm_response_cache
+from .llm_clients import llm_client_registry
+from .llm_tiers import TieredLlmCaller, LlmTier
+from .prescoring import LexicalPreScorer
+from .scheduler import get_llm_scheduler
+from .prompt_compaction import compaction_report
+from .semantic_cache import get_semantic_cache
+from .sentence_store import SentenceErrorsStore
+from .token_accounting import get_token_accountant
 
 # init module logger
 logger = logging.getLogger(__name__)
 
+# prebuilt evaluators shared by all factories of the process, keyed by TextEvaluatorFactory._registry_key
+_evaluator_registry: Dict[Tuple[str, ...], TextEvaluator] = {}
+_evaluator_registry_lock = threading.Lock()
+
 
 class TextEvaluatorFactory:
 
@@ -24,70 +41,199 @@ class TextEvaluatorFactory:
         self._config = config
 
     def get_evaluator(self) -> TextEvaluator:
+        """
+        Returns the prebuilt evaluator for the recording type, output parser type and llm setup of this factory.
+        The evaluator, and with it the llm, prompt templates, output parser and compiled chains, is built once per
+        process and shared afterwards, so no prompt or parser is constructed while handling a request.
+        """
+        key = self._registry_key()
+        evaluator = _evaluator_registry.get(key)
+        if evaluator is None:
+            with _evaluator_registry_lock:
+                evaluator = _evaluator_registry.get(key)
+                if evaluator is None:
+                    evaluator = self.build_evaluator()
+                    if evaluator is not None:
+                        _evaluator_registry[key] = evaluator
+        return evaluator
+
+    def build_evaluator(self) -> TextEvaluator:
+        """
+        Builds a new evaluator, bypassing the evaluator registry. With an enabled model cascade, the evaluator of the
+        cheap first setup is returned, escalating its doubtful evaluations to the evaluator of the configured setup.
+        """
+        evaluator = self._build_setup_evaluator()
+        cascade_params = self._config.get_model_cascade_params()
+        first_setup = cascade_params.get('FIRST_SETUP')
+        if evaluator is None or not cascade_params.get('ENABLED', False) or not first_setup or \
+                first_setup == self._config.get_llm_setup_name():
+            return evaluator
+        first_evaluator = TextEvaluatorFactory(self._recording_type,
+                                               self._config.for_setup(first_setup)).build_evaluator()
+        if first_evaluator is None:
+            logger.error("Could not build the evaluator of the first cascade setup %s, evaluating with %s only",
+                         first_setup, self._config.get_llm_setup_name())
+            return evaluator
+        first_evaluator.set_escalation(ModelEscalation(
+            evaluator, self._config.get_llm_setup_name(),
+            borderline_scores=cascade_params.get('BORDERLINE_SCORES', (4, 6)),
+            max_metric_spread=cascade_params.get('MAX_METRIC_SPREAD', 5),
+            max_errors_per_word=cascade_params.get('MAX_ERRORS_PER_WORD', 0.5)))
+        logger.info("Built model cascade from %s to %s for %s", first_setup, self._config.get_llm_setup_name(),
+                    self._recording_type)
+        return first_evaluator
+
+    def _build_setup_evaluator(self) -> TextEvaluator:
         llm = self.get_llm()
+        cache = get_llm_response_cache(self._config.get_llm_cache_params())
+        scheduler = get_llm_scheduler(self._config.get_llm_setup_name(), self._config.get_llm_scheduler_params())
+        chain_params = dict(cache=cache, scheduler=scheduler,
+                            accountant=get_token_accountant(self._config.get_token_accounting_params()),
+                            compact_prompts=self._config.get_evaluation_params().get('COMPACT_PROMPTS', True))
         output_parser_type = self._config.get_llm_output_parser_type(self._recording_type)
         processor: TextEvaluator
         try:
             if self._recording_type == RecordingType.COMPREHENSION:
                 chain_components: ChainWrapper
                 if output_parser_type == "model":
-                    chain_components = SummaryChainWrapper()
+                    chain_components = SummaryChainWrapper(**chain_params)
                 elif output_parser_type == "schema":
-                    chain_components = SchemaSummaryChainWrapper()
+                    chain_components = SchemaSummaryChainWrapper(**chain_params)
+                elif output_parser_type == "multi_metric":
+                    chain_components = MultiMetricSummaryChainWrapper(**chain_params)
+                elif output_parser_type == "native":
+                    chain_components = NativeSummaryChainWrapper(**chain_params)
                 else:
                     raise NotImplementedError(f"Output parser type {output_parser_type} has not been implemented yet")
 
-                # TODO: document should be defined by user after defining RecordingType.COMPREHENSION in frontend
-                document = get_testing_document()
-                processor: SummaryEvaluator = SummaryEvaluator(llm, chain_components, document)
+                documents = get_document_registry(self._config.get_document_params())
+                # TODO: the default document should go once RecordingType.COMPREHENSION recordings name their document
+                default_document = documents.register(afrikaans_OPENAI_doc)
+                evaluation_params = self._config.get_evaluation_params()
+                digest_chain_components = None
+                if evaluation_params.get('SUMMARY_DOCUMENT_DIGEST', False):
+                    digest_chain_components = DocumentDigestChainWrapper(**chain_params)
+                processor: SummaryEvaluator = SummaryEvaluator(
+                    llm, chain_components, documents, default_document.id,
+                    max_concurrency=evaluation_params.get('MAX_CONCURRENCY', 4),
+                    llm_tiers=self.get_llm_tiers(llm),
+                    evaluation_timeout=self._config.get_llm_tier_params().get('EVALUATION_TIMEOUT_SECONDS'),
+                    digest_chain_comps=digest_chain_components,
+                    long_document_tokens=evaluation_params.get('SUMMARY_LONG_DOCUMENT_TOKENS'),
+                    chunk_tokens=evaluation_params.get('SUMMARY_CHUNK_TOKENS', 1500),
+                    chunk_overlap_tokens=evaluation_params.get('SUMMARY_CHUNK_OVERLAP_TOKENS', 150),
+                    prescorer=self.get_prescorer(evaluation_params.get('SUMMARY_PRESCORING') or {}))
             elif self._recording_type == RecordingType.LANGUAGE_PRODUCTION:
                 chain_components: ChainWrapper
+                batch_chain_components = None
                 if output_parser_type == "model":
-                    chain_components = GrammaticalErrorsChainWrapper()
+                    chain_components = GrammaticalErrorsChainWrapper(**chain_params)
+                    batch_chain_components = BatchGrammaticalErrorsChainWrapper(**chain_params)
                 elif output_parser_type == "schema":
-                    chain_components = SchemaGrammaticalErrorsChainWrapper()
+                    chain_components = SchemaGrammaticalErrorsChainWrapper(**chain_params)
+                elif output_parser_type == "native":
+                    chain_components = NativeGrammaticalErrorsChainWrapper(**chain_params)
+                    batch_chain_components = NativeBatchGrammaticalErrorsChainWrapper(**chain_params)
                 else:
                     raise NotImplementedError(f"Output parser type {output_parser_type} has not been implemented yet")
 
-                processor: GrammaticalEvaluator = GrammaticalEvaluator(llm, chain_components)
+                evaluation_params = self._config.get_evaluation_params()
+                sentence_store = None
+                if evaluation_params.get('GRAMMAR_INCREMENTAL', False):
+                    sentence_store = SentenceErrorsStore(evaluation_params.get('GRAMMAR_SENTENCE_STORE_SIZE', 10000))
+                processor: GrammaticalEvaluator = GrammaticalEvaluator(
+                    llm, chain_components, batch_chain_components,
+                    max_batch_tokens=evaluation_params.get('GRAMMAR_MAX_BATCH_TOKENS', 1000),
+                    max_concurrency=evaluation_params.get('MAX_CONCURRENCY', 4),
+                    sentence_store=sentence_store)
             else:
                 raise NotImplementedError(f"Recording type {self._recording_type} has not been implemented yet")
+            semantic_cache_params = self._config.get_semantic_cache_params()
+            processor.set_semantic_cache(get_semantic_cache(semantic_cache_params), threshold=semantic_cache_params.get(
+                'SUMMARY_THRESHOLD' if self._recording_type == RecordingType.COMPREHENSION else 'GRAMMAR_THRESHOLD'))
             return processor
 
         except Exception as e:
             logger.exception("An error occurred: %s", e)
 
+    def _registry_key(self) -> Tuple[str, ...]:
+        return (self._recording_type,
+                str(self._config.get_llm_output_parser_type(self._recording_type)),
+                self._config.get_llm_setup_name(),
+                json.dumps(self._config.get_llm_setup_params(), sort_keys=True, default=str),
+                json.dumps(self._config.get_llm_http_pool_params(), sort_keys=True, default=str),
+                json.dumps(self._config.get_evaluation_params(), sort_keys=True, default=str),
+                json.dumps(self._config.get_llm_cache_params(), sort_keys=True, default=str),
+                json.dumps(self._config.get_llm_scheduler_params(), sort_keys=True, default=str),
+                json.dumps(self._config.get_llm_tier_params(), sort_keys=True, default=str),
+                json.dumps(self._config.get_model_cascade_params(), sort_keys=True, default=str),
+                json.dumps(self._config.get_token_accounting_params(), sort_keys=True, default=str),
+                json.dumps(self._config.get_semantic_cache_params(), sort_keys=True, default=str),
+                json.dumps(self._config.get_document_params(), sort_keys=True, default=str))
+
     def get_llm(self) -> BaseLanguageModel:
+        """Returns the shared client of the configured llm setup, created on first use"""
         try:
-            llm: BaseLanguageModel
-            # Use predefined config to choose what LLM to use
-            if self._config.get_llm_setup_name() == "ONLINE_OPENAI_GPT3":
-                llm_setup = self._config.get_llm_setup_params()
-                env_path = os.path.join(os.getcwd(), ".env")
-                load_dotenv(env_path)
-                llm: ChatOpenAI = ChatOpenAI(temperature=llm_setup['TEMPERATURE'],
-                                             model_name=llm_setup['MODEL_NAME'],
-                                             openai_api_key=os.environ["OPENAI_API_KEY"])
-
-            elif self._config.get_llm_setup_name() == "LOCAL_OLLAMA_LLAMA3":
-                # host llm on localhost
-                llm_setup = self._config.get_llm_setup_params()
-                llm = ollama.Ollama(model=llm_setup['MODEL_NAME'])
-
-            elif self._config.get_llm_setup_name() == "LOCAL_DOCKER_OLLAMA_LLAMA3":
-                # host llm in docker network
-                llm_setup = self._config.get_llm_setup_params()
-                host = llm_setup['OLLAMA_HOST']
-                port = llm_setup['OLLAMA_PORT']
-                llm = ollama.Ollama(model=llm_setup['MODEL_NAME'],
-                                    base_url=f'http://{host}:{port}')
-            else:
-                raise NotImplementedError(f"Model setup {self._config.get_llm_setup_name()} is not supported.")
-            return llm
+            return llm_client_registry.get_llm(self._config.get_llm_setup_name(),
+                                               self._config.get_llm_setup_params(),
+                                               self._config.get_llm_http_pool_params())
 
         except NotImplementedError as e:
             logger.exception("An error occurred: %s", e)
 
-
-def get_testing_document():
-    return afrikaans_OPENAI_doc
+    @staticmethod
+    def get_prescorer(prescoring_params: dict) -> Optional[LexicalPreScorer]:
+        """
+        Returns the lexical pre-scorer of the summaries, or None if pre-scoring is disabled
+        :param prescoring_params: SUMMARY_PRESCORING section of the evaluation config
+        """
+        if not prescoring_params.get('ENABLED', False):
+            return None
+        return LexicalPreScorer(min_tokens=prescoring_params.get('MIN_TOKENS', 5),
+                                max_copy_ratio=prescoring_params.get('MAX_COPY_RATIO', 0.9),
+                                min_rouge1_precision=prescoring_params.get('MIN_ROUGE1_PRECISION', 0.1),
+                                max_length_ratio=prescoring_params.get('MAX_LENGTH_RATIO'),
+                                gate_score=prescoring_params.get('GATE_SCORE', 0))
+
+    def get_llm_tiers(self, llm: BaseLanguageModel) -> Optional[TieredLlmCaller]:
+        """
+        Returns the tiers of the configured llm setup followed by its fallback setups, each scheduled by the scheduler
+        of its own setup, or None if the setup has no llm_tiers config
+        """
+        tier_params = self._config.get_llm_tier_params()
+        if not tier_params:
+            return None
+        tiers = [LlmTier(self._config.get_llm_setup_name(), llm)]
+        for setup_name in tier_params.get('FALLBACK_SETUPS') or []:
+            try:
+                tiers.append(LlmTier(setup_name, llm_client_registry.get_llm(
+                    setup_name, self._config.get_llm_setup_params(setup_name),
+                    self._config.get_llm_http_pool_params()),
+                    scheduler=get_llm_scheduler(setup_name, self._config.get_llm_scheduler_params(setup_name))))
+            except (NotImplementedError, KeyError) as e:
+                logger.exception("Skipping fallback llm setup %s: %s", setup_name, e)
+        return TieredLlmCaller(tiers,
+                               call_timeout=tier_params.get('CALL_TIMEOUT_SECONDS'),
+                               hedge_percentile=tier_params.get('HEDGE_PERCENTILE'),
+                               hedge_min_samples=tier_params.get('HEDGE_MIN_SAMPLES', 20))
+
+
+@lru_cache(maxsize=1)
+def prompt_compaction_report() -> Dict[str, dict]:
+    """
+    Compares the tokens of the original and the compact prompt template of every chain. The templates are fixed, so
+    the report is computed once
+    """
+    chain_components = [SummaryChainWrapper(), SchemaSummaryChainWrapper(), MultiMetricSummaryChainWrapper(),
+                        NativeSummaryChainWrapper(), DocumentDigestChainWrapper(), GrammaticalErrorsChainWrapper(),
+                        SchemaGrammaticalErrorsChainWrapper(), BatchGrammaticalErrorsChainWrapper(),
+                        NativeGrammaticalErrorsChainWrapper(), NativeBatchGrammaticalErrorsChainWrapper()]
+    return compaction_report({type(components).__name__: (components.original_prompt_template,
+                                                          components.prompt_template)
+                              for components in chain_components})
+
+
+def clear_evaluator_registry():
+    """Drops all prebuilt evaluators, e.g. after the configuration changed"""
+    with _evaluator_registry_lock:
+        _evaluator_registry.clear()
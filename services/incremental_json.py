@@ -0,0 +1,86 @@
+import json
+import logging
+import re
+from typing import List
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+
+class IncrementalJsonArrayParser:
+    """
+    Parses the objects of one array of a JSON document while the document is still being streamed. Every object of
+    the array is returned by feed as soon as its closing brace arrived, so consumers do not have to wait for the LLM
+    to finish the whole response.
+    """
+
+    def __init__(self, array_key: str):
+        """
+        :param array_key: key of the array whose objects are parsed, e.g. "error" for Errors
+        """
+        self._array_start_pattern = re.compile(r'"' + re.escape(array_key) + r'"\s*:\s*\[')
+        self._buffer = ""
+        self._position = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+
+    @property
+    def done(self) -> bool:
+        """True once the closing bracket of the array was parsed"""
+        return self._done
+
+    def feed(self, chunk: str) -> List[dict]:
+        """
+        Adds the next chunk of the streamed document
+        :return: the objects of the array completed by this chunk
+        """
+        self._buffer += chunk
+        if self._done:
+            return []
+        if not self._in_array:
+            match = self._array_start_pattern.search(self._buffer, max(0, self._position))
+            if match is None:
+                # keep scanning close to the end, the key might be split over two chunks
+                self._position = max(0, len(self._buffer) - 64)
+                return []
+            self._in_array = True
+            self._position = match.end()
+        return self._scan_array()
+
+    def _scan_array(self) -> List[dict]:
+        objects: List[dict] = []
+        buffer = self._buffer
+        for index in range(self._position, len(buffer)):
+            char = buffer[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._object_start = index
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # closing bracket of the array itself
+                    self._done = True
+                    self._position = index + 1
+                    return objects
+                self._depth -= 1
+                if self._depth == 0 and self._object_start is not None:
+                    try:
+                        objects.append(json.loads(buffer[self._object_start:index + 1]))
+                    except json.JSONDecodeError as e:
+                        logger.warning("Skipping unparsable streamed object: %s", e)
+                    self._object_start = None
+        self._position = len(buffer)
+        return objects
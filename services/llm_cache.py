@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple
+
+from langchain_core.language_models import BaseLanguageModel
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+
+class LlmResponseCache:
+    """
+    Content addressed cache of raw LLM responses with two tiers: a bounded in-memory LRU and an optional persistent
+    SQLite database with a time to live and a maximum size. Responses are cached before output parsing, so one cache
+    serves every chain wrapper and output parser type. The persistent tier keeps its size in memory, and expires
+    responses and writes the last access times of its hits in periodic batches, so a get or put costs one indexed
+    lookup or one insert.
+    """
+
+    def __init__(self, memory_max_entries: int = 1024, disk_path: Optional[str] = None,
+                 disk_ttl_seconds: Optional[float] = None, disk_max_bytes: Optional[int] = None,
+                 maintenance_interval_seconds: float = 60.0):
+        """
+        :param memory_max_entries: maximum number of responses in the in-memory tier
+        :param disk_path: SQLite file of the persistent tier. None disables the persistent tier
+        :param disk_ttl_seconds: responses older than this are treated as missing. None keeps them forever
+        :param disk_max_bytes: least recently used responses are evicted from the persistent tier above this size
+        :param maintenance_interval_seconds: how often expired responses are deleted and the last access times of
+        disk hits are written
+        """
+        self._memory_max_entries = memory_max_entries
+        self._ttl = disk_ttl_seconds
+        self._disk_max_bytes = disk_max_bytes
+        self._maintenance_interval = maintenance_interval_seconds
+        self._last_maintenance = time.time()
+        self._disk_bytes = 0
+        # last access times of disk hits not written yet
+        self._pending_accesses: Dict[str, float] = {}
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0,
+                                          "evictions": 0}
+        self._connection: Optional[sqlite3.Connection] = None
+        if disk_path is not None:
+            self._open_disk_tier(disk_path)
+
+    @staticmethod
+    def make_key(prompt: str, llm: BaseLanguageModel, parser_type: str) -> str:
+        """Hashes the rendered prompt, model name, temperature and parser type into a cache key"""
+        model_name = getattr(llm, "model_name", None) or getattr(llm, "model", None)
+        temperature = getattr(llm, "temperature", None)
+        payload = json.dumps([prompt, llm._llm_type, model_name, temperature, parser_type], default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and not self._expired(cached[1], now):
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return cached[0]
+            if cached is not None:
+                del self._memory[key]
+            response = self._disk_get(key, now)
+            self._maintain_disk(now)
+            if response is not None:
+                self._counters["disk_hits"] += 1
+                self._memory_put(key, response[0], response[1])
+                return response[0]
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self._lock:
+            self._counters["stores"] += 1
+            self._memory_put(key, response, now)
+            self._disk_put(key, response, now)
+            self._maintain_disk(now)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM responses")
+                self._connection.commit()
+                self._disk_bytes = 0
+                self._pending_accesses.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hit/miss counters along with the current number of responses per tier"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            if self._connection is not None:
+                self._maintain_disk(time.time(), force=True)
+                stats["disk_entries"] = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                stats["disk_bytes"] = self._disk_bytes
+        return stats
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self._ttl is not None and now - created_at > self._ttl
+
+    def _memory_put(self, key: str, response: str, created_at: float):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_max_entries:
+            self._memory.popitem(last=False)
+
+    def _open_disk_tier(self, disk_path: str):
+        directory = os.path.dirname(disk_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(disk_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                                 "created_at REAL NOT NULL, last_access REAL NOT NULL, size INTEGER NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+        self._connection.commit()
+        self._disk_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        if self._connection is None:
+            return None
+        row = self._connection.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        # expired responses are deleted by the next maintenance
+        if row is None or self._expired(row[1], now):
+            return None
+        self._pending_accesses[key] = now
+        return row[0], row[1]
+
+    def _disk_put(self, key: str, response: str, now: float):
+        if self._connection is None:
+            return
+        size = len(response.encode("utf-8"))
+        replaced = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self._connection.execute("INSERT OR REPLACE INTO responses (key, response, created_at, last_access, size) "
+                                 "VALUES (?, ?, ?, ?, ?)", (key, response, now, now, size))
+        self._pending_accesses.pop(key, None)
+        self._disk_bytes += size - (replaced[0] if replaced is not None else 0)
+        if self._disk_max_bytes is not None and self._disk_bytes > self._disk_max_bytes:
+            self._evict_disk(self._disk_max_bytes)
+        self._connection.commit()
+
+    def _maintain_disk(self, now: float, force: bool = False):
+        """Writes the pending last access times and deletes expired responses, once per maintenance interval"""
+        if self._connection is None or (not force and now - self._last_maintenance < self._maintenance_interval):
+            return
+        self._last_maintenance = now
+        self._write_pending_accesses()
+        if self._ttl is not None:
+            expired_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses "
+                                                     "WHERE created_at < ?", (now - self._ttl,)).fetchone()[0]
+            if expired_bytes:
+                self._connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self._ttl,))
+                self._disk_bytes -= expired_bytes
+        self._connection.commit()
+
+    def _write_pending_accesses(self):
+        if self._pending_accesses:
+            self._connection.executemany("UPDATE responses SET last_access = ? WHERE key = ?",
+                                         [(accessed, key) for key, accessed in self._pending_accesses.items()])
+            self._pending_accesses.clear()
+
+    def _evict_disk(self, max_bytes: int):
+        """Deletes least recently used responses until the persistent tier fits into max_bytes"""
+        self._write_pending_accesses()
+        cursor = self._connection.execute("SELECT key, size FROM responses ORDER BY last_access")
+        evicted = []
+        while self._disk_bytes > max_bytes:
+            row = cursor.fetchone()
+            if row is None:
+                break
+            evicted.append((row[0],))
+            self._disk_bytes -= row[1]
+        cursor.close()
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._counters["evictions"] += len(evicted)
+
+
+# caches shared by all chain wrappers of the process, keyed by their configuration
+_caches: Dict[str, LlmResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_llm_response_cache(cache_params: dict) -> Optional[LlmResponseCache]:
+    """
+    Returns the process-wide cache for the llm_cache config section, or None if caching is disabled
+    :param cache_params: llm_cache section of the config
+    """
+    if not cache_params or not cache_params.get('ENABLED', False):
+        return None
+    key = json.dumps(cache_params, sort_keys=True, default=str)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = LlmResponseCache(memory_max_entries=cache_params.get('MEMORY_MAX_ENTRIES', 1024),
+                                     disk_path=cache_params.get('DISK_PATH'),
+                                     disk_ttl_seconds=cache_params.get('DISK_TTL_SECONDS'),
+                                     disk_max_bytes=cache_params.get('DISK_MAX_BYTES'),
+                                     maintenance_interval_seconds=cache_params.get('MAINTENANCE_INTERVAL_SECONDS',
+                                                                                   60.0))
+            _caches[key] = cache
+            logger.info("Created LLM response cache with %s", cache_params)
+        return cache
@@ -0,0 +1,300 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+import httpx
+import openai
+import requests
+from dotenv import load_dotenv
+from langchain_core.language_models import BaseLanguageModel
+from langchain_community.chat_models import ChatOpenAI
+from langchain_community.llms import ollama
+from requests.adapters import HTTPAdapter
+
+from .ollama_router import OllamaRouter, OllamaHost
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+
+class OllamaCallError(ValueError):
+    """Failed Ollama call, carrying the HTTP status code so that e.g. the scheduler can tell an overloaded backend"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class HttpPool:
+    """
+    Keep-alive HTTP connection pools shared by all LLM clients of one setup: one for sync and one per event loop for
+    async requests (async connections cannot be shared between event loops)
+    """
+
+    def __init__(self, max_connections: int = 20, max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 30.0):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self._requests_session: Optional[requests.Session] = None
+        self._aiohttp_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = \
+            weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def httpx_limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive_connections,
+                            keepalive_expiry=self.keepalive_expiry)
+
+    def requests_session(self) -> requests.Session:
+        with self._lock:
+            if self._requests_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.max_keepalive_connections,
+                                      pool_maxsize=self.max_connections)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._requests_session = session
+            return self._requests_session
+
+    def aiohttp_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._aiohttp_sessions.get(loop)
+            if session is None or session.closed:
+                connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_expiry)
+                session = aiohttp.ClientSession(connector=connector)
+                self._aiohttp_sessions[loop] = session
+            return session
+
+    async def aclose(self):
+        """Closes the async session of the running event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._aiohttp_sessions.pop(loop, None)
+        if session is not None:
+            await session.close()
+
+    def close(self):
+        with self._lock:
+            if self._requests_session is not None:
+                self._requests_session.close()
+                self._requests_session = None
+
+
+class PooledOllama(ollama.Ollama):
+    """
+    Ollama LLM sending its requests through the keep-alive connections of a shared HttpPool, and with a router over
+    the Ollama hosts of the setup if it has several
+    """
+    http_pool: Any = None
+    router: Any = None
+
+    def _request_payload(self, payload: Any, stop: Optional[List[str]], **kwargs: Any) -> dict:
+        # mirrors the payload built by ollama.Ollama._create_stream
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+        elif stop is None:
+            stop = []
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {**params["options"], "stop": stop,
+                                 **{k: v for k, v in kwargs.items() if k not in self._default_params}}
+        if payload.get("messages"):
+            return {"messages": payload.get("messages", []), **params}
+        return {"prompt": payload.get("prompt"), "images": payload.get("images", []), **params}
+
+    def _headers(self) -> dict:
+        return {"Content-Type": "application/json", **(self.headers if isinstance(self.headers, dict) else {})}
+
+    def _create_stream(self, api_url: str, payload: Any, stop: Optional[List[str]] = None,
+                       **kwargs: Any) -> Iterator[str]:
+        if self.router is None:
+            yield from self._post_stream(api_url, payload, stop, **kwargs)
+            return
+        host = self.router.acquire()
+        started, failed = time.time(), False
+        try:
+            yield from self._post_stream(self._routed_url(api_url, host), payload, stop, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.router.release(host, time.time() - started, not failed)
+
+    async def _acreate_stream(self, api_url: str, payload: Any, stop: Optional[List[str]] = None,
+                              **kwargs: Any) -> AsyncIterator[str]:
+        if self.router is None:
+            async for line in self._apost_stream(api_url, payload, stop, **kwargs):
+                yield line
+            return
+        host = self.router.acquire()
+        started, failed = time.time(), False
+        try:
+            async for line in self._apost_stream(self._routed_url(api_url, host), payload, stop, **kwargs):
+                yield line
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.router.release(host, time.time() - started, not failed)
+
+    def _routed_url(self, api_url: str, host: OllamaHost) -> str:
+        if api_url.startswith(self.base_url):
+            return host.base_url + api_url[len(self.base_url):]
+        return api_url
+
+    def _post_stream(self, api_url: str, payload: Any, stop: Optional[List[str]], **kwargs: Any) -> Iterator[str]:
+        response = self.http_pool.requests_session().post(url=api_url, headers=self._headers(),
+                                                          json=self._request_payload(payload, stop, **kwargs),
+                                                          stream=True, timeout=self.timeout)
+        response.encoding = "utf-8"
+        if response.status_code != 200:
+            if response.status_code == 404:
+                raise ollama.OllamaEndpointNotFoundError(
+                    f"Ollama call failed with status code 404. Maybe your model is not found and you should pull "
+                    f"the model with `ollama pull {self.model}`.")
+            raise OllamaCallError(f"Ollama call failed with status code {response.status_code}. "
+                                  f"Details: {response.text}", response.status_code)
+        return response.iter_lines(decode_unicode=True)
+
+    async def _apost_stream(self, api_url: str, payload: Any, stop: Optional[List[str]],
+                            **kwargs: Any) -> AsyncIterator[str]:
+        async with self.http_pool.aiohttp_session().post(url=api_url, headers=self._headers(),
+                                                         json=self._request_payload(payload, stop, **kwargs),
+                                                         timeout=self.timeout) as response:
+            if response.status != 200:
+                if response.status == 404:
+                    raise ollama.OllamaEndpointNotFoundError("Ollama call failed with status code 404.")
+                raise OllamaCallError(f"Ollama call failed with status code {response.status}. "
+                                      f"Details: {await response.text()}", response.status)
+            async for line in response.content:
+                yield line.decode("utf-8")
+
+
+class LlmClientRegistry:
+    """
+    Creates every LLM client once per setup name and setup parameters and shares it, along with its HTTP connection
+    pool, between all evaluators and concurrent requests of the process
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str], BaseLanguageModel] = {}
+        self._pools: List[HttpPool] = []
+        self._routers: List[OllamaRouter] = []
+        self._lock = threading.Lock()
+        self._environment_loaded = False
+
+    def get_llm(self, setup_name: str, setup_params: dict, pool_params: Optional[dict] = None) -> BaseLanguageModel:
+        """
+        :param setup_name: one of LlmConfigOptions
+        :param setup_params: llm section of the setup in the config
+        :param pool_params: llm_http_pool section of the config
+        :raises NotImplementedError: if the setup is not supported
+        """
+        pool_params = pool_params or {}
+        key = (setup_name, json.dumps([setup_params, pool_params], sort_keys=True, default=str))
+        llm = self._clients.get(key)
+        if llm is None:
+            with self._lock:
+                llm = self._clients.get(key)
+                if llm is None:
+                    pool = HttpPool(max_connections=pool_params.get('MAX_CONNECTIONS', 20),
+                                    max_keepalive_connections=pool_params.get('MAX_KEEPALIVE_CONNECTIONS', 10),
+                                    keepalive_expiry=pool_params.get('KEEPALIVE_EXPIRY_SECONDS', 30))
+                    llm = self._create_llm(setup_name, setup_params, pool)
+                    self._pools.append(pool)
+                    self._clients[key] = llm
+                    logger.info("Created shared LLM client for setup %s", setup_name)
+        return llm
+
+    def _create_llm(self, setup_name: str, llm_setup: dict, pool: HttpPool) -> BaseLanguageModel:
+        if setup_name == "ONLINE_OPENAI_GPT3":
+            self._load_environment()
+            api_key = os.environ["OPENAI_API_KEY"]
+            client = openai.OpenAI(api_key=api_key, http_client=httpx.Client(limits=pool.httpx_limits()))
+            async_client = openai.AsyncOpenAI(api_key=api_key,
+                                              http_client=httpx.AsyncClient(limits=pool.httpx_limits()))
+            return ChatOpenAI(temperature=llm_setup['TEMPERATURE'],
+                              model_name=llm_setup['MODEL_NAME'],
+                              openai_api_key=api_key,
+                              client=client.chat.completions,
+                              async_client=async_client.chat.completions)
+
+        elif setup_name == "LOCAL_OLLAMA_LLAMA3":
+            # host llm on localhost
+            return PooledOllama(model=llm_setup['MODEL_NAME'], http_pool=pool, **self._ollama_params(llm_setup))
+
+        elif setup_name == "LOCAL_DOCKER_OLLAMA_LLAMA3":
+            # host llm in docker network, on one or several hosts
+            hosts = llm_setup.get('OLLAMA_HOSTS') or [f"{llm_setup['OLLAMA_HOST']}:{llm_setup['OLLAMA_PORT']}"]
+            base_urls = [host if host.startswith("http") else f"http://{host}" for host in hosts]
+            if len(base_urls) == 1:
+                return PooledOllama(model=llm_setup['MODEL_NAME'], base_url=base_urls[0], http_pool=pool,
+                                    **self._ollama_params(llm_setup))
+            router = OllamaRouter(base_urls,
+                                  unhealthy_after_failures=llm_setup.get('UNHEALTHY_AFTER_FAILURES', 3),
+                                  health_check_interval=llm_setup.get('HEALTH_CHECK_INTERVAL_SECONDS', 10))
+            router.start()
+            self._routers.append(router)
+            return PooledOllama(model=llm_setup['MODEL_NAME'], base_url=base_urls[0], http_pool=pool, router=router,
+                                **self._ollama_params(llm_setup))
+        raise NotImplementedError(f"Model setup {setup_name} is not supported.")
+
+    @staticmethod
+    def _ollama_params(llm_setup: dict) -> dict:
+        """
+        Keeps the model loaded between requests and its context size fixed, so Ollama reuses the evaluated tokens of
+        the prompt prefix the requests share (static instructions and source text) instead of evaluating it again
+        """
+        params = {}
+        if llm_setup.get('KEEP_ALIVE') is not None:
+            params['keep_alive'] = llm_setup['KEEP_ALIVE']
+        if llm_setup.get('NUM_CTX') is not None:
+            params['num_ctx'] = llm_setup['NUM_CTX']
+        return params
+
+    def _load_environment(self):
+        """Loads the .env file of the working directory once per process"""
+        if not self._environment_loaded:
+            load_dotenv(os.path.join(os.getcwd(), ".env"))
+            self._environment_loaded = True
+
+    def host_stats(self) -> Dict[str, dict]:
+        """Returns the health, load and latency statistics of every routed Ollama host"""
+        with self._lock:
+            routers = list(self._routers)
+        return {base_url: stats for router in routers for base_url, stats in router.stats().items()}
+
+    async def aclose(self):
+        """Closes the async connections of the running event loop, e.g. on application shutdown"""
+        for pool in list(self._pools):
+            await pool.aclose()
+
+    def clear(self):
+        """Closes all pools, stops all health checks and drops all clients"""
+        with self._lock:
+            for pool in self._pools:
+                pool.close()
+            self._pools.clear()
+            for router in self._routers:
+                router.stop()
+            self._routers.clear()
+            self._clients.clear()
+
+
+# registry shared by all evaluator factories of the process
+llm_client_registry = LlmClientRegistry()
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from langchain_core.language_models import BaseLanguageModel
+
+from services.scheduler import LlmScheduler
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class LlmTier:
+    name: str
+    llm: BaseLanguageModel
+    # admission control of the calls to a fallback tier, the scheduler of its own llm setup. None calls its llm right
+    # away. The first tier is scheduled by the chain components of its setup
+    scheduler: Optional[LlmScheduler] = None
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=1000))
+    counters: Dict[str, int] = field(default_factory=lambda: {"calls": 0, "answered": 0, "failures": 0,
+                                                              "timeouts": 0, "hedges": 0})
+
+
+class LlmCallTimeoutError(TimeoutError):
+    """Raised when no tier answered a call within its deadline"""
+
+
+class TieredLlmCaller:
+    """
+    Runs an LLM call against a list of tiers, e.g. the configured model followed by cheaper or local ones. Every
+    attempt is bounded by the call timeout and the deadline of the evaluation. When an attempt is slower than the
+    hedge percentile of the latencies observed for its tier, a duplicate is sent to the next tier and the first answer
+    wins. Failed or timed out attempts fall back to the next untried tier. Returns the name of the tier that answered.
+    """
+
+    def __init__(self, tiers: List[LlmTier], call_timeout: Optional[float] = None,
+                 hedge_percentile: Optional[float] = None, hedge_min_samples: int = 20, max_workers: int = 16):
+        """
+        :param tiers: tiers in the order they are tried, the first one answers unless it is slow or fails
+        :param call_timeout: seconds every attempt gets. None only bounds attempts by the deadline of the call
+        :param hedge_percentile: percentile (0-100) of the latencies of a tier after which a hedged duplicate is sent
+        to the next tier. None disables hedging
+        :param hedge_min_samples: latencies observed for a tier before its calls are hedged
+        :param max_workers: threads running sync calls (timed out sync calls keep their thread until they return)
+        """
+        if not tiers:
+            raise ValueError("TieredLlmCaller needs at least one tier")
+        self.tiers = tiers
+        self._call_timeout = call_timeout
+        self._hedge_percentile = hedge_percentile
+        self._hedge_min_samples = hedge_min_samples
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-tier")
+        self._lock = threading.Lock()
+
+    def call(self, invoke: Callable[[BaseLanguageModel], T], deadline: Optional[float] = None) -> Tuple[T, str]:
+        """
+        :param invoke: runs the call with the llm of a tier
+        :param deadline: time.time() by which the call has to be answered. None only applies the call timeout
+        :return: result of the call and name of the tier that answered
+        :raises LlmCallTimeoutError: if no tier answered in time
+        """
+        index, last_error = 0, None
+        while index < len(self.tiers):
+            timeout = self._attempt_timeout(deadline)
+            if timeout is not None and timeout <= 0:
+                break
+            tried: List[int] = []
+            try:
+                return self._attempt(invoke, index, timeout, tried)
+            except Exception as e:
+                last_error = e
+                logger.warning("LLM tier %s failed, falling back: %r", self.tiers[index].name, e)
+            index = max(tried) + 1
+        raise self._final_error(last_error)
+
+    async def acall(self, ainvoke: Callable[[BaseLanguageModel], Awaitable[T]],
+                    deadline: Optional[float] = None) -> Tuple[T, str]:
+        """Async counterpart of call"""
+        index, last_error = 0, None
+        while index < len(self.tiers):
+            timeout = self._attempt_timeout(deadline)
+            if timeout is not None and timeout <= 0:
+                break
+            tried: List[int] = []
+            try:
+                return await self._aattempt(ainvoke, index, timeout, tried)
+            except Exception as e:
+                last_error = e
+                logger.warning("LLM tier %s failed, falling back: %r", self.tiers[index].name, e)
+            index = max(tried) + 1
+        raise self._final_error(last_error)
+
+    def hedge_delay(self, index: int) -> Optional[float]:
+        """Returns the seconds after which a call to the tier is hedged, or None if it is not hedged"""
+        if self._hedge_percentile is None or index + 1 >= len(self.tiers):
+            return None
+        with self._lock:
+            latencies = sorted(self.tiers[index].latencies)
+        if len(latencies) < self._hedge_min_samples:
+            return None
+        return latencies[int(self._hedge_percentile / 100 * (len(latencies) - 1))]
+
+    def stats(self) -> Dict[str, dict]:
+        hedge_delays = [self.hedge_delay(index) for index in range(len(self.tiers))]
+        with self._lock:
+            return {tier.name: dict(tier.counters, hedge_delay=hedge_delay)
+                    for tier, hedge_delay in zip(self.tiers, hedge_delays)}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _attempt(self, invoke: Callable[[BaseLanguageModel], T], index: int, timeout: Optional[float],
+                 tried: List[int]) -> Tuple[T, str]:
+        started = time.time()
+        futures: Dict[Future, int] = {self._submit(invoke, index, tried): index}
+        hedge_delay = self.hedge_delay(index)
+        if hedge_delay is not None and (timeout is None or hedge_delay < timeout):
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                self._count(index, "hedges")
+                futures[self._submit(invoke, index + 1, tried)] = index + 1
+        last_error = None
+        while futures:
+            remaining = None if timeout is None else timeout - (time.time() - started)
+            done, _ = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                self._count_timeouts(futures.values())
+                raise LlmCallTimeoutError(f"LLM call timed out after {timeout:.2f}s")
+            for future in done:
+                answered = futures.pop(future)
+                if future.exception() is None:
+                    self._count(answered, "answered")
+                    return future.result(), self.tiers[answered].name
+                last_error = future.exception()
+        raise last_error
+
+    async def _aattempt(self, ainvoke: Callable[[BaseLanguageModel], Awaitable[T]], index: int,
+                        timeout: Optional[float], tried: List[int]) -> Tuple[T, str]:
+        started = time.time()
+        tasks: Dict[asyncio.Future, int] = {self._astart(ainvoke, index, tried): index}
+        try:
+            hedge_delay = self.hedge_delay(index)
+            if hedge_delay is not None and (timeout is None or hedge_delay < timeout):
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    self._count(index, "hedges")
+                    tasks[self._astart(ainvoke, index + 1, tried)] = index + 1
+            last_error = None
+            while tasks:
+                remaining = None if timeout is None else timeout - (time.time() - started)
+                done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self._count_timeouts(tasks.values())
+                    raise LlmCallTimeoutError(f"LLM call timed out after {timeout:.2f}s")
+                for task in done:
+                    answered = tasks.pop(task)
+                    if task.exception() is None:
+                        self._count(answered, "answered")
+                        return task.result(), self.tiers[answered].name
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _submit(self, invoke: Callable[[BaseLanguageModel], T], index: int, tried: List[int]) -> Future:
+        tried.append(index)
+        self._count(index, "calls")
+        return self._executor.submit(self._timed, invoke, index)
+
+    def _timed(self, invoke: Callable[[BaseLanguageModel], T], index: int) -> T:
+        started = time.time()
+        try:
+            result = invoke(self.tiers[index].llm)
+        except Exception:
+            self._count(index, "failures")
+            raise
+        self._record_latency(index, time.time() - started)
+        return result
+
+    def _astart(self, ainvoke: Callable[[BaseLanguageModel], Awaitable[T]], index: int,
+                tried: List[int]) -> asyncio.Future:
+        tried.append(index)
+        self._count(index, "calls")
+        return asyncio.ensure_future(self._atimed(ainvoke, index))
+
+    async def _atimed(self, ainvoke: Callable[[BaseLanguageModel], Awaitable[T]], index: int) -> T:
+        started = time.time()
+        try:
+            result = await ainvoke(self.tiers[index].llm)
+        except Exception:
+            self._count(index, "failures")
+            raise
+        self._record_latency(index, time.time() - started)
+        return result
+
+    def _attempt_timeout(self, deadline: Optional[float]) -> Optional[float]:
+        timeouts = [timeout for timeout in (self._call_timeout, None if deadline is None else deadline - time.time())
+                    if timeout is not None]
+        return min(timeouts) if timeouts else None
+
+    def _record_latency(self, index: int, latency: float):
+        with self._lock:
+            self.tiers[index].latencies.append(latency)
+
+    def _count(self, index: int, counter: str):
+        with self._lock:
+            self.tiers[index].counters[counter] += 1
+
+    def _count_timeouts(self, indices):
+        for index in indices:
+            self._count(index, "timeouts")
+
+    @staticmethod
+    def _final_error(last_error: Optional[Exception]) -> Exception:
+        if last_error is None or isinstance(last_error, (FutureTimeoutError, asyncio.TimeoutError)):
+            return LlmCallTimeoutError("No LLM tier answered before the deadline")
+        return last_error
@@ -0,0 +1,131 @@
+import logging
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import requests
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+
+class OllamaHost:
+    """One Ollama endpoint of an OllamaRouter with its load, health and latency bookkeeping"""
+
+    def __init__(self, base_url: str, latency_window: int = 1000):
+        self.base_url = base_url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.latencies: Deque[float] = deque(maxlen=latency_window)
+
+    def stats(self) -> dict:
+        ordered = sorted(self.latencies)
+        return {"healthy": self.healthy,
+                "outstanding": self.outstanding,
+                "requests": self.requests,
+                "failures": self.failures,
+                "latency_mean": sum(ordered) / len(ordered) if ordered else None,
+                "latency_p50": ordered[int(0.5 * (len(ordered) - 1))] if ordered else None,
+                "latency_p95": ordered[int(0.95 * (len(ordered) - 1))] if ordered else None}
+
+
+class OllamaRouter:
+    """
+    Spreads the requests of one Ollama setup over several hosts. Every request goes to the healthy host with the
+    least outstanding requests. Hosts failing several requests in a row are taken out of the rotation, and an active
+    health check of /api/tags takes them out as well as re-admits them once they answer again.
+    """
+
+    def __init__(self, base_urls: List[str], unhealthy_after_failures: int = 3,
+                 health_check_interval: Optional[float] = 10.0, health_check_timeout: float = 2.0):
+        """
+        :param base_urls: base urls of the Ollama hosts, e.g. http://ollama:11434
+        :param unhealthy_after_failures: consecutive failed requests after which a host is taken out of the rotation
+        :param health_check_interval: seconds between active health checks. None disables the background checks
+        :param health_check_timeout: seconds a host gets to answer a health check
+        """
+        if not base_urls:
+            raise ValueError("OllamaRouter needs at least one host")
+        self.hosts: List[OllamaHost] = [OllamaHost(base_url) for base_url in base_urls]
+        self._unhealthy_after_failures = unhealthy_after_failures
+        self._health_check_interval = health_check_interval
+        self._health_check_timeout = health_check_timeout
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+        self._next_index = 0
+
+    def acquire(self) -> OllamaHost:
+        """
+        Returns the host the next request goes to and counts the request as outstanding until release. If no host is
+        healthy, all hosts are tried rather than failing right away.
+        """
+        with self._lock:
+            candidates = [host for host in self.hosts if host.healthy] or self.hosts
+            # rotate the start of the scan, so that ties are spread over the hosts
+            offset = self._next_index % len(candidates)
+            self._next_index += 1
+            rotated = candidates[offset:] + candidates[:offset]
+            host = min(rotated, key=lambda candidate: candidate.outstanding)
+            host.outstanding += 1
+            host.requests += 1
+            return host
+
+    def release(self, host: OllamaHost, latency: float, succeeded: bool):
+        with self._lock:
+            host.outstanding -= 1
+            if succeeded:
+                host.consecutive_failures = 0
+                host.latencies.append(latency)
+                return
+            host.failures += 1
+            host.consecutive_failures += 1
+            if host.healthy and host.consecutive_failures >= self._unhealthy_after_failures:
+                host.healthy = False
+                logger.warning("Removed Ollama host %s after %d failed requests", host.base_url,
+                               host.consecutive_failures)
+
+    def check_health(self):
+        """Checks every host once, removing hosts that do not answer and re-admitting hosts that answer again"""
+        for host in self.hosts:
+            try:
+                response = requests.get(f"{host.base_url}/api/tags", timeout=self._health_check_timeout)
+                healthy = response.status_code == 200
+            except requests.RequestException:
+                healthy = False
+            with self._lock:
+                if healthy and not host.healthy:
+                    logger.info("Re-admitted Ollama host %s", host.base_url)
+                    host.consecutive_failures = 0
+                elif not healthy and host.healthy:
+                    logger.warning("Removed Ollama host %s after failed health check", host.base_url)
+                host.healthy = healthy
+
+    def start(self):
+        """Starts the background health checks"""
+        if self._health_check_interval is None or self._health_thread is not None:
+            return
+        self._stopped.clear()
+        self._health_thread = threading.Thread(target=self._check_health_periodically, daemon=True,
+                                               name="ollama-health-check")
+        self._health_thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._health_thread is not None:
+            self._health_thread.join(timeout=self._health_check_timeout + 1)
+            self._health_thread = None
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            return {host.base_url: host.stats() for host in self.hosts}
+
+    def _check_health_periodically(self):
+        while not self._stopped.wait(self._health_check_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.exception("Ollama health check failed: %s", e)
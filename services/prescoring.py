@@ -0,0 +1,167 @@
+import logging
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+_WORD_PATTERN = re.compile(r"\w+")
+# n-gram length whose verbatim matches count as copied text
+COPY_NGRAM = 4
+_NGRAM_LENGTHS = (1, 2, COPY_NGRAM)
+_HASH_MULTIPLIER = np.uint64(1099511628211)
+
+
+class _DocumentTables:
+    """Word ids and n-gram counts of a document, built once per document text"""
+
+    def __init__(self, document: str):
+        words = _WORD_PATTERN.findall(document.lower())
+        # id 0 is reserved for words that are not part of the document
+        self.vocabulary: Dict[str, int] = {}
+        for word in words:
+            self.vocabulary.setdefault(word, len(self.vocabulary) + 1)
+        ids = np.array([self.vocabulary[word] for word in words], dtype=np.uint64)
+        self.token_count = len(words)
+        self.ngrams: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for n in _NGRAM_LENGTHS:
+            keys = _ngram_keys(ids, n)
+            self.ngrams[n] = np.unique(keys, return_counts=True)
+
+
+@lru_cache(maxsize=32)
+def _document_tables(document: str) -> _DocumentTables:
+    return _DocumentTables(document)
+
+
+def _ngram_keys(ids: np.ndarray, n: int) -> np.ndarray:
+    """Hashes every run of n consecutive word ids into one key"""
+    if len(ids) < n:
+        return np.empty(0, dtype=np.uint64)
+    keys = ids[:len(ids) - n + 1].copy()
+    for offset in range(1, n):
+        keys = keys * _HASH_MULTIPLIER ^ ids[offset:len(ids) - n + 1 + offset]
+    return keys
+
+
+class LexicalPreScorer:
+    """
+    Local, LLM free pre-scoring of summaries against their source document: ROUGE-1/2 style n-gram overlap, the ratio
+    of verbatim copied 4-grams, the length ratio and the coverage of the document vocabulary. Scores a whole batch of
+    summaries with a few vectorized NumPy operations. Gates flag the clear-cut cases (empty or truncated, copied,
+    off-topic) whose evaluation does not need the LLM.
+    """
+
+    def __init__(self, min_tokens: Optional[int] = 5, max_copy_ratio: Optional[float] = 0.9,
+                 min_rouge1_precision: Optional[float] = 0.1, max_length_ratio: Optional[float] = None,
+                 gate_score: int = 0):
+        """
+        :param min_tokens: summaries with fewer words are gated as empty or truncated. None disables the gate
+        :param max_copy_ratio: summaries whose 4-grams are copied from the document at least this often are gated as
+        copied. None disables the gate
+        :param min_rouge1_precision: summaries sharing a smaller share of their words with the document are gated as
+        off-topic. None disables the gate
+        :param max_length_ratio: summaries longer than this share of the document are gated as not summarizing. None
+        disables the gate
+        :param gate_score: score of every metric of a gated summary
+        """
+        self.gate_score = gate_score
+        self._min_tokens = min_tokens
+        self._max_copy_ratio = max_copy_ratio
+        self._min_rouge1_precision = min_rouge1_precision
+        self._max_length_ratio = max_length_ratio
+
+    def score_batch(self, document: str, summaries: Sequence[str]) -> List[Dict[str, float]]:
+        """Returns the pre-scores of every summary against the document"""
+        if not summaries:
+            return []
+        tables = _document_tables(document)
+        words_per_summary = [_WORD_PATTERN.findall(summary.lower()) for summary in summaries]
+        ids = np.array([tables.vocabulary.get(word, 0) for words in words_per_summary for word in words],
+                       dtype=np.uint64)
+        segments = np.repeat(np.arange(len(summaries)), [len(words) for words in words_per_summary])
+        batch_size = len(summaries)
+        token_counts = np.bincount(segments, minlength=batch_size).astype(float)
+
+        scores: Dict[str, np.ndarray] = {"tokens": token_counts,
+                                         "length_ratio": token_counts / max(tables.token_count, 1)}
+        for n in (1, 2):
+            overlap, summary_totals = self._clipped_overlap(tables, ids, segments, n, batch_size)
+            document_total = max(int(tables.ngrams[n][1].sum()), 1)
+            precision = np.divide(overlap, summary_totals, out=np.zeros(batch_size), where=summary_totals > 0)
+            recall = overlap / document_total
+            scores[f"rouge{n}_precision"] = precision
+            scores[f"rouge{n}_recall"] = recall
+            scores[f"rouge{n}_f1"] = np.divide(2 * precision * recall, precision + recall,
+                                               out=np.zeros(batch_size), where=precision + recall > 0)
+        scores["copy_ratio"] = self._copy_ratio(tables, ids, segments, batch_size)
+        scores["vocabulary_coverage"] = self._vocabulary_coverage(tables, ids, segments, batch_size)
+        return [{name: round(float(values[index]), 4) for name, values in scores.items()}
+                for index in range(batch_size)]
+
+    def gate(self, pre_scores: Dict[str, float]) -> Optional[str]:
+        """Returns why the summary can be scored without the LLM, or None if it needs the LLM"""
+        if self._min_tokens is not None and pre_scores["tokens"] < self._min_tokens:
+            return f"Summary is empty or truncated ({int(pre_scores['tokens'])} words)"
+        if self._max_copy_ratio is not None and pre_scores["copy_ratio"] >= self._max_copy_ratio:
+            return f"Summary is copied from the source text ({pre_scores['copy_ratio']:.0%} of its 4-grams)"
+        if self._min_rouge1_precision is not None and pre_scores["rouge1_precision"] < self._min_rouge1_precision:
+            return f"Summary is off-topic ({pre_scores['rouge1_precision']:.0%} of its words are in the source text)"
+        if self._max_length_ratio is not None and pre_scores["length_ratio"] > self._max_length_ratio:
+            return f"Summary is not shorter than the source text ({pre_scores['length_ratio']:.0%} of its length)"
+        return None
+
+    @staticmethod
+    def _summary_ngrams(ids: np.ndarray, segments: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the n-gram keys of all summaries and the summary of each key, without n-grams across summaries"""
+        keys = _ngram_keys(ids, n)
+        if not len(keys):
+            return keys, np.empty(0, dtype=int)
+        within_summary = segments[:len(keys)] == segments[n - 1:]
+        return keys[within_summary], segments[:len(keys)][within_summary]
+
+    def _clipped_overlap(self, tables: _DocumentTables, ids: np.ndarray, segments: np.ndarray, n: int,
+                         batch_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the n-grams every summary shares with the document (counted at most as often as in the document)
+        and the number of n-grams of every summary"""
+        keys, key_segments = self._summary_ngrams(ids, segments, n)
+        summary_totals = np.bincount(key_segments, minlength=batch_size).astype(float)
+        if not len(keys):
+            return np.zeros(batch_size), summary_totals
+        # count every distinct (summary, n-gram) pair
+        order = np.lexsort((keys, key_segments))
+        keys, key_segments = keys[order], key_segments[order]
+        run_starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]) | (key_segments[1:] != key_segments[:-1])])
+        summary_counts = np.diff(np.r_[run_starts, len(keys)])
+        document_counts = self._document_counts(tables, n, keys[run_starts])
+        overlap = np.bincount(key_segments[run_starts], weights=np.minimum(summary_counts, document_counts),
+                              minlength=batch_size)
+        return overlap, summary_totals
+
+    def _copy_ratio(self, tables: _DocumentTables, ids: np.ndarray, segments: np.ndarray,
+                    batch_size: int) -> np.ndarray:
+        keys, key_segments = self._summary_ngrams(ids, segments, COPY_NGRAM)
+        totals = np.bincount(key_segments, minlength=batch_size).astype(float)
+        copied = np.bincount(key_segments, weights=self._document_counts(tables, COPY_NGRAM, keys) > 0,
+                             minlength=batch_size)
+        return np.divide(copied, totals, out=np.zeros(batch_size), where=totals > 0)
+
+    @staticmethod
+    def _vocabulary_coverage(tables: _DocumentTables, ids: np.ndarray, segments: np.ndarray,
+                             batch_size: int) -> np.ndarray:
+        known = ids > 0
+        pairs = np.unique(np.stack([segments[known], ids[known].astype(np.int64)]), axis=1)
+        covered = np.bincount(pairs[0], minlength=batch_size).astype(float)
+        return covered / max(len(tables.vocabulary), 1)
+
+    @staticmethod
+    def _document_counts(tables: _DocumentTables, n: int, keys: np.ndarray) -> np.ndarray:
+        """Returns how often every key occurs in the document"""
+        document_keys, document_counts = tables.ngrams[n]
+        if not len(document_keys):
+            return np.zeros(len(keys), dtype=int)
+        positions = np.minimum(np.searchsorted(document_keys, keys), len(document_keys) - 1)
+        return np.where(document_keys[positions] == keys, document_counts[positions], 0)
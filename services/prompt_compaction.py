@@ -0,0 +1,73 @@
+import logging
+import re
+import textwrap
+from typing import Dict, List, Optional, Union
+
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate, HumanMessagePromptTemplate
+
+from services.tokens import count_tokens
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+_SPACES_PATTERN = re.compile(r"[ \t]+")
+
+
+def compact_text(text: str) -> str:
+    """
+    Normalizes the whitespace of a prompt text: the indentation of the template source, runs of spaces, trailing
+    spaces, blank line runs and blank lines after headings go
+    """
+    lines: List[str] = []
+    for line in textwrap.dedent(text.replace("\t", "    ")).splitlines():
+        line = _SPACES_PATTERN.sub(" ", line).strip()
+        if not line:
+            if lines and lines[-1] and not lines[-1].endswith(":"):
+                lines.append("")
+            continue
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def compact_prompt_template(prompt_template: Union[PromptTemplate, ChatPromptTemplate]
+                            ) -> Union[PromptTemplate, ChatPromptTemplate]:
+    """Returns a copy of the prompt template with its template text and partial variables compacted"""
+    if isinstance(prompt_template, PromptTemplate):
+        return PromptTemplate(input_variables=list(prompt_template.input_variables),
+                              template=compact_text(prompt_template.template),
+                              partial_variables=_compact_partials(prompt_template.partial_variables))
+    if isinstance(prompt_template, ChatPromptTemplate):
+        messages = [HumanMessagePromptTemplate(prompt=compact_prompt_template(message.prompt))
+                    if isinstance(message, HumanMessagePromptTemplate) else message
+                    for message in prompt_template.messages]
+        return ChatPromptTemplate(input_variables=list(prompt_template.input_variables), messages=messages,
+                                  partial_variables=_compact_partials(prompt_template.partial_variables))
+    logger.warning("Not compacting prompt template of unknown type %s", type(prompt_template).__name__)
+    return prompt_template
+
+
+def _compact_partials(partial_variables: Optional[dict]) -> dict:
+    return {name: compact_text(value) if isinstance(value, str) else value
+            for name, value in (partial_variables or {}).items()}
+
+
+def prompt_overhead_tokens(prompt_template: Union[PromptTemplate, ChatPromptTemplate]) -> int:
+    """Tokens of the prompt template rendered with empty inputs, i.e. what every prompt costs besides its inputs"""
+    return count_tokens(prompt_template.format_prompt(
+        **{name: "" for name in prompt_template.input_variables}).to_string())
+
+
+def compaction_report(prompt_templates: Dict[str, tuple]) -> Dict[str, dict]:
+    """
+    Compares the original and the compact prompt template of every chain
+    :param prompt_templates: (original, compact) prompt template by chain name
+    :return: the tokens every prompt of the chain costs besides its inputs, before and after compaction, by chain name
+    """
+    report = {}
+    for name, (original, compact) in prompt_templates.items():
+        original_tokens, compact_tokens = prompt_overhead_tokens(original), prompt_overhead_tokens(compact)
+        report[name] = {"original_tokens": original_tokens,
+                        "compact_tokens": compact_tokens,
+                        "saved_tokens": original_tokens - compact_tokens,
+                        "saved_ratio": round(1 - compact_tokens / original_tokens, 4) if original_tokens else 0.0}
+    return report
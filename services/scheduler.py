@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Deque, Dict, Optional, Tuple, Iterator, AsyncIterator, List
+
+import aiohttp
+import httpx
+import openai
+import requests
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = 60.0
+# longest sleep while waiting for a free concurrency slot before checking again
+POLL_SECONDS = 0.05
+# errors of the LLM clients signalling an oversubscribed backend, see is_overload_error
+OVERLOAD_ERRORS = (TimeoutError, asyncio.TimeoutError, httpx.TimeoutException, requests.exceptions.Timeout,
+                   aiohttp.ServerTimeoutError, openai.RateLimitError, openai.APITimeoutError)
+OVERLOAD_STATUS_CODES = (429, 503)
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """
+    True for rate limit errors (HTTP 429, or 503 of a backend whose queue is full) and timeouts, which signal that the
+    backend is oversubscribed
+    """
+    if isinstance(error, OVERLOAD_ERRORS):
+        return True
+    status_code = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return status_code in OVERLOAD_STATUS_CODES
+
+
+class LlmScheduler:
+    """
+    Admission control in front of the LLM calls of one llm setup. Enforces requests and tokens per minute budgets
+    over a sliding window and adapts the number of concurrent calls AIMD style: every fast successful call increases
+    the limit by 1/limit, while rate limit errors, timeouts and calls slower than the target latency halve it.
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None,
+                 initial_concurrency: int = 4, min_concurrency: int = 1, max_concurrency: int = 16,
+                 target_latency: Optional[float] = None, decrease_factor: float = 0.5,
+                 decrease_cooldown: float = 1.0, expected_completion_tokens: int = 256):
+        """
+        :param requests_per_minute: budget of calls per minute. None disables the budget
+        :param tokens_per_minute: budget of prompt and completion tokens per minute. None disables the budget
+        :param target_latency: calls slower than this many seconds decrease the concurrency limit
+        :param decrease_cooldown: minimum seconds between two decreases, so that one burst of errors halves the
+        limit only once
+        :param expected_completion_tokens: completion tokens reserved per call until the actual count is known
+        """
+        self._requests_per_minute = requests_per_minute
+        self._tokens_per_minute = tokens_per_minute
+        self._min_concurrency = max(1, min_concurrency)
+        self._max_concurrency = max(self._min_concurrency, max_concurrency)
+        self._limit = float(min(max(initial_concurrency, self._min_concurrency), self._max_concurrency))
+        self._target_latency = target_latency
+        self._decrease_factor = decrease_factor
+        self._decrease_cooldown = decrease_cooldown
+        self._expected_completion_tokens = expected_completion_tokens
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._window: Deque[List] = deque()  # [start time, tokens] of the calls of the last minute
+        self._window_tokens = 0
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {"calls": 0, "overloads": 0, "slow_calls": 0, "waits": 0,
+                                            "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    @contextmanager
+    def slot(self, prompt_tokens: int) -> Iterator["CallRecord"]:
+        """Blocks until the call fits into the budgets and the concurrency limit, and reports its outcome on exit"""
+        record = CallRecord(prompt_tokens + self._expected_completion_tokens)
+        waited = 0.0
+        while not self._try_acquire(record):
+            wait = self._wait_seconds(record)
+            time.sleep(wait)
+            waited += wait
+        self._record_wait(waited)
+        started = time.time()
+        try:
+            yield record
+        except BaseException as e:
+            self._release(record, time.time() - started, is_overload_error(e))
+            raise
+        self._release(record, time.time() - started, False)
+
+    @asynccontextmanager
+    async def aslot(self, prompt_tokens: int) -> AsyncIterator["CallRecord"]:
+        """Async counterpart of slot"""
+        record = CallRecord(prompt_tokens + self._expected_completion_tokens)
+        waited = 0.0
+        while not self._try_acquire(record):
+            wait = self._wait_seconds(record)
+            await asyncio.sleep(wait)
+            waited += wait
+        self._record_wait(waited)
+        started = time.time()
+        try:
+            yield record
+        except BaseException as e:
+            self._release(record, time.time() - started, is_overload_error(e))
+            raise
+        self._release(record, time.time() - started, False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._prune(time.time())
+            return dict(self._counters,
+                        concurrency_limit=self._limit,
+                        in_flight=self._in_flight,
+                        requests_in_window=len(self._window),
+                        tokens_in_window=self._window_tokens,
+                        requests_per_minute=self._requests_per_minute,
+                        tokens_per_minute=self._tokens_per_minute)
+
+    def _record_wait(self, waited: float):
+        with self._lock:
+            self._counters["waits"] += waited > 0
+            self._counters["wait_seconds"] += waited
+            self._counters["max_wait_seconds"] = max(self._counters["max_wait_seconds"], waited)
+
+    def _try_acquire(self, record: "CallRecord") -> bool:
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            if self._blocking_seconds(record.reserved_tokens, now) is not None:
+                return False
+            self._in_flight += 1
+            record.window_entry = [now, record.reserved_tokens]
+            self._window.append(record.window_entry)
+            self._window_tokens += record.reserved_tokens
+            return True
+
+    def _wait_seconds(self, record: "CallRecord") -> float:
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            blocking = self._blocking_seconds(record.reserved_tokens, now)
+        return POLL_SECONDS if blocking is None else max(POLL_SECONDS, blocking)
+
+    def _blocking_seconds(self, tokens: int, now: float) -> Optional[float]:
+        """Returns None if a call with tokens can start now, otherwise the seconds until it may be able to"""
+        if self._in_flight >= int(self._limit):
+            return POLL_SECONDS
+        if self._requests_per_minute is not None and len(self._window) >= self._requests_per_minute:
+            return self._window[0][0] + WINDOW_SECONDS - now
+        if self._tokens_per_minute is not None and self._window and \
+                self._window_tokens + tokens > self._tokens_per_minute:
+            # wait until enough tokens left the window (a call above the whole budget runs in an empty window)
+            excess = self._window_tokens + tokens - self._tokens_per_minute
+            for timestamp, window_tokens in self._window:
+                excess -= window_tokens
+                if excess <= 0:
+                    return timestamp + WINDOW_SECONDS - now
+            return self._window[-1][0] + WINDOW_SECONDS - now
+        return None
+
+    def _release(self, record: "CallRecord", latency: float, overloaded: bool):
+        now = time.time()
+        with self._lock:
+            self._in_flight -= 1
+            self._counters["calls"] += 1
+            if record.completion_tokens is not None:
+                self._correct_tokens(record)
+            slow = self._target_latency is not None and latency > self._target_latency
+            if overloaded or slow:
+                self._counters["overloads" if overloaded else "slow_calls"] += 1
+                if now - self._last_decrease >= self._decrease_cooldown:
+                    self._limit = max(self._min_concurrency, self._limit * self._decrease_factor)
+                    self._last_decrease = now
+                    logger.warning("Decreased LLM concurrency limit to %.2f (latency %.2fs, overloaded: %s)",
+                                   self._limit, latency, overloaded)
+            else:
+                self._limit = min(self._max_concurrency, self._limit + 1 / self._limit)
+
+    def _correct_tokens(self, record: "CallRecord"):
+        """Replaces the reserved completion tokens of the call in the window by the actual ones"""
+        entry = record.window_entry
+        if entry is None or entry[0] <= time.time() - WINDOW_SECONDS:
+            return
+        actual = record.reserved_tokens - self._expected_completion_tokens + record.completion_tokens
+        self._window_tokens += actual - entry[1]
+        entry[1] = actual
+
+    def _prune(self, now: float):
+        while self._window and self._window[0][0] <= now - WINDOW_SECONDS:
+            self._window_tokens -= self._window.popleft()[1]
+
+
+class CallRecord:
+    """Handed to the caller of a slot, to report the completion tokens of the call"""
+
+    def __init__(self, reserved_tokens: int):
+        self.reserved_tokens = reserved_tokens
+        self.completion_tokens: Optional[int] = None
+        self.window_entry: Optional[List] = None
+
+
+# schedulers shared by all chain wrappers of the process, keyed by llm setup and configuration
+_schedulers: Dict[Tuple[str, str], LlmScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_llm_scheduler(setup_name: str, scheduler_params: dict) -> Optional[LlmScheduler]:
+    """
+    Returns the process-wide scheduler of the llm setup, or None if the setup has no llm_scheduler config
+    :param scheduler_params: llm_scheduler section of the setup in the config
+    """
+    if not scheduler_params:
+        return None
+    key = (setup_name, json.dumps(scheduler_params, sort_keys=True, default=str))
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = LlmScheduler(requests_per_minute=scheduler_params.get('REQUESTS_PER_MINUTE'),
+                                     tokens_per_minute=scheduler_params.get('TOKENS_PER_MINUTE'),
+                                     initial_concurrency=scheduler_params.get('INITIAL_CONCURRENCY', 4),
+                                     min_concurrency=scheduler_params.get('MIN_CONCURRENCY', 1),
+                                     max_concurrency=scheduler_params.get('MAX_CONCURRENCY', 16),
+                                     target_latency=scheduler_params.get('TARGET_LATENCY_SECONDS'),
+                                     expected_completion_tokens=scheduler_params.get('EXPECTED_COMPLETION_TOKENS',
+                                                                                     256))
+            _schedulers[key] = scheduler
+            logger.info("Created LLM scheduler for setup %s with %s", setup_name, scheduler_params)
+        return scheduler
@@ -0,0 +1,104 @@
+import re
+from dataclasses import dataclass
+from typing import List, Callable, Sequence, Optional, Tuple
+
+from services.tokens import count_tokens
+
+# a sentence ends at ., ! or ? (optionally followed by closing quotes or brackets) followed by whitespace
+_SENTENCE_END_PATTERN = re.compile(r"""(?<=[.!?])["')\]]*\s+""")
+
+
+@dataclass(frozen=True)
+class Sentence:
+    text: str
+    start: int  # character offset of the sentence in the segmented text
+    end: int
+
+
+def split_sentences(text: str) -> List[Sentence]:
+    """
+    Splits text into sentences at sentence ending punctuation and line breaks. Leading and trailing whitespace is not
+    part of a sentence, so text[sentence.start:sentence.end] == sentence.text.
+    """
+    sentences: List[Sentence] = []
+    for line in re.finditer(r"[^\n]+", text):
+        position = line.start()
+        boundaries = [match.end() for match in _SENTENCE_END_PATTERN.finditer(line.group())] + [len(line.group())]
+        for boundary in boundaries:
+            segment_end = line.start() + boundary
+            raw = text[position:segment_end]
+            stripped = raw.strip()
+            if stripped:
+                start = position + len(raw) - len(raw.lstrip())
+                sentences.append(Sentence(text=stripped, start=start, end=start + len(stripped)))
+            position = segment_end
+    return sentences
+
+
+def normalize_sentence(sentence: str) -> str:
+    """Collapses whitespace runs, so that sentences differing only in spacing are treated as equal"""
+    return " ".join(sentence.split())
+
+
+def locate_fragment(text: str, fragment: str, start: Optional[int] = None,
+                    end: Optional[int] = None) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Returns the offsets of fragment in text, preferring the given offsets if they point at the fragment. Returns
+    (None, None) if the fragment is not part of text.
+    """
+    if start is not None and end is not None and text[start:end] == fragment:
+        return start, end
+    found = text.find(fragment)
+    if found < 0:
+        return None, None
+    return found, found + len(fragment)
+
+
+def pack_batches(texts: Sequence[str], max_batch_tokens: int,
+                 token_counter: Callable[[str], int] = count_tokens) -> List[List[int]]:
+    """
+    Packs texts in order into batches whose token count stays within max_batch_tokens. A text exceeding the budget
+    on its own gets a batch of its own.
+    :return: the indices of the texts in each batch
+    """
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    batch_tokens = 0
+    for index, text in enumerate(texts):
+        tokens = token_counter(text)
+        if batch and batch_tokens + tokens > max_batch_tokens:
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(index)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def chunk_text(text: str, max_chunk_tokens: int, overlap_tokens: int = 0,
+               token_counter: Callable[[str], int] = count_tokens) -> List[str]:
+    """
+    Splits text into chunks of whole sentences with at most max_chunk_tokens tokens each. Consecutive chunks share
+    sentences worth up to overlap_tokens tokens, so content at a chunk border is also seen with its context. A
+    sentence exceeding max_chunk_tokens on its own makes a chunk of its own.
+    """
+    sentences = split_sentences(text)
+    tokens = [token_counter(sentence.text) for sentence in sentences]
+    chunks: List[str] = []
+    start = 0
+    while start < len(sentences):
+        end, chunk_tokens = start, 0
+        while end < len(sentences) and (end == start or chunk_tokens + tokens[end] <= max_chunk_tokens):
+            chunk_tokens += tokens[end]
+            end += 1
+        chunks.append(text[sentences[start].start:sentences[end - 1].end])
+        if end == len(sentences):
+            break
+        # the next chunk repeats the last sentences of this one, but always starts after this one's first sentence
+        next_start, overlap = end, 0
+        while next_start - 1 > start and overlap + tokens[next_start - 1] <= overlap_tokens:
+            next_start -= 1
+            overlap += tokens[next_start]
+        start = next_start
+    return chunks
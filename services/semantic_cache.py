@@ -0,0 +1,191 @@
+import difflib
+import json
+import logging
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.pydantic_v1 import BaseModel
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+_SPACES_PATTERN = re.compile(r"\s+")
+
+
+def normalized_text(text: str) -> str:
+    """The text in lower case with its whitespace collapsed, as it is embedded"""
+    return _SPACES_PATTERN.sub(' ', text).strip().lower()
+
+
+def hashed_ngram_vector(text: str, dimensions: int = 2048, ngram_size: int = 3) -> np.ndarray:
+    """
+    Embeds the text as unit length vector of its hashed character n-grams (the hashing trick), which only needs
+    NumPy. Case and whitespace are normalized, so texts differing by a few characters get close vectors.
+    """
+    normalized = f" {normalized_text(text)} "
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for start in range(max(1, len(normalized) - ngram_size + 1)):
+        digest = zlib.crc32(normalized[start:start + ngram_size].encode("utf-8"))
+        # the top bit signs the n-gram, so that colliding n-grams cancel out instead of adding up
+        vector[digest % dimensions] += 1.0 if digest & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _VectorIndex:
+    """Texts, their vectors and results of one document and model version, oldest first"""
+
+    def __init__(self, dimensions: int):
+        self.vectors = np.empty((0, dimensions), dtype=np.float32)
+        self.texts: List[str] = []
+        self.results: List[BaseModel] = []
+
+
+class SemanticResultCache:
+    """
+    Cache of evaluation results for near-duplicate texts: classmates copying phrasing or a student resubmitting with a
+    typo fixed. Every namespace, document and model version has an in-memory vector index of the hashed n-gram
+    vectors of the evaluated texts; a text reuses the result of its most similar indexed text if their cosine
+    similarity reaches the threshold. Least recently used indexes are dropped above max_indexes.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries_per_index: int = 1000, max_indexes: int = 256,
+                 dimensions: int = 2048, ngram_size: int = 3):
+        """
+        :param threshold: lowest cosine similarity of the hashed n-gram vectors at which a result is reused
+        :param max_entries_per_index: oldest texts of an index are dropped above this number
+        :param max_indexes: least recently used indexes are dropped above this number
+        :param dimensions: dimensions of the hashed n-gram vectors
+        :param ngram_size: characters per n-gram
+        """
+        self._threshold = threshold
+        self._max_entries_per_index = max_entries_per_index
+        self._max_indexes = max_indexes
+        self._dimensions = dimensions
+        self._ngram_size = ngram_size
+        self._indexes: "OrderedDict[Tuple[str, str, str], _VectorIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0, "rejections": 0, "stores": 0, "invalidations": 0}
+
+    def get(self, namespace: str, document_id: Optional[str], model_version: str, text: str,
+            accept: Optional[Callable[[str, BaseModel], bool]] = None,
+            threshold: Optional[float] = None) -> Optional[Tuple[BaseModel, float]]:
+        """
+        Returns a copy of the result of the most similar text above the threshold and the similarity, or None
+        :param namespace: kind of evaluation, e.g. the recording type
+        :param document_id: document the text was evaluated against. None for evaluations without a document
+        :param model_version: version of the llm, prompt and parser the results were produced with
+        :param accept: decides whether the result of an indexed text (the text and its result) may be reused for
+        text. Candidates are tried from the most similar one on, outside of the lock of the cache. accept must not
+        modify the result
+        :param threshold: overrides the threshold of the cache
+        """
+        vector = hashed_ngram_vector(text, self._dimensions, self._ngram_size)
+        threshold = self._threshold if threshold is None else threshold
+        candidates: List[Tuple[str, BaseModel, float]] = []
+        with self._lock:
+            index = self._indexes.get((namespace, document_id or "", model_version))
+            if index is not None and index.texts:
+                self._indexes.move_to_end((namespace, document_id or "", model_version))
+                similarities = index.vectors @ vector
+                # stored results are never modified, so the candidates can be decided on after releasing the lock
+                candidates = [(index.texts[position], index.results[position], float(similarities[position]))
+                              for position in np.argsort(-similarities) if similarities[position] >= threshold]
+        rejections = 0
+        for candidate_text, result, similarity in candidates:
+            if accept is None or accept(candidate_text, result):
+                with self._lock:
+                    self._counters["hits"] += 1
+                    self._counters["rejections"] += rejections
+                return result.copy(deep=True), similarity
+            rejections += 1
+        with self._lock:
+            self._counters["misses"] += 1
+            self._counters["rejections"] += rejections
+        return None
+
+    def put(self, namespace: str, document_id: Optional[str], model_version: str, text: str, result: BaseModel):
+        vector = hashed_ngram_vector(text, self._dimensions, self._ngram_size)
+        key = (namespace, document_id or "", model_version)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._indexes[key] = _VectorIndex(self._dimensions)
+            self._indexes.move_to_end(key)
+            index.vectors = np.vstack([index.vectors, vector[np.newaxis, :]])[-self._max_entries_per_index:]
+            index.texts = (index.texts + [text])[-self._max_entries_per_index:]
+            index.results = (index.results + [result.copy(deep=True)])[-self._max_entries_per_index:]
+            self._counters["stores"] += 1
+            while len(self._indexes) > self._max_indexes:
+                self._indexes.popitem(last=False)
+
+    def invalidate(self, document_id: Optional[str] = None, model_version: Optional[str] = None) -> int:
+        """
+        Drops the indexes of the document, of the model version or, with both, of the document and model version.
+        Without either, drops all indexes
+        :return: number of dropped results
+        """
+        with self._lock:
+            keys = [key for key in self._indexes
+                    if (document_id is None or key[1] == document_id) and
+                    (model_version is None or key[2] == model_version)]
+            dropped = sum(len(self._indexes.pop(key).texts) for key in keys)
+            self._counters["invalidations"] += dropped
+        logger.info("Invalidated %d cached results of document %s and model version %s", dropped, document_id,
+                    model_version)
+        return dropped
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return dict(self._counters,
+                        hit_rate=self._counters["hits"] / lookups if lookups else None,
+                        indexes=len(self._indexes),
+                        entries=sum(len(index.texts) for index in self._indexes.values()),
+                        model_versions=sorted({key[2] for key in self._indexes}))
+
+
+def model_version(*components) -> str:
+    """Short hash of what determines an evaluation result, e.g. the llm type, model name, temperature and prompt"""
+    payload = json.dumps([str(component) for component in components])
+    return format(zlib.crc32(payload.encode("utf-8")), "08x")
+
+
+# caches shared by all evaluators of the process, keyed by their configuration
+_caches: Dict[str, SemanticResultCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_semantic_cache(cache_params: dict) -> Optional[SemanticResultCache]:
+    """
+    Returns the process-wide semantic result cache for the semantic_cache config section, or None if it is disabled
+    :param cache_params: semantic_cache section of the config
+    """
+    if not cache_params or not cache_params.get('ENABLED', False):
+        return None
+    key = json.dumps(cache_params, sort_keys=True, default=str)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = SemanticResultCache(threshold=cache_params.get('SUMMARY_THRESHOLD', 0.95),
+                                        max_entries_per_index=cache_params.get('MAX_ENTRIES_PER_DOCUMENT', 1000),
+                                        max_indexes=cache_params.get('MAX_DOCUMENTS', 256),
+                                        dimensions=cache_params.get('DIMENSIONS', 2048),
+                                        ngram_size=cache_params.get('NGRAM_SIZE', 3))
+            _caches[key] = cache
+            logger.info("Created semantic result cache with %s", cache_params)
+    return cache
+
+
+def changes_within(text: str, new_text: str, spans: List[Tuple[int, int]]) -> bool:
+    """
+    Whether every difference between text and new_text lies within (or right at) one of the character spans of text,
+    e.g. a resubmission that only fixed the errors found in text
+    """
+    matcher = difflib.SequenceMatcher(None, text, new_text, autojunk=False)
+    return all(tag == "equal" or any(start <= changed_start and changed_end <= end for start, end in spans)
+               for tag, changed_start, changed_end, _, _ in matcher.get_opcodes())
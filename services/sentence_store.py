@@ -0,0 +1,64 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, List
+
+from pydantic_models.evaluator import Errors, ErrorItem, PositionedErrorItem
+from services.segmentation import normalize_sentence, locate_fragment
+
+
+class SentenceErrorsStore:
+    """
+    Bounded in-memory LRU of the grammatical errors found per sentence, keyed by the hash of the normalized sentence.
+    Lets GrammaticalEvaluator re-evaluate an edited text by sending only its new or changed sentences to the LLM.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[str, List[dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(sentence: str) -> str:
+        return hashlib.sha256(normalize_sentence(sentence).encode("utf-8")).hexdigest()
+
+    def get(self, sentence: str, sentence_index: int = 0) -> Optional[Errors]:
+        """
+        Returns copies of the stored errors of the sentence with offsets relative to the given sentence text, or None
+        if the sentence has not been evaluated yet
+        """
+        key = self.make_key(sentence)
+        with self._lock:
+            stored = self._entries.get(key)
+            if stored is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+        error_items: List[PositionedErrorItem] = []
+        for item in stored:
+            start, end = locate_fragment(sentence, item["error"], item.get("start"), item.get("end"))
+            error_items.append(PositionedErrorItem(**dict(item, sentence_index=sentence_index, start=start, end=end)))
+        return Errors(error=error_items)
+
+    def put(self, sentence: str, errors: Errors):
+        """Stores the errors of the sentence. Their offsets must be relative to the sentence"""
+        stored = [self._to_dict(item) for item in errors.error]
+        key = self.make_key(sentence)
+        with self._lock:
+            self._entries[key] = stored
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries))
+
+    @staticmethod
+    def _to_dict(item: ErrorItem) -> dict:
+        stored = {"error": item.error, "correction": item.correction, "category": item.category}
+        if isinstance(item, PositionedErrorItem):
+            stored.update(start=item.start, end=item.end)
+        return stored
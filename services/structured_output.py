@@ -0,0 +1,215 @@
+import json
+import logging
+import re
+from typing import Any, List, Tuple, Type, Union
+
+from langchain.pydantic_v1 import BaseModel, ValidationError
+from langchain_community.chat_models import ChatOpenAI
+from langchain_community.chat_models import ChatOllama
+from langchain_community.llms import ollama
+from langchain_core.exceptions import OutputParserException
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import BaseOutputParser
+from langchain_core.outputs import ChatGeneration, Generation
+from langchain_core.runnables import Runnable
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+_CODE_FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL)
+_LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "/": "/", "\\": "\\", '"': '"', "'": "'"}
+
+
+def response_text(response: Union[BaseMessage, str]) -> str:
+    """
+    Returns the text of a chat model message or a completion model string. Messages answering with a tool or
+    function call return the arguments of the call, which hold the structured output.
+    """
+    if not isinstance(response, BaseMessage):
+        return response
+    if not response.content:
+        tool_calls = response.additional_kwargs.get("tool_calls") or []
+        if tool_calls:
+            return "".join((tool_call.get("function") or {}).get("arguments") or "" for tool_call in tool_calls)
+        function_call = response.additional_kwargs.get("function_call")
+        if function_call:
+            return function_call.get("arguments") or ""
+    return response.content
+
+
+def compact_format_instructions(output_model: Type[BaseModel]) -> str:
+    """Returns a one line JSON skeleton of the model, instead of its full JSON schema"""
+    schema = convert_to_openai_tool(output_model)["function"]["parameters"]
+    return f"Respond only with a JSON object of this form: {_skeleton(schema)}"
+
+
+def _skeleton(schema: dict) -> str:
+    if schema.get("type") == "object":
+        fields = ", ".join(f'"{name}": {_skeleton(field)}' for name, field in schema.get("properties", {}).items())
+        return "{" + fields + "}"
+    if schema.get("type") == "array":
+        return f"[{_skeleton(schema.get('items') or {})}, ...]"
+    description = schema.get("description")
+    return f"<{schema.get('type', 'value')}: {description}>" if description else f"<{schema.get('type', 'value')}>"
+
+
+def repair_json(text: str) -> Any:
+    """
+    Parses the first JSON object or array in an LLM response, repairing the usual defects locally instead of asking
+    the LLM again: markdown code fences, text around the JSON, single quoted or unescaped strings, unquoted keys and
+    words, Python literals, trailing commas and a response truncated before its closing brackets
+    :raises ValueError: if the response does not contain a repairable JSON object or array
+    """
+    fenced = _CODE_FENCE_PATTERN.search(text)
+    if fenced is not None:
+        text = fenced.group(1)
+    starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+    if not starts:
+        raise ValueError("No JSON object or array in the response")
+    text = text[min(starts):]
+    try:
+        return json.JSONDecoder().raw_decode(text)[0]
+    except json.JSONDecodeError:
+        pass
+    repaired = _repair(text)
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Could not repair the JSON of the response: {e}") from e
+
+
+def _repair(text: str) -> str:
+    out: List[str] = []
+    closing: List[str] = []
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if char in "\"'":
+            value, index = _read_string(text, index)
+            out.append(json.dumps(value, ensure_ascii=False))
+            continue
+        if char in "{[":
+            closing.append("}" if char == "{" else "]")
+            out.append(char)
+        elif char in "}]":
+            _drop_trailing_comma(out)
+            if closing:
+                out.append(closing.pop())
+            if not closing:
+                break
+        elif char.isalpha() or char == "_":
+            end = index
+            while end < len(text) and (text[end].isalnum() or text[end] == "_"):
+                end += 1
+            word = text[index:end]
+            out.append(_LITERALS.get(word, json.dumps(word)))
+            index = end
+            continue
+        else:
+            out.append(char)
+        index += 1
+    # a truncated response: drop a dangling key, complete a key without value and close the open objects and arrays
+    _drop_trailing_comma(out)
+    tokens = [token for token in out if token.strip()]
+    if closing and closing[-1] == "}" and len(tokens) >= 2 and tokens[-1].startswith('"') and tokens[-2] in "{,":
+        while out[-1] is not tokens[-1]:
+            out.pop()
+        out.pop()
+        _drop_trailing_comma(out)
+    if out and out[-1].rstrip().endswith(":"):
+        out.append("null")
+    return "".join(out) + "".join(reversed(closing))
+
+
+def _read_string(text: str, start: int) -> Tuple[str, int]:
+    """Reads the string starting with the quote at start and returns its value and the index after it"""
+    quote = text[start]
+    chars: List[str] = []
+    index = start + 1
+    while index < len(text):
+        char = text[index]
+        if char == "\\" and index + 1 < len(text):
+            escaped = text[index + 1]
+            if escaped == "u" and re.fullmatch(r"[0-9a-fA-F]{4}", text[index + 2:index + 6]):
+                chars.append(chr(int(text[index + 2:index + 6], 16)))
+                index += 6
+                continue
+            chars.append(_ESCAPES.get(escaped, escaped))
+            index += 2
+            continue
+        if char == quote and _ends_string(text, index + 1):
+            return "".join(chars), index + 1
+        chars.append(char)
+        index += 1
+    return "".join(chars), index
+
+
+def _ends_string(text: str, index: int) -> bool:
+    """A quote only ends a string if JSON syntax follows it, otherwise it is a quote inside the string"""
+    rest = text[index:].lstrip()
+    return not rest or rest[0] in ",:}]"
+
+
+def _drop_trailing_comma(out: List[str]):
+    while out and not out[-1].strip():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+class NativeOutputParser(BaseOutputParser):
+    """
+    Parses the constrained JSON output of an LLM straight into the pydantic model, with compact format instructions
+    and a local JSON repair instead of another LLM round trip when the output is malformed
+    """
+    pydantic_object: Type[BaseModel]
+
+    def parse(self, text: str) -> BaseModel:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            try:
+                data = repair_json(text)
+            except ValueError as e:
+                raise OutputParserException(f"Invalid JSON output: {e}", llm_output=text) from e
+            logger.info("Repaired malformed JSON output of the LLM")
+        fields = list(self.pydantic_object.__fields__.values())
+        if isinstance(data, list) and len(fields) == 1:
+            # a bare list answering a model with a single list field
+            data = {fields[0].name: data}
+        try:
+            return self.pydantic_object.parse_obj(data)
+        except ValidationError as e:
+            raise OutputParserException(f"Output does not match {self.pydantic_object.__name__}: {e}",
+                                        llm_output=text) from e
+
+    def parse_result(self, result: List[Generation], *, partial: bool = False) -> BaseModel:
+        generation = result[0]
+        if isinstance(generation, ChatGeneration):
+            return self.parse(response_text(generation.message))
+        return self.parse(generation.text)
+
+    def get_format_instructions(self) -> str:
+        return compact_format_instructions(self.pydantic_object)
+
+    @property
+    def _type(self) -> str:
+        return "native"
+
+
+def bind_structured_output(llm: BaseLanguageModel, output_model: Type[BaseModel]) -> Union[BaseLanguageModel,
+                                                                                             Runnable]:
+    """
+    Binds the native structured output of the llm: a forced tool call with the JSON schema of the model for OpenAI,
+    format=json constrained decoding for Ollama. Other llms are returned unchanged.
+    """
+    if isinstance(llm, ChatOpenAI):
+        tool = convert_to_openai_tool(output_model)
+        return llm.bind(tools=[tool], tool_choice={"type": "function", "function": {"name": tool["function"]["name"]}})
+    if isinstance(llm, (ollama.Ollama, ChatOllama)):
+        return llm.bind(format="json")
+    return llm
+
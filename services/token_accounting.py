@@ -0,0 +1,68 @@
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+
+class TokenAccountant:
+    """
+    Records the prompt and completion tokens of every chain invocation per recording type and metric, along with the
+    prompt tokens the original, uncompacted prompt would have cost and the invocations answered from the cache
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[Tuple[str, str], Dict[str, int]] = {}
+
+    def record(self, recording_type: str, metric: str, prompt_tokens: int, completion_tokens: int,
+               original_prompt_tokens: Optional[int] = None, cached: bool = False):
+        """
+        :param original_prompt_tokens: tokens of the prompt before compaction. None if the prompt was not compacted
+        :param cached: the invocation was answered from the cache, so its tokens were not sent to the LLM
+        """
+        with self._lock:
+            totals = self._totals.setdefault((recording_type, metric), {
+                "invocations": 0, "cached_invocations": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "original_prompt_tokens": 0, "cached_tokens": 0})
+            totals["invocations"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["original_prompt_tokens"] += prompt_tokens if original_prompt_tokens is None \
+                else original_prompt_tokens
+            if cached:
+                totals["cached_invocations"] += 1
+                totals["cached_tokens"] += prompt_tokens + completion_tokens
+
+    def stats(self) -> Dict[str, Dict[str, dict]]:
+        """Returns the totals and means per invocation by recording type and metric"""
+        with self._lock:
+            totals = {key: dict(value) for key, value in self._totals.items()}
+        stats: Dict[str, Dict[str, dict]] = {}
+        for (recording_type, metric), metric_totals in sorted(totals.items()):
+            invocations = metric_totals["invocations"]
+            stats.setdefault(recording_type, {})[metric] = dict(
+                metric_totals,
+                saved_prompt_tokens=metric_totals["original_prompt_tokens"] - metric_totals["prompt_tokens"],
+                mean_prompt_tokens=metric_totals["prompt_tokens"] / invocations,
+                mean_completion_tokens=metric_totals["completion_tokens"] / invocations)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._totals.clear()
+
+
+# accountant shared by all chain wrappers of the process
+token_accountant = TokenAccountant()
+
+
+def get_token_accountant(accounting_params: dict) -> Optional[TokenAccountant]:
+    """
+    Returns the process-wide token accountant, or None if token accounting is disabled
+    :param accounting_params: token_accounting section of the config
+    """
+    if not accounting_params or not accounting_params.get('ENABLED', False):
+        return None
+    return token_accountant
@@ -0,0 +1,44 @@
+import logging
+import threading
+from typing import Optional
+
+# init module logger
+logger = logging.getLogger(__name__)
+
+# average number of characters per token, used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+ENCODING_NAME = "cl100k_base"
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """Loads the tiktoken encoding once. Returns None if tiktoken or its encoding files are unavailable"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception as e:
+                    logger.warning("Tokenizer %s unavailable, estimating tokens from characters: %s",
+                                   ENCODING_NAME, e)
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """
+    Counts the tokens of text with the cl100k_base tokenizer or, if that is unavailable, estimates them from the
+    number of characters
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
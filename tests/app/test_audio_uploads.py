@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.controllers.audio_uploads import AudioUploadManager, UploadStore, UploadStatus, UploadConflictError, \
+    ChunkChecksumMismatchError, IncompleteUploadError, UploadNotFoundError
+from app.models.pydantic.sessions import Recording, RecordingStatus
+from app.models.repositories import recording as recording_module
+from app.models.repositories.recording import RecordingRepo
+from app.routers import sessions
+from app.routers.main import app
+
+AUDIO = os.urandom(10 * 1024 + 100)
+CHUNK_BYTES = 1024
+
+
+def _chunks(data: bytes):
+    return [(offset, data[offset:offset + CHUNK_BYTES]) for offset in range(0, len(data), CHUNK_BYTES)]
+
+
+@pytest.fixture
+def manager(tmp_path) -> AudioUploadManager:
+    return AudioUploadManager(UploadStore(str(tmp_path / "uploads.sqlite3")), str(tmp_path),
+                              max_chunk_bytes=CHUNK_BYTES)
+
+
+def test_parallel_out_of_order_chunks_are_assembled(manager: AudioUploadManager, tmp_path):
+    async def upload() -> str:
+        created = await manager.create(2, "presentation.wav", len(AUDIO))
+        await asyncio.gather(*[manager.write_chunk(created.id, offset, chunk, hashlib.sha256(chunk).hexdigest())
+                               for offset, chunk in reversed(_chunks(AUDIO))])
+        await manager.finalize(created.id, str(tmp_path / "audio.wav"), hashlib.sha256(AUDIO).hexdigest())
+        return created.id
+
+    upload_id = asyncio.run(upload())
+    with open(tmp_path / "audio.wav", "rb") as saved:
+        assert saved.read() == AUDIO
+    # the state is read back from the store, as after a restart
+    upload = AudioUploadManager(UploadStore(str(tmp_path / "uploads.sqlite3")), str(tmp_path)).get(upload_id)
+    assert (upload.status, upload.sha256) == (UploadStatus.FINALIZED, hashlib.sha256(AUDIO).hexdigest())
+    assert manager.stats()["chunks"] == len(_chunks(AUDIO))
+
+
+def test_duplicate_chunks_are_verified(manager: AudioUploadManager):
+    upload = asyncio.run(manager.create(2, "audio.wav", len(AUDIO)))
+    offset, chunk = _chunks(AUDIO)[1]
+    asyncio.run(manager.write_chunk(upload.id, offset, chunk))
+    assert asyncio.run(manager.write_chunk(upload.id, offset, chunk))[1]
+    with pytest.raises(UploadConflictError):
+        asyncio.run(manager.write_chunk(upload.id, offset, bytes(len(chunk))))
+    with pytest.raises(UploadConflictError):
+        asyncio.run(manager.write_chunk(upload.id, offset + 1, chunk[:10]))
+    with pytest.raises(ChunkChecksumMismatchError):
+        asyncio.run(manager.write_chunk(upload.id, 0, AUDIO[:CHUNK_BYTES], hashlib.sha256(b"other").hexdigest()))
+
+
+def test_incomplete_upload_is_not_finalized(manager: AudioUploadManager, tmp_path):
+    upload = asyncio.run(manager.create(2, "audio.wav", len(AUDIO)))
+    for offset, chunk in _chunks(AUDIO)[:-1]:
+        asyncio.run(manager.write_chunk(upload.id, offset, chunk))
+    with pytest.raises(IncompleteUploadError) as error:
+        asyncio.run(manager.finalize(upload.id, str(tmp_path / "audio.wav")))
+    assert error.value.missing_ranges == [(10 * CHUNK_BYTES, len(AUDIO))]
+    assert not os.path.exists(tmp_path / "audio.wav")
+
+
+def test_only_idle_active_uploads_are_aborted(monkeypatch, manager: AudioUploadManager, tmp_path):
+    write = manager._write
+    monkeypatch.setattr(manager, "_write", lambda *args: time.sleep(0.2) or write(*args))
+
+    async def abort_while_writing(upload_id: str):
+        writing = asyncio.ensure_future(manager.write_chunk(upload_id, 0, AUDIO[:CHUNK_BYTES]))
+        await asyncio.sleep(0.05)
+        with pytest.raises(UploadConflictError):
+            await manager.abort(upload_id)
+        await writing
+
+    upload = asyncio.run(manager.create(2, "audio.wav", CHUNK_BYTES))
+    asyncio.run(abort_while_writing(upload.id))
+    asyncio.run(manager.finalize(upload.id, str(tmp_path / "audio.wav")))
+    with pytest.raises(UploadConflictError):
+        asyncio.run(manager.abort(upload.id))
+    assert os.path.exists(tmp_path / "audio.wav")
+
+    upload = asyncio.run(manager.create(2, "audio.wav", len(AUDIO)))
+    asyncio.run(manager.abort(upload.id))
+    assert not os.path.exists(tmp_path / f"{upload.id}.upload.part")
+    assert manager.stats()["aborted"] == 1
+
+
+def test_abandoned_uploads_are_expired(tmp_path):
+    manager = AudioUploadManager(UploadStore(str(tmp_path / "uploads.sqlite3")), str(tmp_path),
+                                 max_chunk_bytes=CHUNK_BYTES, upload_ttl_seconds=0.1, sweep_interval_seconds=60)
+    abandoned = asyncio.run(manager.create(2, "audio.wav", len(AUDIO)))
+    asyncio.run(manager.write_chunk(abandoned.id, 0, AUDIO[:CHUNK_BYTES]))
+    finalized = asyncio.run(manager.create(3, "audio.wav", CHUNK_BYTES))
+    asyncio.run(manager.write_chunk(finalized.id, 0, AUDIO[:CHUNK_BYTES]))
+    asyncio.run(manager.finalize(finalized.id, str(tmp_path / "audio.wav")))
+    time.sleep(0.15)
+    fresh = asyncio.run(manager.create(4, "audio.wav", len(AUDIO)))
+    # the last sweep is less than the sweep interval ago
+    assert asyncio.run(manager.expire_due()) == []
+
+    assert [upload.id for upload in asyncio.run(manager.expire())] == [abandoned.id]
+    assert not os.path.exists(tmp_path / f"{abandoned.id}.upload.part")
+    assert os.path.exists(tmp_path / f"{fresh.id}.upload.part")
+    assert manager.get(finalized.id).status == UploadStatus.FINALIZED
+    with pytest.raises(UploadNotFoundError):
+        manager.get(abandoned.id)
+    assert manager.stats()["expired"] == 1
+
+
+def test_resumable_upload_endpoints(monkeypatch, manager: AudioUploadManager, tmp_path):
+    monkeypatch.setattr(recording_module, "UPLOAD_DIRECTORY", str(tmp_path))
+    repo = RecordingRepo()
+    patches = []
+    monkeypatch.setattr(repo, "get_recording", lambda recording_id: Recording(id=recording_id, session_id=1))
+    monkeypatch.setattr(repo, "patch_recording_attributes",
+                        lambda recording_id, **attributes: patches.append(attributes) or
+                        Recording(id=recording_id, session_id=1, **attributes))
+    monkeypatch.setattr(sessions, "recording_repo", repo)
+    monkeypatch.setattr(sessions, "audio_uploads", manager)
+    client = TestClient(app)
+
+    upload_id = client.post("/recording/2/audio/uploads",
+                            json={"filename": "audio.wav", "total_size": len(AUDIO)}).json()["id"]
+    url = f"/recording/2/audio/uploads/{upload_id}"
+    for offset, chunk in _chunks(AUDIO)[1:]:
+        response = client.patch(url, content=chunk, headers={
+            "Upload-Offset": str(offset), "Upload-Checksum": f"sha256 {hashlib.sha256(chunk).hexdigest()}"})
+        assert response.status_code == 200
+    assert client.get(url).json()["missing_ranges"] == [[0, CHUNK_BYTES]]
+    assert client.post(f"{url}/finalize").status_code == 409
+    assert client.patch(url, content=AUDIO[:CHUNK_BYTES], headers={"Upload-Offset": "0"}).status_code == 200
+    assert client.get(f"/recording/3/audio/uploads/{upload_id}").status_code == 404
+    # a streamed body without Content-Length is cut off at the chunk limit
+    assert client.patch(url, content=iter([AUDIO[:CHUNK_BYTES], AUDIO[:CHUNK_BYTES]]),
+                        headers={"Upload-Offset": "0"}).status_code == 413
+    assert client.patch(url, content=AUDIO[:CHUNK_BYTES],
+                        headers={"Upload-Offset": "0", "Content-Length": "1kB"}).status_code == 400
+
+    recording = client.post(f"{url}/finalize", json={"sha256": hashlib.sha256(AUDIO).hexdigest()}).json()
+    assert recording["status"] == RecordingStatus.AUDIO_SAVED
+    assert recording["audio_file_path"] == os.path.join(str(tmp_path), "1_2_audio.wav")
+    with open(recording["audio_file_path"], "rb") as saved:
+        assert saved.read() == AUDIO
+    assert [attributes["status"] for attributes in patches] == [RecordingStatus.SAVING_AUDIO,
+                                                                RecordingStatus.AUDIO_SAVED]
+    assert client.patch(url, content=AUDIO[:CHUNK_BYTES], headers={"Upload-Offset": "0"}).status_code == 409
+    assert client.delete(url).status_code == 409
+    assert len(patches) == 2
@@ -0,0 +1,129 @@
+import asyncio
+import os
+from typing import Dict
+
+import pytest
+
+from app.controllers.evaluation_jobs import EvaluationJobQueue, JobStore, JobStatus
+from app.models.pydantic.sessions import Recording, RecordingType, RecordingStatus
+from services.evaluators import SummaryEvaluator, SummaryChainWrapper
+from static.summary_example_text import afrikaans_OPENAI_summary_good
+from static.summary_metrics import evaluation_metrics
+from tests.services.fakes import FakeEvaluationLLM, registered_document
+
+
+class InMemoryRecordingRepo:
+    def __init__(self, recordings: Dict[int, Recording]):
+        self.recordings = recordings
+
+    def get_recording(self, recording_id: int) -> Recording:
+        return self.recordings[recording_id]
+
+    def patch_recording_attributes(self, recording_id: int, **attributes) -> Recording:
+        for attr, value in attributes.items():
+            setattr(self.recordings[recording_id], attr, value)
+        return self.recordings[recording_id]
+
+
+def _recordings(count: int) -> Dict[int, Recording]:
+    return {recording_id: Recording(id=recording_id, type=RecordingType.COMPREHENSION,
+                                    status=RecordingStatus.PROCESSING_AUDIO, transcript=afrikaans_OPENAI_summary_good)
+            for recording_id in range(count)}
+
+
+def _run(queue: EvaluationJobQueue, *recording_ids: int):
+    async def run():
+        await queue.start()
+        for recording_id in recording_ids:
+            await queue.aenqueue(recording_id)
+        await queue.join()
+        await queue.stop()
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def llm() -> FakeEvaluationLLM:
+    return FakeEvaluationLLM(delay=0.02)
+
+
+def test_jobs_evaluate_recordings_with_bounded_concurrency(llm: FakeEvaluationLLM):
+    repo = InMemoryRecordingRepo(_recordings(6))
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), *registered_document(), max_concurrency=1)
+    evaluated = []
+    queue = EvaluationJobQueue(repo, lambda recording_type: evaluator, JobStore(), concurrency=2,
+                               on_evaluated=lambda recording, evaluation: evaluated.append(recording.id))
+    _run(queue, *repo.recordings)
+    assert all(recording.status == RecordingStatus.AUDIO_PROCESSED for recording in repo.recordings.values())
+    assert sorted(evaluated) == sorted(repo.recordings)
+    assert all(len(recording.evaluation.evaluations) == len(evaluation_metrics)
+               for recording in repo.recordings.values())
+    assert llm.max_in_flight == 2
+    stats = queue.stats()
+    assert (stats["succeeded"], stats["queue_depth"], stats["run_seconds"]["count"]) == (6, 0, 6)
+
+
+def test_failed_jobs_are_retried_with_backoff(llm: FakeEvaluationLLM):
+    repo = InMemoryRecordingRepo(_recordings(1))
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), *registered_document())
+    attempts = []
+
+    def flaky_provider(recording_type: str):
+        attempts.append(recording_type)
+        if len(attempts) < 3:
+            raise ConnectionError("LLM backend unavailable")
+        return evaluator
+
+    queue = EvaluationJobQueue(repo, flaky_provider, JobStore(), max_attempts=3, retry_base_delay=0.01)
+    _run(queue, 0)
+    assert len(attempts) == 3
+    assert repo.recordings[0].status == RecordingStatus.AUDIO_PROCESSED
+    assert queue.stats()["retried"] == 2
+
+
+def test_recording_is_marked_failed_after_last_attempt(llm: FakeEvaluationLLM):
+    repo = InMemoryRecordingRepo(_recordings(1))
+    llm.failing_metrics = list(evaluation_metrics.keys())
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), *registered_document())
+    store = JobStore()
+    queue = EvaluationJobQueue(repo, lambda recording_type: evaluator, store, max_attempts=2, retry_base_delay=0.01)
+    _run(queue, 0)
+    assert repo.recordings[0].status == RecordingStatus.PROCESSING_FAILED
+    assert store.get(1).status == JobStatus.FAILED
+    assert store.get(1).attempts == 2
+
+
+def test_failure_to_store_the_evaluation_is_retried(llm: FakeEvaluationLLM):
+    repo = InMemoryRecordingRepo(_recordings(1))
+    patch = repo.patch_recording_attributes
+    failed_patches = []
+
+    def flaky_patch(recording_id: int, **attributes) -> Recording:
+        if "evaluation" in attributes and not failed_patches:
+            failed_patches.append(recording_id)
+            raise ConnectionError("database unavailable")
+        return patch(recording_id, **attributes)
+
+    repo.patch_recording_attributes = flaky_patch
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), *registered_document())
+    store = JobStore()
+    queue = EvaluationJobQueue(repo, lambda recording_type: evaluator, store, retry_base_delay=0.01)
+    _run(queue, 0)
+    assert failed_patches == [0]
+    assert repo.recordings[0].status == RecordingStatus.AUDIO_PROCESSED
+    assert (store.get(1).status, store.get(1).attempts) == (JobStatus.SUCCEEDED, 2)
+
+
+def test_unfinished_jobs_survive_a_restart(tmp_path, llm: FakeEvaluationLLM):
+    db_path = os.path.join(tmp_path, "jobs.sqlite3")
+    repo = InMemoryRecordingRepo(_recordings(2))
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), *registered_document())
+    stopped_queue = EvaluationJobQueue(repo, lambda recording_type: evaluator, JobStore(db_path))
+    stopped_queue.enqueue(0)
+    stopped_queue.enqueue(1)
+    assert repo.recordings[0].status == RecordingStatus.PROCESSING_AUDIO
+
+    restarted_queue = EvaluationJobQueue(repo, lambda recording_type: evaluator, JobStore(db_path))
+    _run(restarted_queue)
+    assert all(recording.status == RecordingStatus.AUDIO_PROCESSED for recording in repo.recordings.values())
+    assert JobStore(db_path).unfinished() == []
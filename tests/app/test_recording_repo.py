@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+
+from app.models.pydantic.sessions import Recording, RecordingStatus
+from app.models.repositories import recording as recording_module
+from app.models.repositories.recording import RecordingRepo, AudioFileTooLargeError
+from app.routers import sessions
+from app.routers.main import app
+
+AUDIO = os.urandom(10 * 1024 + 100)
+
+
+class ChunkRecordingUploadFile(UploadFile):
+    """UploadFile recording the sizes it was read with"""
+
+    def __init__(self, data: bytes):
+        super().__init__(file=io.BytesIO(data), filename="../presentation.wav")
+        self.read_sizes = []
+
+    async def read(self, size: int = -1) -> bytes:
+        self.read_sizes.append(size)
+        return await super().read(size)
+
+
+@pytest.fixture(autouse=True)
+def upload_directory(monkeypatch, tmp_path) -> str:
+    monkeypatch.setattr(recording_module, "UPLOAD_DIRECTORY", str(tmp_path))
+    return str(tmp_path)
+
+
+def test_audio_file_is_streamed_in_chunks(upload_directory: str):
+    repo = RecordingRepo(chunk_bytes=1024)
+    file = ChunkRecordingUploadFile(AUDIO)
+    recording = asyncio.run(repo.save_audio_file(file, Recording(id=2, session_id=1)))
+    assert set(file.read_sizes) == {1024}
+    assert recording.audio_file_path == os.path.join(upload_directory, "1_2_presentation.wav")
+    with open(recording.audio_file_path, "rb") as saved:
+        assert saved.read() == AUDIO
+    assert (recording.audio_size, recording.audio_sha256) == (len(AUDIO), hashlib.sha256(AUDIO).hexdigest())
+    assert os.listdir(upload_directory) == ["1_2_presentation.wav"]
+    stats = repo.audio_upload_stats()
+    assert (stats["files"], stats["bytes"]) == (1, len(AUDIO))
+    assert stats["throughput_bytes_per_second"] > 0
+
+
+def test_too_large_audio_file_is_not_saved(upload_directory: str):
+    repo = RecordingRepo(max_audio_bytes=4096, chunk_bytes=1024)
+    with pytest.raises(AudioFileTooLargeError):
+        asyncio.run(repo.save_audio_file(ChunkRecordingUploadFile(AUDIO), Recording(id=2, session_id=1)))
+    assert os.listdir(upload_directory) == []
+    assert repo.audio_upload_stats()["rejected_files"] == 1
+
+
+def test_finish_recording_rejects_too_large_audio(monkeypatch):
+    repo = RecordingRepo(max_audio_bytes=4096, chunk_bytes=1024)
+    statuses = []
+    monkeypatch.setattr(repo, "get_recording", lambda recording_id: Recording(id=recording_id, session_id=1))
+    monkeypatch.setattr(repo, "patch_recording_attributes",
+                        lambda recording_id, **attributes: statuses.append(attributes["status"]))
+    monkeypatch.setattr(sessions, "recording_repo", repo)
+    response = TestClient(app).patch("/recording/2/audio", files={"file": ("audio.wav", AUDIO)})
+    assert response.status_code == 413
+    assert statuses == [RecordingStatus.SAVING_AUDIO, RecordingStatus.NO_AUDIO_SAVED]
@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+
+from app.models.pydantic.sessions import Recording, RecordingStatus, RecordingType, Session
+from app.models.repositories.database import SqliteDatabase
+from app.models.repositories.recording import RecordingRepo, RecordingNotFoundError, serialize_evaluation
+from app.models.repositories.session import SessionRepo, SessionNotFoundError
+from pydantic_models.evaluator import SummaryEvaluations, SummaryEvaluationItem, Errors, ErrorItem
+
+SUMMARY_EVALUATION = SummaryEvaluations(
+    evaluations=[SummaryEvaluationItem(metric="Relevance", score=7, reason="Covers the main points."),
+                 SummaryEvaluationItem(metric="Fluency", score=None, reason=None)],
+    answered_by={"Relevance": "small"})
+
+
+@pytest.fixture
+def database(tmp_path) -> SqliteDatabase:
+    return SqliteDatabase(str(tmp_path / "sessions.sqlite3"), pool_size=4)
+
+
+def test_sessions_and_recordings_are_stored(database: SqliteDatabase):
+    sessions, recordings = SessionRepo(database), RecordingRepo(database=database)
+    session = sessions.create_session(Session(facilitator_id=1, student_id=2, start="2024-05-01T10:00"))
+    recording = recordings.create_recording(Recording(session_id=session.id, type=RecordingType.COMPREHENSION,
+                                                      status=RecordingStatus.NO_AUDIO_SAVED))
+    assert sessions.patch_session_attributes(session.id, end="2024-05-01T11:00").end == "2024-05-01T11:00"
+    patched = recordings.patch_recording_attributes(recording.id, status=RecordingStatus.AUDIO_PROCESSED,
+                                                    evaluation=SUMMARY_EVALUATION)
+    assert patched.evaluation == SUMMARY_EVALUATION
+    # read back through another repository, as after a restart
+    stored = RecordingRepo(database=SqliteDatabase(database._db_path)).get_recording(recording.id)
+    assert (stored.session_id, stored.type, stored.status) == (session.id, RecordingType.COMPREHENSION,
+                                                               RecordingStatus.AUDIO_PROCESSED)
+    assert stored.evaluation == SUMMARY_EVALUATION
+    assert database.read(lambda connection: connection.execute("PRAGMA journal_mode").fetchone()[0]) == "wal"
+
+
+def test_missing_records_and_unknown_attributes(database: SqliteDatabase):
+    recordings = RecordingRepo(database=database)
+    with pytest.raises(RecordingNotFoundError):
+        recordings.get_recording(1)
+    with pytest.raises(SessionNotFoundError):
+        SessionRepo(database).patch_session_attributes(1, end="")
+    recording = recordings.create_recording(Recording(type=RecordingType.PRESENTATION))
+    with pytest.raises(ValueError):
+        recordings.patch_recording_attributes(recording.id, colour="red")
+
+
+def test_evaluation_is_stored_compactly():
+    errors = Errors(error=[ErrorItem(error="buyed", correction="bought")] * 20)
+    evaluation_type, payload = serialize_evaluation(errors)
+    assert evaluation_type == "Errors"
+    assert len(payload) < len(errors.json()) / 5
+
+
+def test_concurrent_patches_are_group_committed(database: SqliteDatabase):
+    recordings = RecordingRepo(database=database)
+    ids = [recordings.create_recording(Recording(session_id=1, type=RecordingType.COMPREHENSION)).id
+           for _ in range(8)]
+    writes = database.stats()["writes"]
+    barrier = threading.Barrier(len(ids))
+
+    def patch(recording_id: int):
+        barrier.wait()
+        for status in (RecordingStatus.SAVING_AUDIO, RecordingStatus.AUDIO_SAVED):
+            recordings.patch_recording_attributes(recording_id, status=status)
+
+    threads = [threading.Thread(target=patch, args=(recording_id,)) for recording_id in ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert {recordings.get_recording(recording_id).status for recording_id in ids} == {RecordingStatus.AUDIO_SAVED}
+    stats = database.stats()
+    assert stats["writes"] - writes == 2 * len(ids)
+    assert stats["mean_batch_size"] > 1
+    plan = database.read(lambda connection: connection.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM recordings WHERE session_id = ?", (1,)).fetchall())
+    assert "recordings_session_id" in str(plan)
+
+
+def test_session_recordings_are_listed_by_keyset(database: SqliteDatabase):
+    recordings = RecordingRepo(database=database)
+    ids = [recordings.create_recording(Recording(session_id=1 + index % 2, type=RecordingType.COMPREHENSION,
+                                                 transcript=f"Transcript {index}")).id for index in range(9)]
+    recordings.patch_recording_attributes(ids[0], evaluation=SUMMARY_EVALUATION)
+    pages, after = [], None
+    while True:
+        page = recordings.list_session_recordings(1, after=after, limit=2)
+        pages.append([recording.id for recording in page.recordings])
+        if page.next_cursor is None:
+            break
+        after = page.next_cursor
+    assert pages == [ids[0:4:2], ids[4:8:2], ids[8:9]]
+    assert recordings.list_session_recordings(1, limit=2).recordings[0].evaluation is None
+
+    projected = recordings.list_session_recordings(1, limit=1, fields=["status", "evaluation"])
+    assert projected.recordings[0].evaluation == SUMMARY_EVALUATION
+    assert (projected.recordings[0].transcript, projected.recordings[0].session_id) == (None, None)
+    assert projected.etag != recordings.list_session_recordings(1, limit=1).etag
+    with pytest.raises(ValueError):
+        recordings.list_session_recordings(1, fields=["colour"])
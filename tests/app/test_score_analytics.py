@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app.controllers.score_analytics import ScoreAnalytics, AnalyticsGroup, stored_evaluations, UNCATEGORIZED
+from app.models.pydantic.sessions import Recording, RecordingType, Session
+from app.models.repositories.database import SqliteDatabase
+from app.models.repositories.recording import RecordingRepo
+from app.models.repositories.session import SessionRepo
+from app.routers import sessions
+from app.routers.main import app
+from pydantic_models.evaluator import SummaryEvaluations, SummaryEvaluationItem, Errors, ErrorItem
+
+METRICS = ["Relevance", "Coherence"]
+
+
+def _summary_evaluation(relevance, coherence) -> SummaryEvaluations:
+    return SummaryEvaluations(evaluations=[SummaryEvaluationItem(metric="Relevance", score=relevance),
+                                           SummaryEvaluationItem(metric="Coherence", score=coherence)])
+
+
+def _errors(*categories) -> Errors:
+    return Errors(error=[ErrorItem(error="goed", correction="went", category=category) for category in categories])
+
+
+def test_scores_are_aggregated_per_student():
+    analytics = ScoreAnalytics(METRICS, rolling_window=2)
+    for recording_id, (relevance, coherence) in enumerate([(4, 6), (6, None), (8, 7), (10, 9)]):
+        analytics.add(recording_id, 1, 7, _summary_evaluation(relevance, coherence))
+    analytics.add(10, 2, 7, _summary_evaluation(2, 3))
+    analytics.add(11, 1, 7, _errors("tense", "tense", None))
+
+    scores = analytics.scores(student_id=1)
+    assert scores["evaluations"] == 5
+    relevance = scores["metrics"]["Relevance"]
+    assert (relevance["count"], relevance["mean"], relevance["min"], relevance["max"]) == (4, 7.0, 4.0, 10.0)
+    assert relevance["percentiles"]["p50"] == 7.0
+    assert relevance["trend"] == 2.0
+    assert relevance["rolling_means"] == [4.0, 5.0, 7.0, 9.0, 10.0]
+    assert scores["metrics"]["Coherence"]["rolling_means"][:2] == [6.0, 6.0]
+    assert scores["error_categories"] == {"tense": 2, UNCATEGORIZED: 1}
+    assert analytics.scores(facilitator_id=7)["metrics"]["Relevance"]["count"] == 5
+    assert analytics.scores(student_id=3)["metrics"]["Relevance"]["mean"] is None
+
+
+def test_materialized_aggregates_match_a_rescan():
+    analytics = ScoreAnalytics(METRICS)
+    rng = np.random.default_rng(0)
+    for recording_id in range(200):
+        analytics.add(recording_id, int(rng.integers(5)), int(rng.integers(2)),
+                      _summary_evaluation(int(rng.integers(11)), int(rng.integers(11))))
+    # re-evaluations replace the previous evaluation of a recording
+    analytics.add(3, 1, 0, _summary_evaluation(0, 0))
+    for group, key in ((AnalyticsGroup.STUDENT, "student_id"), (AnalyticsGroup.CLASS, "facilitator_id")):
+        for group_id, aggregate in analytics.aggregates(group).items():
+            scanned = analytics.scores(**{key: group_id})
+            for metric in METRICS:
+                assert aggregate["metrics"][metric]["count"] == scanned["metrics"][metric]["count"]
+                assert aggregate["metrics"][metric]["mean"] == pytest.approx(scanned["metrics"][metric]["mean"])
+                assert aggregate["metrics"][metric]["std"] == pytest.approx(scanned["metrics"][metric]["std"],
+                                                                            abs=1e-3)
+    assert sum(aggregate["evaluations"] for aggregate in analytics.aggregates(AnalyticsGroup.CLASS).values()) == 200
+    with pytest.raises(ValueError):
+        analytics.aggregates("school")
+
+
+def test_load_does_not_hold_the_lock_and_keeps_newer_evaluations():
+    analytics = ScoreAnalytics(METRICS)
+
+    def stored():
+        yield 1, 1, 7, _summary_evaluation(4, 4)
+        # requests and new evaluations are served while the stored evaluations are scanned
+        assert analytics.scores()["evaluations"] == 0
+        analytics.add(2, 1, 7, _summary_evaluation(10, 10))
+        yield 2, 1, 7, _summary_evaluation(2, 2)
+        yield 3, 2, 7, _errors("tense")
+
+    assert analytics.load(stored()) == 3
+    assert analytics.load(stored()) == 0
+    assert analytics.loaded
+    assert analytics.scores(student_id=1)["metrics"]["Relevance"]["mean"] == 7.0
+    assert analytics.aggregates(AnalyticsGroup.STUDENT)[1]["metrics"]["Relevance"]["mean"] == 7.0
+    assert analytics.scores()["error_categories"] == {"tense": 1}
+
+
+def test_analytics_endpoints_load_stored_evaluations(monkeypatch, tmp_path):
+    database = SqliteDatabase(str(tmp_path / "sessions.sqlite3"))
+    session_repo, recording_repo = SessionRepo(database), RecordingRepo(database=database)
+    session = session_repo.create_session(Session(facilitator_id=7, student_id=1))
+    for evaluation in (_summary_evaluation(5, 6), _summary_evaluation(7, 8), _errors("spelling")):
+        recording = recording_repo.create_recording(Recording(session_id=session.id,
+                                                              type=RecordingType.COMPREHENSION))
+        recording_repo.patch_recording_attributes(recording.id, evaluation=evaluation)
+    assert len(list(stored_evaluations(database, batch_size=2))) == 3
+
+    analytics = ScoreAnalytics(METRICS)
+    monkeypatch.setattr(sessions, "database", database)
+    monkeypatch.setattr(sessions, "session_repo", session_repo)
+    monkeypatch.setattr(sessions, "score_analytics", analytics)
+    client = TestClient(app)
+    scores = client.get("/analytics/scores?student_id=1").json()
+    assert scores["metrics"]["Relevance"]["mean"] == 6.0
+    assert scores["error_categories"] == {"spelling": 1}
+
+    # a new evaluation updates the materialized aggregates without reloading
+    sessions._add_to_analytics(Recording(id=99, session_id=session.id), _summary_evaluation(9, 9))
+    classes = client.get("/analytics/class").json()
+    assert classes["7"]["evaluations"] == 4
+    assert classes["7"]["metrics"]["Relevance"]["mean"] == 7.0
+    assert client.get("/analytics/school").status_code == 404
@@ -0,0 +1,131 @@
+import json
+from typing import List, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.controllers.evaluation_jobs import EvaluationJobQueue, JobStore, JobStatus
+from app.models.pydantic.sessions import Recording, RecordingType, RecordingStatus
+from app.models.repositories.database import SqliteDatabase
+from app.models.repositories.recording import RecordingRepo
+from app.routers import sessions
+from app.routers.main import app
+from pydantic_models.evaluator import Errors, ErrorItem
+from services.evaluators import SummaryEvaluator, MultiMetricSummaryChainWrapper, GrammaticalEvaluator, \
+    GrammaticalErrorsChainWrapper
+from static.summary_example_text import afrikaans_OPENAI_summary_good
+from static.summary_metrics import evaluation_metrics
+from tests.services.fakes import FakeEvaluationLLM, registered_document
+
+
+class FakeFactory:
+    def __init__(self, evaluator):
+        self._evaluator = evaluator
+
+    def __call__(self, recording_type: str, config):
+        return self
+
+    def get_evaluator(self):
+        return self._evaluator
+
+
+def _parse_events(body: str) -> List[Tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+@pytest.fixture
+def client() -> TestClient:
+    return TestClient(app)
+
+
+def _use_recording(monkeypatch, recording: Recording):
+    monkeypatch.setattr(sessions.recording_repo, "get_recording", lambda recording_id: recording)
+
+
+def test_stream_summary_evaluation_events(monkeypatch, client: TestClient):
+    _use_recording(monkeypatch, Recording(id=1, type=RecordingType.COMPREHENSION,
+                                          transcript=afrikaans_OPENAI_summary_good))
+    evaluator = SummaryEvaluator(FakeEvaluationLLM(), MultiMetricSummaryChainWrapper(), *registered_document())
+    monkeypatch.setattr(sessions, "TextEvaluatorFactory", FakeFactory(evaluator))
+    response = client.get("/recording/1/evaluation/stream")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _parse_events(response.text)
+    assert [event for event, _ in events] == ["SummaryEvaluationItem"] * len(evaluation_metrics) + ["end"]
+    assert [data["metric"] for _, data in events[:-1]] == list(evaluation_metrics.keys())
+
+
+def test_stream_grammatical_evaluation_events(monkeypatch, client: TestClient):
+    _use_recording(monkeypatch, Recording(id=1, type=RecordingType.LANGUAGE_PRODUCTION,
+                                          transcript="She buyed apples."))
+    evaluator = GrammaticalEvaluator(FakeEvaluationLLM(grammar_errors={"buyed": "bought"}),
+                                     GrammaticalErrorsChainWrapper())
+    monkeypatch.setattr(sessions, "TextEvaluatorFactory", FakeFactory(evaluator))
+    events = _parse_events(client.get("/recording/1/evaluation/stream").text)
+    assert events == [("ErrorItem", {"error": "buyed", "correction": "bought", "category": "Grammar"}), ("end", {})]
+
+
+def test_stream_evaluation_without_transcript_is_rejected(monkeypatch, client: TestClient):
+    _use_recording(monkeypatch, Recording(id=1, type=RecordingType.COMPREHENSION))
+    assert client.get("/recording/1/evaluation/stream").status_code == 400
+
+
+def test_process_recording_enqueues_evaluation_job(monkeypatch, client: TestClient):
+    recording = Recording(id=1, type=RecordingType.COMPREHENSION, status=RecordingStatus.AUDIO_SAVED)
+    _use_recording(monkeypatch, recording)
+    patched = {}
+    monkeypatch.setattr(sessions.recording_repo, "patch_recording_attributes",
+                        lambda recording_id, **attributes: patched.update(attributes) or recording)
+    store = JobStore()
+    monkeypatch.setattr(sessions, "evaluation_queue", EvaluationJobQueue(sessions.recording_repo, None, store))
+    response = client.post("/recording/1/evaluation")
+    assert response.status_code == 200
+    assert patched == {"status": RecordingStatus.PROCESSING_AUDIO}
+    assert [(job.recording_id, job.status) for job in store.unfinished()] == [(1, JobStatus.QUEUED)]
+
+
+def test_process_recording_requires_saved_audio(monkeypatch, client: TestClient):
+    _use_recording(monkeypatch, Recording(id=1, type=RecordingType.COMPREHENSION,
+                                          status=RecordingStatus.NO_AUDIO_SAVED))
+    assert client.post("/recording/1/evaluation").status_code == 500
+
+
+def test_register_and_get_document(client: TestClient):
+    response = client.post("/document/", json={"text": "  Die bron teks.  "})
+    assert response.status_code == 200
+    registered = response.json()
+    assert registered["text"] is None and registered["token_count"] > 0
+    assert client.post("/document/", json={"text": "Die bron teks."}).json()["id"] == registered["id"]
+    assert client.get(f"/document/{registered['id']}").json()["text"] == "Die bron teks."
+    assert client.get("/document/unknown").status_code == 404
+    assert client.post("/document/", json={"text": " "}).status_code == 400
+
+
+def test_session_recordings_are_paginated_with_etags(monkeypatch, client: TestClient, tmp_path):
+    repo = RecordingRepo(database=SqliteDatabase(str(tmp_path / "sessions.sqlite3")))
+    monkeypatch.setattr(sessions, "recording_repo", repo)
+    ids = [repo.create_recording(Recording(session_id=1, type=RecordingType.COMPREHENSION,
+                                           status=RecordingStatus.NO_AUDIO_SAVED)).id for _ in range(3)]
+
+    response = client.get("/session/1/recording/?limit=2&fields=status")
+    assert response.json() == [{"id": ids[0], "status": RecordingStatus.NO_AUDIO_SAVED},
+                               {"id": ids[1], "status": RecordingStatus.NO_AUDIO_SAVED}]
+    assert response.headers["link"] == \
+        f'<http://testserver/session/1/recording/?limit=2&fields=status&after={ids[1]}>; rel="next"'
+    etag = response.headers["etag"]
+    assert client.get("/session/1/recording/?limit=2&fields=status", headers={"If-None-Match": etag}).status_code == 304
+
+    repo.patch_recording_attributes(ids[1], status=RecordingStatus.AUDIO_SAVED,
+                                    evaluation=Errors(error=[ErrorItem(error="buyed", correction="bought")]))
+    response = client.get("/session/1/recording/?limit=2&fields=status", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["etag"] != etag
+    last_page = client.get(f"/session/1/recording/?after={ids[1]}&fields=evaluation,status")
+    assert "link" not in last_page.headers
+    assert last_page.json() == [{"id": ids[2], "status": RecordingStatus.NO_AUDIO_SAVED, "evaluation": None}]
+    evaluated = client.get(f"/session/1/recording/?after={ids[0]}&limit=1&fields=evaluation").json()
+    assert evaluated[0]["evaluation"]["error"][0]["correction"] == "bought"
+    assert client.get("/session/1/recording/?fields=colour").status_code == 400
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from typing import Any, List, Optional, Dict, AsyncIterator, Tuple
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+from services.documents import DocumentRegistry
+from static.summary_example_text import afrikaans_OPENAI_doc
+
+METRIC_NAME_PATTERN = re.compile(r"Metric Name:\s*(\w+)")
+NUMBERED_SENTENCE_PATTERN = re.compile(r"^\[(\d+)\] (.*)$", re.MULTILINE)
+
+
+class FakeEvaluationLLM(LLM):
+    """
+    Offline stand-in for the evaluation LLMs. Answers summary prompts with a SummaryEvaluationItem JSON for the metric
+    named in the prompt (or a list of them when several metrics are named) and digest prompts with a DocumentDigest
+    JSON. Grammar prompts are answered with the
+    grammar_errors found in the sentence (or in each numbered sentence). Records the prompts it received.
+    """
+    delay: float = 0.0
+    score: int = 7
+    scores_by_marker: Dict[str, int] = {}  # score of prompts containing the marker, instead of score
+    failing_metrics: List[str] = []
+    grammar_errors: Dict[str, str] = {}
+    stream_chunk_size: int = 8
+    prompts: List[str] = []
+    in_flight: int = 0
+    max_in_flight: int = 0
+    _lock = threading.Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-evaluation"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        self._enter(prompt)
+        try:
+            time.sleep(self.delay)
+            return self._respond(prompt)
+        finally:
+            self._exit()
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None,
+                     **kwargs: Any) -> str:
+        self._enter(prompt)
+        try:
+            await asyncio.sleep(self.delay)
+            return self._respond(prompt)
+        finally:
+            self._exit()
+
+    async def _astream(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None,
+                       **kwargs: Any) -> AsyncIterator[GenerationChunk]:
+        self._enter(prompt)
+        try:
+            response = self._respond(prompt)
+            for start in range(0, len(response), self.stream_chunk_size):
+                await asyncio.sleep(self.delay / 10)
+                yield GenerationChunk(text=response[start:start + self.stream_chunk_size])
+        finally:
+            self._exit()
+
+    def _respond(self, prompt: str) -> str:
+        metrics = METRIC_NAME_PATTERN.findall(prompt)
+        if not metrics and "key_points" in prompt:
+            return json.dumps({"main_topic": "Die artikel", "key_points": ["Eerste punt.", "Tweede punt."]})
+        if not metrics:
+            return self._respond_grammar(prompt)
+        for metric in metrics:
+            if metric in self.failing_metrics:
+                raise RuntimeError(f"LLM failure for {metric}")
+        score = next((score for marker, score in self.scores_by_marker.items() if marker in prompt), self.score)
+        items = [{"metric": metric, "score": score, "reason": f"{metric} looks fine"} for metric in metrics]
+        if len(items) == 1:
+            return json.dumps(items[0])
+        return json.dumps({"evaluations": items})
+
+    def _respond_grammar(self, prompt: str) -> str:
+        numbered_sentences = NUMBERED_SENTENCE_PATTERN.findall(prompt)
+        if not numbered_sentences:
+            sentence = prompt.strip().splitlines()[-1]
+            return json.dumps({"error": [{"error": error, "correction": correction, "category": "Grammar"}
+                                         for error, correction in self.grammar_errors.items() if error in sentence]})
+        return json.dumps({"error": [{"error": error, "correction": correction, "category": "Grammar",
+                                      "sentence_index": int(index)}
+                                     for index, sentence in numbered_sentences
+                                     for error, correction in self.grammar_errors.items() if error in sentence]})
+
+    def _enter(self, prompt: str):
+        with self._lock:
+            self.prompts.append(prompt)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+def registered_document(text: str = afrikaans_OPENAI_doc) -> Tuple[DocumentRegistry, str]:
+    """Returns an in-memory document registry with the document registered, and the id of the document"""
+    documents = DocumentRegistry()
+    return documents, documents.register(text).id
@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+
+
+class OllamaStubServer:
+    """
+    Local stand-in for an Ollama server answering /api/generate with a streamed response and /api/tags as health
+    check. Records the client address of every request, which shows whether connections are kept alive and reused.
+    Answers every request with 503 while healthy is False.
+    """
+
+    def __init__(self, response: str = '{"error": []}', delay: float = 0.0):
+        self.response = response
+        self.delay = delay
+        self.healthy = True
+        self.client_addresses: List[Tuple[str, int]] = []
+        self.request_bodies: List[dict] = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._send(200 if stub.healthy else 503, b'{"models": []}')
+
+            def do_POST(self):
+                stub.client_addresses.append(self.client_address)
+                stub.request_bodies.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+                if not stub.healthy:
+                    self._send(503, b'{"error": "unavailable"}')
+                    return
+                time.sleep(stub.delay)
+                lines = [json.dumps({"response": stub.response, "done": False}),
+                         json.dumps({"response": "", "done": True})]
+                self._send(200, ("\n".join(lines) + "\n").encode("utf-8"))
+
+            def _send(self, status: int, body: bytes):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def __enter__(self) -> "OllamaStubServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,94 @@
+import asyncio
+
+from pydantic_models.evaluator import PositionedErrorItem
+from services.cascade import ModelEscalation, BORDERLINE_SCORE, METRIC_DISAGREEMENT, PARSE_FAILURE, \
+    UNCHANGED_CORRECTION
+from services.evaluators import SummaryEvaluator, SummaryChainWrapper, GrammaticalEvaluator, \
+    GrammaticalErrorsChainWrapper, BatchGrammaticalErrorsChainWrapper
+from static.summary_example_text import afrikaans_OPENAI_summary_good
+from static.summary_metrics import evaluation_metrics, CONSISTENCY
+from tests.services.fakes import FakeEvaluationLLM, registered_document
+
+ESCALATION_SETUP = "EXPENSIVE"
+
+
+def summary_cascade(cheap_llm: FakeEvaluationLLM, expensive_llm: FakeEvaluationLLM) -> SummaryEvaluator:
+    documents, document_id = registered_document()
+    evaluator = SummaryEvaluator(cheap_llm, SummaryChainWrapper(), documents, document_id)
+    evaluator.set_escalation(ModelEscalation(SummaryEvaluator(expensive_llm, SummaryChainWrapper(), documents,
+                                                              document_id), ESCALATION_SETUP))
+    return evaluator
+
+
+def grammar_cascade(cheap_llm: FakeEvaluationLLM, expensive_llm: FakeEvaluationLLM) -> GrammaticalEvaluator:
+    evaluator = GrammaticalEvaluator(cheap_llm, GrammaticalErrorsChainWrapper(), BatchGrammaticalErrorsChainWrapper())
+    evaluator.set_escalation(ModelEscalation(GrammaticalEvaluator(
+        expensive_llm, GrammaticalErrorsChainWrapper(), BatchGrammaticalErrorsChainWrapper()), ESCALATION_SETUP))
+    return evaluator
+
+
+def test_confident_summary_evaluation_is_not_escalated():
+    cheap_llm, expensive_llm = FakeEvaluationLLM(score=8), FakeEvaluationLLM(score=9)
+    evaluator = summary_cascade(cheap_llm, expensive_llm)
+    evaluation = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert {item.score for item in evaluation.evaluations} == {8}
+    assert evaluation.escalation_reasons == []
+    assert expensive_llm.prompts == []
+    assert evaluator.escalation_stats()["escalation_rate"] == 0
+
+
+def test_borderline_summary_evaluation_is_escalated():
+    cheap_llm, expensive_llm = FakeEvaluationLLM(score=5), FakeEvaluationLLM(score=9)
+    evaluator = summary_cascade(cheap_llm, expensive_llm)
+    evaluation = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert {item.score for item in evaluation.evaluations} == {9}
+    assert evaluation.escalation_reasons == [BORDERLINE_SCORE]
+    assert evaluation.answered_by == {eval_type: ESCALATION_SETUP for eval_type in evaluation_metrics}
+    stats = evaluator.escalation_stats()
+    assert stats["escalations"] == 1 and stats["escalation_rate"] == 1
+    assert stats["reasons"] == {BORDERLINE_SCORE: 1}
+
+
+def test_disagreeing_and_failed_metrics_are_escalated_async():
+    cheap_llm = FakeEvaluationLLM(score=9, scores_by_marker={CONSISTENCY: 1})
+    evaluator = summary_cascade(cheap_llm, FakeEvaluationLLM(score=9))
+    evaluation = asyncio.run(evaluator.aevaluate(afrikaans_OPENAI_summary_good))
+    assert evaluation.escalation_reasons == [METRIC_DISAGREEMENT]
+    assert {item.score for item in evaluation.evaluations} == {9}
+
+    evaluator = summary_cascade(FakeEvaluationLLM(score=9, failing_metrics=[CONSISTENCY]), FakeEvaluationLLM(score=9))
+    assert asyncio.run(evaluator.aevaluate(afrikaans_OPENAI_summary_good)).escalation_reasons == [PARSE_FAILURE]
+
+
+def test_metrics_the_escalation_cannot_score_keep_first_evaluation():
+    expensive_llm = FakeEvaluationLLM(score=9, failing_metrics=[CONSISTENCY])
+    evaluator = summary_cascade(FakeEvaluationLLM(score=5), expensive_llm)
+    evaluation = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert {item.metric: item.score for item in evaluation.evaluations} == {
+        eval_type: 5 if eval_type == CONSISTENCY else 9 for eval_type in evaluation_metrics}
+    assert CONSISTENCY not in evaluation.answered_by
+
+
+def test_only_doubtful_sentences_are_escalated():
+    cheap_llm = FakeEvaluationLLM(grammar_errors={"buyed": "buyed", "are green": "is green"})
+    expensive_llm = FakeEvaluationLLM(grammar_errors={"buyed": "bought"})
+    evaluator = grammar_cascade(cheap_llm, expensive_llm)
+    errors_per_text = evaluator.evaluate_many(["The grass are green.", "It is sunny.", "She buyed apples."])
+    assert [[item.correction for item in errors.error] for errors in errors_per_text] == [["is green"], [],
+                                                                                         ["bought"]]
+    assert all(item.sentence_index == 2 for item in errors_per_text[2].error
+               if isinstance(item, PositionedErrorItem))
+    assert len(expensive_llm.prompts) == 1 and "She buyed apples." in expensive_llm.prompts[0]
+    stats = evaluator.escalation_stats()
+    assert stats["evaluations"] == 3 and stats["escalations"] == 1
+    assert stats["reasons"] == {UNCHANGED_CORRECTION: 1}
+
+
+def test_streamed_grammar_evaluation_is_escalated():
+    evaluator = grammar_cascade(FakeEvaluationLLM(grammar_errors={"buyed": "buyed"}),
+                                FakeEvaluationLLM(grammar_errors={"buyed": "bought"}))
+
+    async def collect():
+        return [item async for item in evaluator.astream_evaluate("She buyed apples.")]
+
+    assert [item.correction for item in asyncio.run(collect())] == ["bought"]
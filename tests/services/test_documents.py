@@ -0,0 +1,144 @@
+import asyncio
+import os
+
+import pytest
+
+from services.documents import DocumentRegistry
+from services.evaluators import SummaryEvaluator, SummaryChainWrapper, MultiMetricSummaryChainWrapper, \
+    DocumentDigestChainWrapper, CHUNKED_METRICS
+from static.summary_example_text import afrikaans_OPENAI_doc, afrikaans_OPENAI_summary_good
+from static.summary_metrics import evaluation_metrics, CONSISTENCY
+from tests.services.fakes import FakeEvaluationLLM, METRIC_NAME_PATTERN, registered_document
+from tests.services.test_summary_evaluator import long_document
+
+
+def test_documents_are_stored_once_by_content(tmp_path):
+    db_path = os.path.join(tmp_path, "documents.sqlite3")
+    documents = DocumentRegistry(db_path)
+    document = documents.register(afrikaans_OPENAI_doc)
+    assert documents.register(afrikaans_OPENAI_doc + "\n").id == document.id
+    assert document.token_count > 0
+    assert DocumentRegistry(db_path).get(document.id).text == afrikaans_OPENAI_doc.strip()
+    assert documents.stats()["documents"] == 1
+
+
+def test_recently_used_documents_are_kept_in_memory(tmp_path):
+    documents = DocumentRegistry(os.path.join(tmp_path, "documents.sqlite3"), memory_max_documents=1)
+    document = documents.register(afrikaans_OPENAI_doc)
+    assert documents.get(document.id) is document
+    other = documents.register(afrikaans_OPENAI_summary_good)
+    assert documents.get(other.id) is other
+    # evicted from memory, read back from the database
+    assert documents.get(document.id) is not document
+    assert documents.get(document.id).text == document.text
+    digested = documents.digest(documents.get(document.id), lambda text: "Kort.")
+    assert (digested, documents.get(document.id).digest, document.digest) == ("Kort.", "Kort.", None)
+
+
+def test_summaries_are_evaluated_against_digest_extracted_once():
+    llm = FakeEvaluationLLM()
+    documents = DocumentRegistry()
+    document_id = documents.register(afrikaans_OPENAI_doc).id
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), documents, max_concurrency=4,
+                                 digest_chain_comps=DocumentDigestChainWrapper())
+    for _ in range(2):
+        evaluation = evaluator.evaluate(afrikaans_OPENAI_summary_good, document_id)
+        assert [item.score for item in evaluation.evaluations] == [7] * len(evaluation_metrics)
+    asyncio.run(evaluator.aevaluate(afrikaans_OPENAI_summary_good, document_id))
+    digest_prompts = [prompt for prompt in llm.prompts if "key_points" in prompt and "Metric Name" not in prompt]
+    metric_prompts = [prompt for prompt in llm.prompts if "Metric Name" in prompt]
+    assert len(digest_prompts) == 1
+    for prompt in metric_prompts:
+        # consistency is checked against the facts of the document itself, not their paraphrase in the digest
+        if METRIC_NAME_PATTERN.findall(prompt) == [CONSISTENCY]:
+            assert afrikaans_OPENAI_doc.strip() in prompt and "Eerste punt." not in prompt
+        else:
+            assert "Eerste punt." in prompt and afrikaans_OPENAI_doc.strip() not in prompt
+    assert documents.get(document_id).digest_token_count < documents.get(document_id).token_count
+
+
+def test_multi_metric_summaries_are_evaluated_against_full_document():
+    llm = FakeEvaluationLLM()
+    documents, document_id = registered_document()
+    evaluator = SummaryEvaluator(llm, MultiMetricSummaryChainWrapper(), documents, document_id,
+                                 digest_chain_comps=DocumentDigestChainWrapper())
+    evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert len(llm.prompts) == 1
+    assert afrikaans_OPENAI_doc.strip() in llm.prompts[0]
+    assert documents.get(document_id).digest is None
+
+
+def test_digest_of_long_document_is_extracted_per_excerpt():
+    llm = FakeEvaluationLLM()
+    documents = DocumentRegistry()
+    document_id = documents.register(long_document()).id
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), documents, document_id,
+                                 digest_chain_comps=DocumentDigestChainWrapper(), long_document_tokens=100,
+                                 chunk_tokens=100, chunk_overlap_tokens=10)
+    evaluation = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert all(item.score == llm.score for item in evaluation.evaluations)
+    digest_prompts = [prompt for prompt in llm.prompts if "key_points" in prompt and "Metric Name" not in prompt]
+    assert len(digest_prompts) > 2
+    assert documents.get(document_id).digest.count("Eerste punt.") == 1
+    for prompt in llm.prompts:
+        metrics = METRIC_NAME_PATTERN.findall(prompt)
+        if metrics and metrics[0] in CHUNKED_METRICS:
+            assert "Excerpt" in prompt and "Eerste punt." not in prompt
+        elif metrics:
+            assert "Excerpt" not in prompt and "Eerste punt." in prompt
+
+
+def test_short_documents_are_sent_in_full():
+    llm = FakeEvaluationLLM()
+    documents = DocumentRegistry(digest_min_tokens=10 ** 6)
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), documents, documents.register(afrikaans_OPENAI_doc).id,
+                                 digest_chain_comps=DocumentDigestChainWrapper())
+    evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert len(llm.prompts) == len(evaluation_metrics)
+    assert all(afrikaans_OPENAI_doc.strip() in prompt for prompt in llm.prompts)
+
+
+def test_failed_digest_extraction_falls_back_to_full_document():
+    documents = DocumentRegistry()
+    document_id = documents.register(afrikaans_OPENAI_doc).id
+
+    def fail(document: str) -> str:
+        raise RuntimeError("LLM failure")
+
+    assert documents.digest(documents.get(document_id), fail) is None
+    assert documents.get(document_id).digest is None
+    assert documents.stats()["failed_digests"] == 1
+
+
+def test_failed_digest_extraction_is_retried_after_backoff(monkeypatch):
+    documents = DocumentRegistry(digest_retry_seconds=10, digest_max_retry_seconds=15)
+    document_id = documents.register(afrikaans_OPENAI_doc).id
+    attempts = []
+    now = [1000.0]
+    monkeypatch.setattr("services.documents.time.time", lambda: now[0])
+
+    def fail(document: str) -> str:
+        attempts.append(document)
+        raise RuntimeError("LLM failure")
+
+    for _ in range(3):
+        documents.digest(documents.get(document_id), fail)
+    assert len(attempts) == 1
+    now[0] += 10
+    documents.digest(documents.get(document_id), fail)
+    assert len(attempts) == 2
+    # the backoff doubles with every consecutive failure, up to the longest wait
+    now[0] += 10
+    documents.digest(documents.get(document_id), fail)
+    assert len(attempts) == 2
+    now[0] += 5
+    assert documents.digest(documents.get(document_id), lambda document: "Kort.") == "Kort."
+    assert documents.stats()["failed_digests"] == 0
+
+
+def test_unknown_document_is_rejected():
+    evaluator = SummaryEvaluator(FakeEvaluationLLM(), SummaryChainWrapper(), DocumentRegistry())
+    with pytest.raises(ValueError):
+        evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    with pytest.raises(KeyError):
+        evaluator.evaluate(afrikaans_OPENAI_summary_good, "unknown")
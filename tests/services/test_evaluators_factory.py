@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from app.models.pydantic.sessions import RecordingType
+from configs.configurator import Config, LlmConfigOptions
+from services.evaluators import SummaryChainWrapper, GrammaticalErrorsChainWrapper
+from services.evaluators_factory import TextEvaluatorFactory, clear_evaluator_registry
+from tests.services.fakes import FakeEvaluationLLM
+
+CONFIG_FILE_PATH = os.path.join(os.getcwd(), "configs", "config.yaml")
+
+
+@pytest.fixture
+def config(monkeypatch) -> Config:
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    clear_evaluator_registry()
+    yield Config(CONFIG_FILE_PATH, LlmConfigOptions.ONLINE_OPENAI_GPT3)
+    clear_evaluator_registry()
+
+
+@pytest.mark.parametrize("recording_type", [RecordingType.COMPREHENSION, RecordingType.LANGUAGE_PRODUCTION])
+def test_get_evaluator_reuses_prebuilt_evaluator(config: Config, recording_type: str):
+    evaluator = TextEvaluatorFactory(recording_type, config).get_evaluator()
+    assert evaluator is not None
+    assert TextEvaluatorFactory(recording_type, config).get_evaluator() is evaluator
+
+
+def test_get_evaluator_is_keyed_by_recording_type(config: Config):
+    summary_evaluator = TextEvaluatorFactory(RecordingType.COMPREHENSION, config).get_evaluator()
+    grammatical_evaluator = TextEvaluatorFactory(RecordingType.LANGUAGE_PRODUCTION, config).get_evaluator()
+    assert summary_evaluator is not grammatical_evaluator
+
+
+def test_build_evaluator_bypasses_registry(config: Config):
+    factory = TextEvaluatorFactory(RecordingType.COMPREHENSION, config)
+    assert factory.build_evaluator() is not factory.get_evaluator()
+
+
+@pytest.mark.parametrize("chain_comps_class", [SummaryChainWrapper, GrammaticalErrorsChainWrapper])
+def test_chain_is_compiled_once_per_llm(chain_comps_class):
+    chain_comps = chain_comps_class()
+    llm, other_llm = FakeEvaluationLLM(), FakeEvaluationLLM()
+    chain = chain_comps._get_chain(llm)
+    assert chain_comps._get_chain(llm) is chain
+    assert chain_comps._get_chain(other_llm) is not chain
+
+
+def test_model_cascade_starts_with_first_setup(config: Config, monkeypatch):
+    monkeypatch.setattr(config, "get_model_cascade_params",
+                        lambda: {"ENABLED": True, "FIRST_SETUP": LlmConfigOptions.LOCAL_OLLAMA_LLAMA3})
+    evaluator = TextEvaluatorFactory(RecordingType.COMPREHENSION, config).build_evaluator()
+    assert evaluator.escalation_stats()["escalation_setup"] == LlmConfigOptions.ONLINE_OPENAI_GPT3
+    assert evaluator._llm is not evaluator._escalation.evaluator._llm
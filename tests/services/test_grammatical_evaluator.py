@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from pydantic_models.evaluator import PositionedErrorItem
+from services.evaluators import GrammaticalEvaluator, GrammaticalErrorsChainWrapper, \
+    BatchGrammaticalErrorsChainWrapper
+from services.segmentation import split_sentences, pack_batches, chunk_text
+from services.sentence_store import SentenceErrorsStore
+from tests.services.fakes import FakeEvaluationLLM
+
+GRAMMAR_ERRORS = {"buyed": "bought", "are green": "is green"}
+TRANSCRIPT = "She buyed apples.  The grass are green!\nIt is sunny. She buyed pears."
+
+
+@pytest.fixture
+def llm() -> FakeEvaluationLLM:
+    return FakeEvaluationLLM(grammar_errors=GRAMMAR_ERRORS)
+
+
+def test_split_sentences_keeps_offsets():
+    sentences = split_sentences(TRANSCRIPT)
+    assert [sentence.text for sentence in sentences] == ["She buyed apples.", "The grass are green!",
+                                                         "It is sunny.", "She buyed pears."]
+    assert all(TRANSCRIPT[sentence.start:sentence.end] == sentence.text for sentence in sentences)
+
+
+def test_pack_batches_respects_token_budget():
+    batches = pack_batches(["a" * 8, "b" * 8, "c" * 8, "d" * 40], max_batch_tokens=5, token_counter=len)
+    assert batches == [[0], [1], [2], [3]]
+    batches = pack_batches(["a" * 8, "b" * 8, "c" * 8, "d" * 40], max_batch_tokens=16, token_counter=len)
+    assert batches == [[0, 1], [2], [3]]
+
+
+def test_chunk_text_overlaps_whole_sentences():
+    text = " ".join(f"Sentence number {index} is here." for index in range(10))
+    chunks = chunk_text(text, max_chunk_tokens=20, overlap_tokens=8, token_counter=lambda sentence: 6)
+    assert [chunk.count("Sentence") for chunk in chunks] == [3, 3, 3, 3, 2]
+    assert chunks[0].endswith("number 2 is here.") and chunks[1].startswith("Sentence number 2")
+    assert chunks[-1].endswith("number 9 is here.")
+    assert chunk_text(text, max_chunk_tokens=1000) == [text]
+
+
+def test_evaluate_many_maps_batch_errors_back_to_texts(llm: FakeEvaluationLLM):
+    evaluator = GrammaticalEvaluator(llm, GrammaticalErrorsChainWrapper(), BatchGrammaticalErrorsChainWrapper())
+    texts = ["She buyed apples.", "It is sunny.", "The grass are green."]
+    errors_per_text = evaluator.evaluate_many(texts)
+    assert len(llm.prompts) == 1
+    assert [[item.error for item in errors.error] for errors in errors_per_text] == [["buyed"], [], ["are green"]]
+    item: PositionedErrorItem = errors_per_text[2].error[0]
+    assert item.sentence_index == 2
+    assert texts[2][item.start:item.end] == "are green"
+
+
+def test_evaluate_many_splits_into_token_bounded_batches(llm: FakeEvaluationLLM):
+    evaluator = GrammaticalEvaluator(llm, GrammaticalErrorsChainWrapper(), BatchGrammaticalErrorsChainWrapper(),
+                                     max_batch_tokens=5)
+    errors_per_text = evaluator.evaluate_many(["She buyed apples.", "It is sunny.", "She buyed pears."])
+    assert len(llm.prompts) == 3
+    assert [item.sentence_index for errors in errors_per_text for item in errors.error] == [0, 2]
+
+
+def test_evaluate_many_without_batch_chain_evaluates_texts_one_by_one(llm: FakeEvaluationLLM):
+    evaluator = GrammaticalEvaluator(llm, GrammaticalErrorsChainWrapper())
+    errors_per_text = evaluator.evaluate_many(["She buyed apples.", "It is sunny."])
+    assert len(llm.prompts) == 2
+    assert [len(errors.error) for errors in errors_per_text] == [1, 0]
+
+
+def test_evaluate_transcript_offsets_are_relative_to_transcript(llm: FakeEvaluationLLM):
+    evaluator = GrammaticalEvaluator(llm, GrammaticalErrorsChainWrapper(), BatchGrammaticalErrorsChainWrapper())
+    errors_per_sentence = evaluator.evaluate_transcript(TRANSCRIPT)
+    assert len(errors_per_sentence) == 4
+    items = [item for errors in errors_per_sentence for item in errors.error]
+    assert [(item.sentence_index, TRANSCRIPT[item.start:item.end]) for item in items] == \
+           [(0, "buyed"), (1, "are green"), (3, "buyed")]
+
+
+def test_incremental_transcript_only_evaluates_changed_sentences(llm: FakeEvaluationLLM):
+    store = SentenceErrorsStore()
+    evaluator = GrammaticalEvaluator(llm, GrammaticalErrorsChainWrapper(), BatchGrammaticalErrorsChainWrapper(),
+                                     sentence_store=store)
+    evaluator.evaluate_transcript(TRANSCRIPT)
+    assert len(llm.prompts) == 1
+    edited = "It rains.  " + TRANSCRIPT.replace("It is sunny.", "It are sunny.")
+    errors_per_sentence = evaluator.evaluate_transcript(edited)
+    assert len(llm.prompts) == 2
+    assert BatchGrammaticalErrorsChainWrapper.number_sentences(["It rains.", "It are sunny."]) in llm.prompts[-1]
+    items = [item for errors in errors_per_sentence for item in errors.error]
+    assert [(item.sentence_index, edited[item.start:item.end]) for item in items] == \
+           [(1, "buyed"), (2, "are green"), (4, "buyed")]
+
+
+def test_incremental_transcript_reuses_errors_of_respaced_sentences(llm: FakeEvaluationLLM):
+    evaluator = GrammaticalEvaluator(llm, GrammaticalErrorsChainWrapper(), BatchGrammaticalErrorsChainWrapper(),
+                                     sentence_store=SentenceErrorsStore())
+    evaluator.evaluate_transcript("The grass are green.")
+    respaced = "It is sunny.  The  grass   are green."
+    errors_per_sentence = evaluator.evaluate_transcript(respaced)
+    assert len(llm.prompts) == 2
+    item = errors_per_sentence[1].error[0]
+    assert respaced[item.start:item.end] == "are green"
+
+
+def test_astream_evaluate_yields_error_items_while_streaming(llm: FakeEvaluationLLM):
+    evaluator = GrammaticalEvaluator(llm, GrammaticalErrorsChainWrapper())
+
+    async def collect():
+        return [(item, llm.in_flight) async for item in evaluator.astream_evaluate("She buyed it, the grass are green")]
+
+    items = asyncio.run(collect())
+    assert [item.error for item, _ in items] == ["buyed", "are green"]
+    # the first item arrives while the LLM is still streaming
+    assert items[0][1] == 1
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from services.incremental_json import IncrementalJsonArrayParser
+
+DOCUMENT = json.dumps({"error": [{"error": "a {b}", "correction": "c \"]\" d"},
+                                 {"error": "e", "correction": "f", "nested": {"list": [1, 2]}}],
+                       "other": [{"ignored": True}]})
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, len(DOCUMENT)])
+def test_objects_of_the_array_are_parsed(chunk_size: int):
+    parser = IncrementalJsonArrayParser("error")
+    parsed = []
+    for start in range(0, len(DOCUMENT), chunk_size):
+        parsed.extend(parser.feed(DOCUMENT[start:start + chunk_size]))
+    assert parsed == json.loads(DOCUMENT)["error"]
+    assert parser.done
+
+
+def test_object_is_returned_before_the_document_is_complete():
+    parser = IncrementalJsonArrayParser("error")
+    first_object_end = DOCUMENT.index('}, {"error": "e"') + 1
+    assert parser.feed(DOCUMENT[:first_object_end - 1]) == []
+    assert parser.feed(DOCUMENT[first_object_end - 1:first_object_end]) == [json.loads(DOCUMENT)["error"][0]]
+    assert not parser.done
+
+
+def test_text_around_the_document_is_ignored():
+    parser = IncrementalJsonArrayParser("evaluations")
+    parsed = parser.feed('Here you go:\n```json\n{"evaluations": [{"metric": "Fluency"}]}\n```')
+    assert parsed == [{"metric": "Fluency"}]
+
+
+def test_unparsable_objects_are_skipped():
+    parser = IncrementalJsonArrayParser("error")
+    assert parser.feed('{"error": [{"error": x}, {"error": "y"}]}') == [{"error": "y"}]
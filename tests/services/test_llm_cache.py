@@ -0,0 +1,109 @@
+import asyncio
+import os
+import time
+
+import pytest
+from langchain_core.language_models.fake import FakeListLLM
+from langchain_core.exceptions import OutputParserException
+
+from services.evaluators import SummaryEvaluator, SummaryChainWrapper, SchemaSummaryChainWrapper, \
+    MultiMetricSummaryChainWrapper, GrammaticalEvaluator, GrammaticalErrorsChainWrapper
+from services.llm_cache import LlmResponseCache, get_llm_response_cache
+from static.summary_example_text import afrikaans_OPENAI_summary_good
+from tests.services.fakes import FakeEvaluationLLM, registered_document
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = LlmResponseCache(memory_max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.stats()["memory_entries"] == 2
+
+
+def test_disk_tier_persists_across_instances(tmp_path):
+    disk_path = os.path.join(tmp_path, "cache.sqlite3")
+    LlmResponseCache(disk_path=disk_path).put("key", "response")
+    cache = LlmResponseCache(disk_path=disk_path)
+    assert cache.get("key") == "response"
+    assert cache.get("key") == "response"
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 0)
+
+
+def test_expired_responses_are_misses(tmp_path):
+    cache = LlmResponseCache(disk_path=os.path.join(tmp_path, "cache.sqlite3"), disk_ttl_seconds=0.05)
+    cache.put("key", "response")
+    time.sleep(0.1)
+    assert cache.get("key") is None
+    assert cache.stats()["disk_entries"] == 0
+
+
+def test_disk_tier_evicts_above_max_bytes(tmp_path):
+    cache = LlmResponseCache(memory_max_entries=1, disk_path=os.path.join(tmp_path, "cache.sqlite3"),
+                             disk_max_bytes=25)
+    for key in ["a", "b", "c"]:
+        cache.put(key, "x" * 10)
+    stats = cache.stats()
+    assert stats["disk_bytes"] <= 25
+    assert stats["evictions"] == 1
+    assert cache.get("a") is None
+    assert cache.get("c") == "x" * 10
+
+
+def test_get_llm_response_cache_is_shared_and_optional():
+    params = {"ENABLED": True, "MEMORY_MAX_ENTRIES": 8}
+    assert get_llm_response_cache(params) is get_llm_response_cache(dict(params))
+    assert get_llm_response_cache({"ENABLED": False}) is None
+    assert get_llm_response_cache({}) is None
+
+
+@pytest.mark.parametrize("chain_comps_class",
+                         [SummaryChainWrapper, SchemaSummaryChainWrapper, MultiMetricSummaryChainWrapper],
+                         ids=["model", "schema", "multi_metric"])
+@pytest.mark.parametrize("use_async", [False, True], ids=["evaluate", "aevaluate"])
+def test_summary_evaluation_is_answered_from_cache(chain_comps_class, use_async: bool):
+    llm = FakeEvaluationLLM()
+    evaluator = SummaryEvaluator(llm, chain_comps_class(LlmResponseCache()), *registered_document())
+    evaluate = (lambda text: asyncio.run(evaluator.aevaluate(text))) if use_async else evaluator.evaluate
+    first = evaluate(afrikaans_OPENAI_summary_good)
+    calls = len(llm.prompts)
+    second = evaluate(afrikaans_OPENAI_summary_good)
+    assert len(llm.prompts) == calls
+    assert second == first
+
+
+def test_grammatical_evaluation_is_answered_from_cache():
+    llm = FakeEvaluationLLM()
+    evaluator = GrammaticalEvaluator(llm, GrammaticalErrorsChainWrapper(LlmResponseCache()))
+    evaluator.evaluate("The grass are green.")
+    evaluator.evaluate("The grass are green.")
+    evaluator.evaluate("The grass is green.")
+    assert len(llm.prompts) == 2
+
+
+def test_unparsable_response_is_not_cached():
+    cache = LlmResponseCache()
+    llm = FakeListLLM(responses=["not json", '{"error": []}'])
+    evaluator = GrammaticalEvaluator(llm, GrammaticalErrorsChainWrapper(cache))
+    with pytest.raises(OutputParserException):
+        evaluator.evaluate("The grass are green.")
+    assert evaluator.evaluate("The grass are green.").error == []
+    assert cache.stats()["stores"] == 1
+
+
+def test_disk_hits_update_access_times_in_batches(tmp_path):
+    disk_path = os.path.join(tmp_path, "cache.sqlite3")
+    cache = LlmResponseCache(memory_max_entries=1, disk_path=disk_path, disk_max_bytes=25,
+                             maintenance_interval_seconds=3600)
+    for key in ["a", "b"]:
+        cache.put(key, "x" * 10)
+    assert cache.get("a") == "x" * 10
+    # the access of "a" is pending, yet the eviction of the put below sees it and evicts "b"
+    cache.put("c", "x" * 10)
+    assert cache.get("b") is None
+    assert cache.get("a") == "x" * 10
+    assert LlmResponseCache(disk_path=disk_path).stats()["disk_bytes"] == 20
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services import llm_clients
+from services.llm_clients import LlmClientRegistry, PooledOllama, HttpPool
+from services.ollama_router import OllamaRouter
+from tests.services.ollama_stub import OllamaStubServer
+
+OPENAI_SETUP = {"MODEL_NAME": "gpt-3.5-turbo-0125", "TEMPERATURE": 0}
+OLLAMA_SETUP = {"MODEL_NAME": "llama3:8b"}
+
+
+@pytest.fixture
+def registry() -> LlmClientRegistry:
+    registry = LlmClientRegistry()
+    yield registry
+    registry.clear()
+
+
+def test_clients_are_created_once_per_setup(monkeypatch, registry: LlmClientRegistry):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    loaded = []
+    monkeypatch.setattr(llm_clients, "load_dotenv", lambda path: loaded.append(path))
+    llm = registry.get_llm("ONLINE_OPENAI_GPT3", OPENAI_SETUP)
+    assert registry.get_llm("ONLINE_OPENAI_GPT3", dict(OPENAI_SETUP)) is llm
+    assert registry.get_llm("ONLINE_OPENAI_GPT3", dict(OPENAI_SETUP, TEMPERATURE=1)) is not llm
+    assert len(loaded) == 1
+
+
+def test_unsupported_setup_raises(registry: LlmClientRegistry):
+    with pytest.raises(NotImplementedError):
+        registry.get_llm("UNKNOWN_SETUP", {})
+
+
+def test_ollama_requests_reuse_keep_alive_connections():
+    with OllamaStubServer() as server:
+        llm = PooledOllama(model="llama3:8b", base_url=server.base_url, http_pool=HttpPool())
+        assert [llm.invoke("prompt") for _ in range(3)] == ['{"error": []}'] * 3
+        assert len(server.client_addresses) == 3
+        assert len(set(server.client_addresses)) == 1
+        assert server.request_bodies[0]["prompt"] == "prompt"
+
+
+def test_ollama_async_requests_reuse_keep_alive_connections():
+    with OllamaStubServer() as server:
+        pool = HttpPool()
+        llm = PooledOllama(model="llama3:8b", base_url=server.base_url, http_pool=pool)
+
+        async def invoke_sequentially():
+            responses = [await llm.ainvoke("prompt") for _ in range(3)]
+            await pool.aclose()
+            return responses
+
+        assert asyncio.run(invoke_sequentially()) == ['{"error": []}'] * 3
+        assert len(set(server.client_addresses)) == 1
+
+
+def test_ollama_clients_of_a_setup_share_their_pool(registry: LlmClientRegistry):
+    with OllamaStubServer() as server:
+        setup = {"MODEL_NAME": "llama3:8b", "OLLAMA_HOST": "127.0.0.1",
+                 "OLLAMA_PORT": int(server.base_url.rsplit(":", 1)[1])}
+        llm = registry.get_llm("LOCAL_DOCKER_OLLAMA_LLAMA3", setup, {"MAX_CONNECTIONS": 4})
+        assert isinstance(llm, PooledOllama)
+        assert llm.http_pool.max_connections == 4
+        llm.invoke("prompt")
+        registry.get_llm("LOCAL_DOCKER_OLLAMA_LLAMA3", dict(setup), {"MAX_CONNECTIONS": 4}).invoke("prompt")
+        assert len(set(server.client_addresses)) == 1
+
+
+def test_ollama_setup_keeps_model_loaded_with_fixed_context(registry: LlmClientRegistry):
+    with OllamaStubServer() as server:
+        setup = {"MODEL_NAME": "llama3:8b", "OLLAMA_HOST": "127.0.0.1",
+                 "OLLAMA_PORT": int(server.base_url.rsplit(":", 1)[1]), "KEEP_ALIVE": "30m", "NUM_CTX": 8192}
+        registry.get_llm("LOCAL_DOCKER_OLLAMA_LLAMA3", setup).invoke("prompt")
+        assert server.request_bodies[0]["keep_alive"] == "30m"
+        assert server.request_bodies[0]["options"]["num_ctx"] == 8192
+
+
+def test_requests_are_spread_over_ollama_hosts_by_outstanding_requests():
+    with OllamaStubServer(delay=0.1) as first, OllamaStubServer(delay=0.1) as second:
+        router = OllamaRouter([first.base_url, second.base_url], health_check_interval=None)
+        llm = PooledOllama(model="llama3:8b", base_url=first.base_url, http_pool=HttpPool(), router=router)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            assert list(executor.map(llm.invoke, ["prompt"] * 4)) == ['{"error": []}'] * 4
+        assert (len(first.request_bodies), len(second.request_bodies)) == (2, 2)
+        stats = router.stats()
+        assert all(host["requests"] == 2 and host["outstanding"] == 0 for host in stats.values())
+        assert all(host["latency_p50"] >= 0.1 for host in stats.values())
+
+
+def test_failing_ollama_host_is_removed_and_readmitted_by_health_check():
+    with OllamaStubServer() as first, OllamaStubServer() as second:
+        router = OllamaRouter([first.base_url, second.base_url], unhealthy_after_failures=1,
+                              health_check_interval=None)
+        llm = PooledOllama(model="llama3:8b", base_url=first.base_url, http_pool=HttpPool(), router=router)
+        first.healthy = False
+        for _ in range(2):
+            try:
+                llm.invoke("prompt")
+            except ValueError:
+                pass
+        assert not router.stats()[first.base_url]["healthy"]
+        assert [llm.invoke("prompt") for _ in range(3)] == ['{"error": []}'] * 3
+        assert router.stats()[second.base_url]["requests"] >= 3
+
+        first.healthy = True
+        router.check_health()
+        assert router.stats()[first.base_url]["healthy"]
+        second.healthy = False
+        router.check_health()
+        assert not router.stats()[second.base_url]["healthy"]
+        assert asyncio.run(llm.ainvoke("prompt")) == '{"error": []}'
+
+
+def test_docker_setup_with_several_hosts_is_routed(registry: LlmClientRegistry):
+    with OllamaStubServer() as first, OllamaStubServer() as second:
+        setup = {"MODEL_NAME": "llama3:8b", "OLLAMA_HOSTS": [first.base_url, second.base_url],
+                 "HEALTH_CHECK_INTERVAL_SECONDS": 0.05}
+        llm = registry.get_llm("LOCAL_DOCKER_OLLAMA_LLAMA3", setup)
+        assert [llm.invoke("prompt") for _ in range(2)] == ['{"error": []}'] * 2
+        assert (len(first.request_bodies), len(second.request_bodies)) == (1, 1)
+        second.healthy = False
+        time.sleep(0.2)
+        assert registry.host_stats()[second.base_url]["healthy"] is False
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import pytest
+
+from services.evaluators import SummaryEvaluator, SummaryChainWrapper, MultiMetricSummaryChainWrapper
+from services.llm_tiers import TieredLlmCaller, LlmTier, LlmCallTimeoutError
+from services.scheduler import LlmScheduler
+from static.summary_example_text import afrikaans_OPENAI_summary_good
+from static.summary_metrics import evaluation_metrics
+from tests.services.fakes import FakeEvaluationLLM, registered_document
+
+
+def invoke_with_delay(llm: FakeEvaluationLLM) -> float:
+    time.sleep(llm.delay)
+    return llm.delay
+
+
+def test_slow_tier_falls_back_to_next_tier():
+    caller = TieredLlmCaller([LlmTier("primary", FakeEvaluationLLM(delay=1)),
+                              LlmTier("fallback", FakeEvaluationLLM(delay=0))], call_timeout=0.1)
+    started = time.time()
+    assert caller.call(invoke_with_delay) == (0, "fallback")
+    assert time.time() - started < 0.5
+    assert caller.stats()["primary"]["timeouts"] == 1
+
+
+def test_slow_call_is_hedged_to_next_tier():
+    primary, secondary = FakeEvaluationLLM(delay=0.01), FakeEvaluationLLM(delay=0.01)
+    caller = TieredLlmCaller([LlmTier("primary", primary), LlmTier("secondary", secondary)],
+                             call_timeout=5, hedge_percentile=90, hedge_min_samples=3)
+    for _ in range(3):
+        assert caller.call(invoke_with_delay)[1] == "primary"
+    assert caller.hedge_delay(0) == pytest.approx(0.01, abs=0.02)
+    primary.delay = 1
+    started = time.time()
+    assert caller.call(invoke_with_delay)[1] == "secondary"
+    assert time.time() - started < 0.5
+    stats = caller.stats()
+    assert (stats["primary"]["hedges"], stats["secondary"]["answered"]) == (1, 1)
+
+
+def test_async_call_hedges_and_cancels_the_slower_attempt():
+    primary, secondary = FakeEvaluationLLM(delay=0.01), FakeEvaluationLLM(delay=0.01)
+    caller = TieredLlmCaller([LlmTier("primary", primary), LlmTier("secondary", secondary)],
+                             hedge_percentile=50, hedge_min_samples=2)
+
+    async def ainvoke(llm: FakeEvaluationLLM) -> float:
+        await asyncio.sleep(llm.delay)
+        return llm.delay
+
+    async def run():
+        for _ in range(2):
+            await caller.acall(ainvoke)
+        primary.delay = 1
+        return await caller.acall(ainvoke)
+
+    started = time.time()
+    assert asyncio.run(run()) == (0.01, "secondary")
+    assert time.time() - started < 0.5
+
+
+def test_call_fails_when_no_tier_answers_before_deadline():
+    caller = TieredLlmCaller([LlmTier("primary", FakeEvaluationLLM(delay=1))])
+    with pytest.raises(LlmCallTimeoutError):
+        caller.call(invoke_with_delay, deadline=time.time() + 0.1)
+
+
+@pytest.mark.parametrize("chain_comps", [SummaryChainWrapper(), MultiMetricSummaryChainWrapper()])
+def test_summary_evaluation_records_the_tier_that_answered(chain_comps):
+    primary, fallback = FakeEvaluationLLM(delay=1), FakeEvaluationLLM()
+    tiers = TieredLlmCaller([LlmTier("primary", primary), LlmTier("fallback", fallback)], call_timeout=0.1)
+    evaluator = SummaryEvaluator(primary, chain_comps, *registered_document(), llm_tiers=tiers)
+    for evaluation in (evaluator.evaluate(afrikaans_OPENAI_summary_good),
+                       asyncio.run(evaluator.aevaluate(afrikaans_OPENAI_summary_good))):
+        assert all(item.score == 7 for item in evaluation.evaluations)
+        assert evaluation.answered_by == {eval_type: "fallback" for eval_type in evaluation_metrics}
+
+
+def test_multi_metric_streaming_falls_back_to_next_tier():
+    primary, fallback = FakeEvaluationLLM(delay=1), FakeEvaluationLLM()
+    tiers = TieredLlmCaller([LlmTier("primary", primary), LlmTier("fallback", fallback)], call_timeout=0.1)
+    evaluator = SummaryEvaluator(primary, MultiMetricSummaryChainWrapper(), *registered_document(), llm_tiers=tiers)
+
+    async def collect():
+        return [item async for item in evaluator.astream_evaluate(afrikaans_OPENAI_summary_good)]
+
+    started = time.time()
+    items = asyncio.run(collect())
+    assert time.time() - started < 0.5
+    assert [(item.metric, item.score) for item in items] == [(eval_type, 7) for eval_type in evaluation_metrics]
+    assert tiers.stats()["fallback"]["answered"] == 1
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["evaluate", "aevaluate"])
+def test_every_tier_is_scheduled_by_the_scheduler_of_its_setup(use_async: bool):
+    primary, fallback = FakeEvaluationLLM(failing_metrics=list(evaluation_metrics)), FakeEvaluationLLM()
+    primary_scheduler, fallback_scheduler = LlmScheduler(), LlmScheduler()
+    tiers = TieredLlmCaller([LlmTier("primary", primary), LlmTier("fallback", fallback, scheduler=fallback_scheduler)])
+    evaluator = SummaryEvaluator(primary, SummaryChainWrapper(scheduler=primary_scheduler), *registered_document(),
+                                 llm_tiers=tiers)
+    if use_async:
+        evaluation = asyncio.run(evaluator.aevaluate(afrikaans_OPENAI_summary_good))
+    else:
+        evaluation = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert evaluation.answered_by == {eval_type: "fallback" for eval_type in evaluation_metrics}
+    assert primary_scheduler.stats()["calls"] == len(evaluation_metrics)
+    assert fallback_scheduler.stats()["calls"] == len(evaluation_metrics)
+
+
+def test_evaluation_timeout_bounds_evaluation_latency():
+    evaluator = SummaryEvaluator(FakeEvaluationLLM(delay=1), SummaryChainWrapper(), *registered_document(),
+                                 max_concurrency=1, evaluation_timeout=0.1)
+    started = time.time()
+    evaluation = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert time.time() - started < 0.5
+    assert all(item.score is None for item in evaluation.evaluations)
+    assert evaluation.answered_by == {}
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from pydantic_models.evaluator import PreScoresItem
+from services.evaluators import SummaryEvaluator, SummaryChainWrapper, PRESCORING_TIER
+from services.prescoring import LexicalPreScorer
+from static.summary_example_text import afrikaans_OPENAI_doc, afrikaans_OPENAI_summary_good, \
+    afrikaans_OPENAI_summary_bad
+from static.summary_metrics import evaluation_metrics
+from tests.services.fakes import FakeEvaluationLLM, registered_document
+
+OFF_TOPIC_SUMMARY = "The weather in Cape Town was sunny and warm during the whole of last week."
+COPIED_SUMMARY = " ".join(afrikaans_OPENAI_doc.split()[:40])
+
+
+def test_score_batch_matches_scoring_one_summary_at_a_time():
+    prescorer = LexicalPreScorer()
+    summaries = [afrikaans_OPENAI_summary_good, "", afrikaans_OPENAI_summary_bad, OFF_TOPIC_SUMMARY, COPIED_SUMMARY]
+    batch = prescorer.score_batch(afrikaans_OPENAI_doc, summaries)
+    assert batch == [prescorer.score_batch(afrikaans_OPENAI_doc, [summary])[0] for summary in summaries]
+
+
+def test_score_batch_scores_overlap_and_copying():
+    good, copied, off_topic = LexicalPreScorer().score_batch(
+        afrikaans_OPENAI_doc, [afrikaans_OPENAI_summary_good, COPIED_SUMMARY, OFF_TOPIC_SUMMARY])
+    assert copied["copy_ratio"] == 1.0
+    assert copied["rouge2_precision"] == 1.0
+    assert good["copy_ratio"] < 0.5
+    assert off_topic["rouge1_precision"] < good["rouge1_precision"]
+    assert 0 < good["length_ratio"] < 1
+
+
+@pytest.mark.parametrize("summary, reason", [("", "truncated"), (COPIED_SUMMARY, "copied"),
+                                             (OFF_TOPIC_SUMMARY, "off-topic")])
+def test_gate(summary: str, reason: str):
+    prescorer = LexicalPreScorer()
+    assert reason in prescorer.gate(prescorer.score_batch(afrikaans_OPENAI_doc, [summary])[0])
+
+
+def test_gate_lets_summaries_through():
+    prescorer = LexicalPreScorer()
+    for pre_scores in prescorer.score_batch(afrikaans_OPENAI_doc,
+                                            [afrikaans_OPENAI_summary_good, afrikaans_OPENAI_summary_bad]):
+        assert prescorer.gate(pre_scores) is None
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["evaluate", "aevaluate"])
+def test_gated_summary_is_scored_without_llm(use_async: bool):
+    llm = FakeEvaluationLLM()
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), *registered_document(),
+                                 prescorer=LexicalPreScorer(gate_score=1))
+    if use_async:
+        evaluations = asyncio.run(evaluator.aevaluate(OFF_TOPIC_SUMMARY))
+    else:
+        evaluations = evaluator.evaluate(OFF_TOPIC_SUMMARY)
+    assert llm.prompts == []
+    assert [item.metric for item in evaluations.evaluations] == list(evaluation_metrics.keys())
+    assert {item.score for item in evaluations.evaluations} == {1}
+    assert set(evaluations.answered_by.values()) == {PRESCORING_TIER}
+    assert evaluations.pre_scores["rouge1_precision"] < 0.1
+
+
+def test_evaluate_many_only_sends_ungated_summaries_to_llm():
+    llm = FakeEvaluationLLM()
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), *registered_document(), prescorer=LexicalPreScorer())
+    good, copied, empty = evaluator.evaluate_many([afrikaans_OPENAI_summary_good, COPIED_SUMMARY, ""])
+    assert len(llm.prompts) == len(evaluation_metrics)
+    assert all(afrikaans_OPENAI_summary_good in prompt for prompt in llm.prompts)
+    assert {item.score for item in good.evaluations} == {llm.score}
+    assert good.pre_scores["rouge1_precision"] > 0.5
+    assert "copied" in copied.evaluations[0].reason
+    assert "truncated" in empty.evaluations[0].reason
+
+
+def test_astream_evaluate_yields_pre_scores_and_gated_items():
+    llm = FakeEvaluationLLM()
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), *registered_document(), prescorer=LexicalPreScorer())
+
+    async def collect(summary: str) -> list:
+        return [item async for item in evaluator.astream_evaluate(summary)]
+
+    pre_scores, *items = asyncio.run(collect(""))
+    assert pre_scores == PreScoresItem(pre_scores=evaluator.evaluate("").pre_scores)
+    assert [item.metric for item in items] == list(evaluation_metrics.keys())
+    assert llm.prompts == []
+    # the pre-scores come first also when the summary is scored by the LLM
+    pre_scores, *items = asyncio.run(collect(afrikaans_OPENAI_summary_good))
+    assert pre_scores.pre_scores["rouge1_precision"] > 0.5
+    assert [item.score for item in items] == [llm.score] * len(evaluation_metrics)
@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+import requests
+
+from services import scheduler as scheduler_module
+from services.evaluators import SummaryEvaluator, SummaryChainWrapper
+from services.llm_clients import PooledOllama, HttpPool
+from services.scheduler import LlmScheduler, get_llm_scheduler, is_overload_error
+from static.summary_example_text import afrikaans_OPENAI_summary_good
+from tests.services.fakes import FakeEvaluationLLM, registered_document
+from tests.services.ollama_stub import OllamaStubServer
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def test_requests_per_minute_budget_delays_calls(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "WINDOW_SECONDS", 0.3)
+    scheduler = LlmScheduler(requests_per_minute=2, initial_concurrency=4)
+    started = time.time()
+    for _ in range(3):
+        with scheduler.slot(prompt_tokens=10):
+            pass
+    assert time.time() - started >= 0.25
+    assert scheduler.stats()["waits"] == 1
+
+
+def test_tokens_per_minute_budget_uses_actual_completion_tokens(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "WINDOW_SECONDS", 0.3)
+    scheduler = LlmScheduler(tokens_per_minute=100, expected_completion_tokens=40)
+    with scheduler.slot(prompt_tokens=10) as call:
+        call.completion_tokens = 5
+    assert scheduler.stats()["tokens_in_window"] == 15
+    started = time.time()
+    # 15 + 50 fits without waiting, while 50 more do not
+    with scheduler.slot(prompt_tokens=10):
+        pass
+    assert time.time() - started < 0.1
+    with scheduler.slot(prompt_tokens=10):
+        pass
+    assert time.time() - started >= 0.2
+
+
+def test_overload_halves_and_success_increases_concurrency_limit():
+    scheduler = LlmScheduler(initial_concurrency=8, min_concurrency=1, decrease_cooldown=0)
+    with pytest.raises(RateLimitError):
+        with scheduler.slot(prompt_tokens=10):
+            raise RateLimitError("Error code: 429 - rate limit reached")
+    assert scheduler.stats()["concurrency_limit"] == 4
+    with scheduler.slot(prompt_tokens=10):
+        pass
+    assert scheduler.stats()["concurrency_limit"] == pytest.approx(4.25)
+    assert scheduler.stats()["overloads"] == 1
+
+
+def test_decreases_are_rate_limited_by_cooldown():
+    scheduler = LlmScheduler(initial_concurrency=8, decrease_cooldown=60)
+    for _ in range(3):
+        with pytest.raises(asyncio.TimeoutError):
+            with scheduler.slot(prompt_tokens=10):
+                raise asyncio.TimeoutError()
+    assert scheduler.stats()["concurrency_limit"] == 4
+
+
+def test_slow_calls_decrease_concurrency_limit():
+    scheduler = LlmScheduler(initial_concurrency=4, target_latency=0.01, decrease_cooldown=0)
+    with scheduler.slot(prompt_tokens=10):
+        time.sleep(0.03)
+    stats = scheduler.stats()
+    assert (stats["concurrency_limit"], stats["slow_calls"]) == (2, 1)
+
+
+def test_other_errors_are_not_overloads():
+    response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    assert is_overload_error(openai.RateLimitError("rate limit reached", response=response, body=None))
+    assert is_overload_error(httpx.ReadTimeout("timed out"))
+    assert is_overload_error(RateLimitError("rate limit reached"))
+    assert is_overload_error(requests.exceptions.ReadTimeout("timed out"))
+    assert not is_overload_error(ValueError("unparsable response"))
+    # a 429 in the message, e.g. of a parsed number, is no rate limit
+    assert not is_overload_error(ValueError("Expected 4290 tokens, got 429"))
+
+
+def test_unavailable_ollama_decreases_concurrency_limit():
+    scheduler = LlmScheduler(initial_concurrency=8, decrease_cooldown=0)
+    with OllamaStubServer() as server:
+        server.healthy = False
+        llm = PooledOllama(model="llama3:8b", base_url=server.base_url, http_pool=HttpPool())
+        with pytest.raises(ValueError, match="503"):
+            with scheduler.slot(prompt_tokens=10):
+                llm.invoke("prompt")
+
+        async def ainvoke():
+            async with scheduler.aslot(prompt_tokens=10):
+                await llm.ainvoke("prompt")
+
+        with pytest.raises(ValueError, match="503"):
+            asyncio.run(ainvoke())
+    stats = scheduler.stats()
+    assert (stats["concurrency_limit"], stats["overloads"]) == (2, 2)
+
+
+def test_scheduler_bounds_concurrent_llm_calls_of_evaluator():
+    llm = FakeEvaluationLLM(delay=0.05)
+    scheduler = LlmScheduler(initial_concurrency=2, max_concurrency=2)
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(scheduler=scheduler), *registered_document(),
+                                 max_concurrency=8)
+    evaluation = asyncio.run(evaluator.aevaluate(afrikaans_OPENAI_summary_good))
+    assert all(item.score == 7 for item in evaluation.evaluations)
+    assert llm.max_in_flight == 2
+    stats = scheduler.stats()
+    assert stats["calls"] == len(evaluation.evaluations)
+    assert stats["in_flight"] == 0
+
+
+def test_get_llm_scheduler_is_shared_and_optional():
+    params = {"REQUESTS_PER_MINUTE": 10, "INITIAL_CONCURRENCY": 2}
+    assert get_llm_scheduler("SETUP", params) is get_llm_scheduler("SETUP", dict(params))
+    assert get_llm_scheduler("SETUP", {}) is None
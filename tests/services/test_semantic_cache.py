@@ -0,0 +1,129 @@
+import asyncio
+
+from pydantic_models.evaluator import SummaryEvaluations, SummaryEvaluationItem
+from services.evaluators import SummaryEvaluator, SummaryChainWrapper, NativeSummaryChainWrapper, \
+    MultiMetricSummaryChainWrapper, GrammaticalEvaluator, GrammaticalErrorsChainWrapper, \
+    BatchGrammaticalErrorsChainWrapper, SEMANTIC_CACHE_TIER
+from services.semantic_cache import SemanticResultCache, hashed_ngram_vector, changes_within
+from static.summary_example_text import afrikaans_OPENAI_summary_good, afrikaans_OPENAI_summary_bad
+from static.summary_metrics import evaluation_metrics, CONSISTENCY
+from tests.services.fakes import FakeEvaluationLLM, registered_document, METRIC_NAME_PATTERN
+
+# the good summary resubmitted with a typo
+RESUBMITTED_SUMMARY = afrikaans_OPENAI_summary_good.replace("toonaangewende", "toonaangewend")
+
+
+def _summary_evaluator(llm: FakeEvaluationLLM, semantic_cache: SemanticResultCache,
+                       chain_comps_class=SummaryChainWrapper) -> SummaryEvaluator:
+    evaluator = SummaryEvaluator(llm, chain_comps_class(), *registered_document())
+    evaluator.set_semantic_cache(semantic_cache)
+    return evaluator
+
+
+def test_near_duplicates_have_similar_vectors():
+    vector = hashed_ngram_vector(afrikaans_OPENAI_summary_good)
+    assert float(vector @ hashed_ngram_vector(RESUBMITTED_SUMMARY)) > 0.95
+    assert float(vector @ hashed_ngram_vector(afrikaans_OPENAI_summary_bad)) < 0.5
+
+
+def test_changes_within():
+    assert changes_within("She buyed apples.", "She bought apples.", [(4, 9)])
+    assert not changes_within("She buyed apples.", "He buyed apples.", [(4, 9)])
+
+
+def test_near_duplicate_summary_reuses_evaluation_but_consistency():
+    llm = FakeEvaluationLLM()
+    semantic_cache = SemanticResultCache(threshold=0.95)
+    evaluator = _summary_evaluator(llm, semantic_cache)
+    evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    llm.score = 3
+    evaluations = evaluator.evaluate(RESUBMITTED_SUMMARY)
+    # the consistency of a changed summary is scored again
+    assert [METRIC_NAME_PATTERN.findall(prompt) for prompt in llm.prompts[len(evaluation_metrics):]] == [[CONSISTENCY]]
+    assert {item.metric: item.score for item in evaluations.evaluations} == \
+        {metric: 3 if metric == CONSISTENCY else 7 for metric in evaluation_metrics}
+    assert evaluations.answered_by == {metric: SEMANTIC_CACHE_TIER for metric in evaluation_metrics
+                                       if metric != CONSISTENCY}
+    # an identical summary, up to case and whitespace, reuses the whole evaluation
+    evaluator.evaluate(f"  {afrikaans_OPENAI_summary_good.upper()} ")
+    assert len(llm.prompts) == len(evaluation_metrics) + 1
+    evaluator.evaluate(afrikaans_OPENAI_summary_bad)
+    assert len(llm.prompts) == 2 * len(evaluation_metrics) + 1
+    assert semantic_cache.stats()["hits"] == 2
+
+
+def test_multi_metric_summary_reuses_only_identical_evaluation():
+    llm = FakeEvaluationLLM()
+    semantic_cache = SemanticResultCache(threshold=0.95)
+    evaluator = _summary_evaluator(llm, semantic_cache, MultiMetricSummaryChainWrapper)
+    evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    evaluator.evaluate(afrikaans_OPENAI_summary_good + "\n")
+    assert len(llm.prompts) == 1
+    evaluator.evaluate(RESUBMITTED_SUMMARY)
+    assert len(llm.prompts) == 2
+    assert semantic_cache.stats()["rejections"] == 1
+
+
+def test_candidates_are_accepted_outside_of_the_cache_lock():
+    semantic_cache = SemanticResultCache(threshold=0.9)
+    semantic_cache.put("summary", "document", "v1", afrikaans_OPENAI_summary_good, SummaryEvaluations(
+        evaluations=[SummaryEvaluationItem(metric=metric, score=7, reason="Fine") for metric in evaluation_metrics]))
+
+    def accept(cached_text, result) -> bool:
+        # another evaluation storing its result meanwhile must not wait for the decision
+        semantic_cache.put("summary", "document", "v1", afrikaans_OPENAI_summary_bad, result)
+        return True
+
+    assert semantic_cache.get("summary", "document", "v1", RESUBMITTED_SUMMARY, accept=accept) is not None
+    assert semantic_cache.stats()["entries"] == 2
+
+
+def test_streamed_summary_evaluation_is_cached():
+    llm = FakeEvaluationLLM()
+    evaluator = _summary_evaluator(llm, SemanticResultCache())
+
+    async def stream(text: str):
+        return [item async for item in evaluator.astream_evaluate(text)]
+
+    asyncio.run(stream(afrikaans_OPENAI_summary_good))
+    items = asyncio.run(stream(RESUBMITTED_SUMMARY))
+    assert [item.metric for item in items] == list(evaluation_metrics)
+    assert len(llm.prompts) == len(evaluation_metrics) + 1
+
+
+def test_invalidation_by_document_and_model_version():
+    llm = FakeEvaluationLLM()
+    semantic_cache = SemanticResultCache()
+    evaluator = _summary_evaluator(llm, semantic_cache)
+    evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    documents, document_id = registered_document()
+    assert semantic_cache.invalidate(document_id=document_id) == 1
+    evaluator.evaluate(RESUBMITTED_SUMMARY)
+    assert len(llm.prompts) == 2 * len(evaluation_metrics)
+
+    model_version = evaluator.model_version()
+    evaluator.set_chain_comps(NativeSummaryChainWrapper())
+    assert evaluator.model_version() != model_version
+    evaluator.evaluate(RESUBMITTED_SUMMARY)
+    assert len(llm.prompts) == 3 * len(evaluation_metrics)
+    assert semantic_cache.invalidate(model_version=model_version) == 1
+    assert semantic_cache.stats()["model_versions"] == [evaluator.model_version()]
+
+
+def test_grammar_errors_are_reused_only_for_fixed_errors():
+    llm = FakeEvaluationLLM(grammar_errors={"buyed": "bought", "goed": "went"})
+    evaluator = GrammaticalEvaluator(llm, GrammaticalErrorsChainWrapper(), BatchGrammaticalErrorsChainWrapper())
+    evaluator.set_semantic_cache(SemanticResultCache(), threshold=0.8)
+    evaluator.evaluate("Yesterday she goed to the market and buyed apples.")
+    errors = evaluator.evaluate("Yesterday she goed to the market and bought apples.")
+    assert [item.error for item in errors.error] == ["goed"]
+    assert len(llm.prompts) == 1
+    evaluator.evaluate("Yesterday he goed to the market and buyed apples.")
+    assert len(llm.prompts) == 2
+
+    # reuses the errors of the first text, which only differs in the error fixed
+    errors_per_text = evaluator.evaluate_many(["It is sunny today.",
+                                               "Yesterday she went to the market and buyed apples."])
+    assert [[(item.error, item.sentence_index, item.start) for item in errors.error]
+            for errors in errors_per_text] == [[], [("buyed", 1, 37)]]
+    assert len(llm.prompts) == 3
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from langchain_community.chat_models import ChatOpenAI
+from langchain_community.llms import Ollama
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import AIMessage
+
+from pydantic_models.evaluator import Errors, SummaryEvaluationItem
+from services.evaluators import SummaryEvaluator, SummaryChainWrapper, NativeSummaryChainWrapper, \
+    GrammaticalEvaluator, NativeGrammaticalErrorsChainWrapper, NativeBatchGrammaticalErrorsChainWrapper
+from services.structured_output import repair_json, response_text, bind_structured_output, NativeOutputParser
+from services.tokens import count_tokens
+from static.summary_example_text import afrikaans_OPENAI_summary_good
+from static.summary_metrics import evaluation_metrics
+from tests.services.fakes import FakeEvaluationLLM, registered_document
+
+
+class MalformedJsonLLM(FakeEvaluationLLM):
+    """Answers like FakeEvaluationLLM, but in a code fence, with single quotes and a trailing comma"""
+
+    def _respond(self, prompt: str) -> str:
+        response = super()._respond(prompt).replace('"', "'")
+        return f"Here is the evaluation:\n```json\n{response[:-1]},}}\n```"
+
+
+@pytest.mark.parametrize("response, expected", [
+    ('```json\n{"score": 7, "reason": "ok",}\n```', {"score": 7, "reason": "ok"}),
+    ("Sure: {'score': 7, 'reason': 'It's fine'} Hope this helps", {"score": 7, "reason": "It's fine"}),
+    ('{score: 7, reason: "He said "hi" there", metric: None}', {"score": 7, "reason": 'He said "hi" there',
+                                                              "metric": None}),
+    ('{"error": [{"error": "buyed", "correction": "bought"}, {"error": "are", "corr',
+     {"error": [{"error": "buyed", "correction": "bought"}, {"error": "are"}]}),
+    ('{"reason": "line\nbreak", "score": ', {"reason": "line\nbreak", "score": None}),
+])
+def test_repair_json(response: str, expected: dict):
+    assert repair_json(response) == expected
+
+
+def test_repair_json_without_json_fails():
+    with pytest.raises(ValueError):
+        repair_json("I cannot evaluate this summary.")
+
+
+def test_native_output_parser():
+    parser = NativeOutputParser(pydantic_object=Errors)
+    assert parser.parse('[{"error": "buyed", "correction": "bought"}]') == Errors.parse_obj(
+        {"error": [{"error": "buyed", "correction": "bought"}]})
+    with pytest.raises(OutputParserException):
+        NativeOutputParser(pydantic_object=SummaryEvaluationItem).parse('{"score": "very good"}')
+
+
+def test_response_text_of_tool_call():
+    message = AIMessage(content="", additional_kwargs={"tool_calls": [
+        {"id": "call", "type": "function", "function": {"name": "Errors", "arguments": '{"error": []}'}}]})
+    assert response_text(message) == '{"error": []}'
+
+
+def test_bind_structured_output(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    openai_llm = bind_structured_output(ChatOpenAI(), SummaryEvaluationItem)
+    assert openai_llm.kwargs["tool_choice"]["function"]["name"] == "SummaryEvaluationItem"
+    parameters = openai_llm.kwargs["tools"][0]["function"]["parameters"]
+    assert set(parameters["properties"]) == {"metric", "score", "reason"}
+    assert bind_structured_output(Ollama(model="llama3:8b"), Errors).kwargs == {"format": "json"}
+    fake_llm = FakeEvaluationLLM()
+    assert bind_structured_output(fake_llm, Errors) is fake_llm
+
+
+def test_native_prompt_is_shorter():
+    inputs = dict(criteria="", document="", metric_name="Relevance", steps="", summary="")
+    assert count_tokens(NativeSummaryChainWrapper().prompt_template.format(**inputs)) < \
+           count_tokens(SummaryChainWrapper().prompt_template.format(**inputs)) - 100
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["evaluate", "aevaluate"])
+def test_native_summary_evaluation_repairs_output_without_retries(use_async: bool):
+    llm = MalformedJsonLLM()
+    evaluator = SummaryEvaluator(llm, NativeSummaryChainWrapper(), *registered_document())
+    if use_async:
+        evaluations = asyncio.run(evaluator.aevaluate(afrikaans_OPENAI_summary_good))
+    else:
+        evaluations = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert [(item.metric, item.score) for item in evaluations.evaluations] == [
+        (eval_type, llm.score) for eval_type in evaluation_metrics]
+    assert len(llm.prompts) == len(evaluation_metrics)
+
+
+def test_native_grammatical_evaluation():
+    llm = MalformedJsonLLM(grammar_errors={"buyed": "bought"})
+    evaluator = GrammaticalEvaluator(llm, NativeGrammaticalErrorsChainWrapper(),
+                                     NativeBatchGrammaticalErrorsChainWrapper())
+    assert [item.correction for item in evaluator.evaluate("She buyed apples.").error] == ["bought"]
+    errors_per_text = evaluator.evaluate_many(["It is sunny.", "She buyed apples."])
+    assert [[item.sentence_index for item in errors.error] for errors in errors_per_text] == [[], [1]]
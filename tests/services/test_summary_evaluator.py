@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+import pytest
+
+from pydantic_models.evaluator import SummaryEvaluations
+from services.evaluators import SummaryEvaluator, SummaryChainWrapper, SchemaSummaryChainWrapper, \
+    MultiMetricSummaryChainWrapper
+from static.summary_example_text import afrikaans_OPENAI_doc, afrikaans_OPENAI_summary_good
+from static.summary_metrics import evaluation_metrics, CONSISTENCY, RELEVANCE, FLUENCY
+from tests.services.fakes import FakeEvaluationLLM, registered_document, METRIC_NAME_PATTERN
+
+DELAY = 0.2
+
+
+@pytest.fixture(params=[SummaryChainWrapper, SchemaSummaryChainWrapper, MultiMetricSummaryChainWrapper],
+                ids=["model", "schema", "multi_metric"])
+def chain_comps(request):
+    return request.param()
+
+
+def test_evaluate_concurrently_keeps_metric_order(chain_comps):
+    llm = FakeEvaluationLLM(delay=DELAY)
+    evaluator = SummaryEvaluator(llm, chain_comps, *registered_document())
+    start = time.perf_counter()
+    evaluations: SummaryEvaluations = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    elapsed = time.perf_counter() - start
+    assert [item.metric for item in evaluations.evaluations] == list(evaluation_metrics.keys())
+    assert elapsed < DELAY * 2
+
+
+def test_evaluate_sequentially_with_max_concurrency_one(chain_comps):
+    llm = FakeEvaluationLLM()
+    evaluator = SummaryEvaluator(llm, chain_comps, *registered_document(), max_concurrency=1)
+    evaluations: SummaryEvaluations = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert [item.metric for item in evaluations.evaluations] == list(evaluation_metrics.keys())
+    assert llm.max_in_flight == 1
+
+
+def test_aevaluate_runs_all_metrics_at_once(chain_comps):
+    llm = FakeEvaluationLLM(delay=DELAY)
+    evaluator = SummaryEvaluator(llm, chain_comps, *registered_document())
+    start = time.perf_counter()
+    evaluations: SummaryEvaluations = asyncio.run(evaluator.aevaluate(afrikaans_OPENAI_summary_good))
+    elapsed = time.perf_counter() - start
+    assert [item.metric for item in evaluations.evaluations] == list(evaluation_metrics.keys())
+    assert elapsed < DELAY * 2
+
+
+@pytest.mark.parametrize("chain_comps_class", [SummaryChainWrapper, SchemaSummaryChainWrapper], ids=["model", "schema"])
+@pytest.mark.parametrize("use_async", [False, True], ids=["evaluate", "aevaluate"])
+def test_failing_metric_is_isolated(chain_comps_class, use_async: bool):
+    llm = FakeEvaluationLLM(failing_metrics=[CONSISTENCY])
+    evaluator = SummaryEvaluator(llm, chain_comps_class(), *registered_document())
+    if use_async:
+        evaluations = asyncio.run(evaluator.aevaluate(afrikaans_OPENAI_summary_good))
+    else:
+        evaluations = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    by_metric = {item.metric: item for item in evaluations.evaluations}
+    assert len(evaluations.evaluations) == len(evaluation_metrics)
+    assert by_metric[CONSISTENCY].score is None
+    assert all(item.score == llm.score for metric, item in by_metric.items() if metric != CONSISTENCY)
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["evaluate", "aevaluate"])
+def test_multi_metric_scores_all_metrics_in_one_call(use_async: bool):
+    llm = FakeEvaluationLLM()
+    evaluator = SummaryEvaluator(llm, MultiMetricSummaryChainWrapper(), *registered_document())
+    if use_async:
+        evaluations = asyncio.run(evaluator.aevaluate(afrikaans_OPENAI_summary_good))
+    else:
+        evaluations = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert len(llm.prompts) == 1
+    assert llm.prompts[0].count(afrikaans_OPENAI_doc) == 1
+    assert [item.metric for item in evaluations.evaluations] == list(evaluation_metrics.keys())
+    assert all(item.score == llm.score for item in evaluations.evaluations)
+
+
+async def _collect(async_iterator) -> list:
+    return [item async for item in async_iterator]
+
+
+def test_astream_evaluate_yields_each_metric_when_finished(chain_comps):
+    llm = FakeEvaluationLLM()
+    evaluator = SummaryEvaluator(llm, chain_comps, *registered_document())
+    items = asyncio.run(_collect(evaluator.astream_evaluate(afrikaans_OPENAI_summary_good)))
+    assert sorted(item.metric for item in items) == sorted(evaluation_metrics.keys())
+    assert all(item.score == llm.score for item in items)
+
+
+def long_document(paragraphs: int = 3) -> str:
+    return "\n".join(f"Paragraaf {index}: " + " ".join(f"Sin {sentence} van paragraaf {index}." for sentence in range(20))
+                     for index in range(paragraphs))
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["evaluate", "aevaluate"])
+def test_long_document_is_evaluated_per_excerpt_and_reduced(use_async: bool):
+    llm = FakeEvaluationLLM(scores_by_marker={"Excerpt 1 of": 3})
+    documents, document_id = registered_document(long_document())
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), documents, document_id, long_document_tokens=100,
+                                 chunk_tokens=100, chunk_overlap_tokens=10)
+    if use_async:
+        evaluations = asyncio.run(evaluator.aevaluate(afrikaans_OPENAI_summary_good))
+    else:
+        evaluations = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    excerpts = [prompt for prompt in llm.prompts if METRIC_NAME_PATTERN.findall(prompt) == [RELEVANCE]]
+    assert len(excerpts) > 2
+    assert all(len(prompt) < len(llm.prompts[0]) + 1000 for prompt in llm.prompts)
+    by_metric = {item.metric: item for item in evaluations.evaluations}
+    assert [item.metric for item in evaluations.evaluations] == list(evaluation_metrics.keys())
+    # consistency takes the best excerpt, relevance the mean, the other metrics only see the first excerpt
+    assert by_metric[CONSISTENCY].score == 7
+    assert 3 < by_metric[RELEVANCE].score < 7
+    assert by_metric[FLUENCY].score == 3
+    assert len(llm.prompts) == 2 * len(excerpts) + 2
+
+
+def test_long_document_multi_metric_evaluation_is_reduced():
+    llm = FakeEvaluationLLM(scores_by_marker={"Excerpt 1 of": 3})
+    documents, document_id = registered_document(long_document())
+    evaluator = SummaryEvaluator(llm, MultiMetricSummaryChainWrapper(), documents, document_id,
+                                 long_document_tokens=100, chunk_tokens=100)
+    evaluations = evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert len(llm.prompts) > 2
+    assert [item.score for item in evaluations.evaluations if item.metric == CONSISTENCY] == [7]
+    assert all(item.score is not None for item in evaluations.evaluations)
+
+
+def test_short_document_is_not_split():
+    llm = FakeEvaluationLLM()
+    evaluator = SummaryEvaluator(llm, SummaryChainWrapper(), *registered_document(), long_document_tokens=10 ** 6)
+    evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    assert len(llm.prompts) == len(evaluation_metrics)
+    assert not any("Excerpt" in prompt for prompt in llm.prompts)
+
+
+@pytest.mark.parametrize("chain_comps_class", [SummaryChainWrapper, MultiMetricSummaryChainWrapper],
+                         ids=["model", "multi_metric"])
+def test_prompts_of_a_document_share_their_prefix(chain_comps_class):
+    llm = FakeEvaluationLLM()
+    evaluator = SummaryEvaluator(llm, chain_comps_class(), *registered_document())
+    evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    evaluator.evaluate("Die artikel gaan oor iets anders.")
+    document_end = afrikaans_OPENAI_doc.strip()[-100:]
+    # everything up to the end of the source text is identical, so backends can reuse the cached prefix
+    assert len({prompt[:prompt.index(document_end)] for prompt in llm.prompts}) == 1
@@ -0,0 +1,85 @@
+from app.models.pydantic.sessions import RecordingType
+from services.evaluators import SummaryEvaluator, SummaryChainWrapper, GrammaticalEvaluator, \
+    GrammaticalErrorsChainWrapper, BatchGrammaticalErrorsChainWrapper
+from services.evaluators_factory import prompt_compaction_report
+from services.llm_cache import LlmResponseCache
+from services.prompt_compaction import compact_text, compact_prompt_template
+from services.token_accounting import TokenAccountant, get_token_accountant
+from static.summary_example_text import afrikaans_OPENAI_summary_good
+from static.summary_metrics import evaluation_metrics
+from tests.services.fakes import FakeEvaluationLLM, registered_document
+
+
+def test_compact_text():
+    text = """
+        Instructions:
+
+            1. Read the   summary carefully and score it.
+
+
+            Summary:
+            {summary}   	
+            Done.
+        """
+    assert compact_text(text) == "Instructions:\n1. Read the summary carefully and score it.\n\n" \
+                                 "Summary:\n{summary}\nDone."
+
+
+def test_compact_prompt_template_keeps_input_variables():
+    wrapper = SummaryChainWrapper(compact_prompts=False)
+    compact = compact_prompt_template(wrapper.prompt_template)
+    assert set(compact.input_variables) == set(wrapper.prompt_template.input_variables)
+    inputs = {name: "" for name in compact.input_variables}
+    assert len(compact.format(**inputs)) < len(wrapper.prompt_template.format(**inputs))
+
+
+def test_accountant_records_tokens_per_metric():
+    accountant = TokenAccountant()
+    chain_wrapper = SummaryChainWrapper(cache=LlmResponseCache(), accountant=accountant)
+    evaluator = SummaryEvaluator(FakeEvaluationLLM(), chain_wrapper, *registered_document())
+    evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    evaluator.evaluate(afrikaans_OPENAI_summary_good)
+    stats = accountant.stats()[RecordingType.COMPREHENSION]
+    assert set(stats) == set(evaluation_metrics)
+    for metric_stats in stats.values():
+        assert (metric_stats["invocations"], metric_stats["cached_invocations"]) == (2, 1)
+        assert metric_stats["prompt_tokens"] > 0 and metric_stats["completion_tokens"] > 0
+        assert metric_stats["saved_prompt_tokens"] > 0
+    accountant.clear()
+    assert accountant.stats() == {}
+
+
+def test_saved_prompt_tokens_are_computed_once_per_template():
+    accountant = TokenAccountant()
+    chain_wrapper = SummaryChainWrapper(accountant=accountant)
+    assert chain_wrapper.compaction_saved_tokens > 0
+    # the uncompacted template is not rendered per invocation
+    chain_wrapper.original_prompt_template = None
+    SummaryEvaluator(FakeEvaluationLLM(), chain_wrapper, *registered_document()).evaluate(
+        afrikaans_OPENAI_summary_good)
+    for metric_stats in accountant.stats()[RecordingType.COMPREHENSION].values():
+        assert metric_stats["saved_prompt_tokens"] == chain_wrapper.compaction_saved_tokens
+
+
+def test_accountant_records_grammar_tokens():
+    accountant = TokenAccountant()
+    evaluator = GrammaticalEvaluator(FakeEvaluationLLM(grammar_errors={"buyed": "bought"}),
+                                     GrammaticalErrorsChainWrapper(accountant=accountant),
+                                     BatchGrammaticalErrorsChainWrapper(accountant=accountant))
+    evaluator.evaluate("She buyed apples.")
+    evaluator.evaluate_many(["It is sunny.", "She buyed apples."])
+    stats = accountant.stats()[RecordingType.LANGUAGE_PRODUCTION]
+    assert (stats["grammar"]["invocations"], stats["grammar_batch"]["invocations"]) == (1, 1)
+    assert stats["grammar"]["original_prompt_tokens"] >= stats["grammar"]["prompt_tokens"]
+
+
+def test_get_token_accountant():
+    assert get_token_accountant({}) is None
+    assert get_token_accountant({"ENABLED": True}) is get_token_accountant({"ENABLED": True})
+
+
+def test_prompt_compaction_report():
+    report = prompt_compaction_report()
+    assert prompt_compaction_report() is report
+    assert all(entry["compact_tokens"] <= entry["original_tokens"] for entry in report.values())
+    assert report["SummaryChainWrapper"]["saved_tokens"] > 0